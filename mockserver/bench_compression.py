@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark response compression of CustomersV3 pages.
+
+Loads N synthetic customers into the in-process mock server and requests
+pages of several sizes with each Content-Encoding the server offers, plus
+identity. Every page is requested twice per codec: once uncached (a $skip
+no earlier request used, so the page is queried, serialized and compressed)
+and once more from the response cache, where the compressed copy is reused.
+Pages of at least odata.stream_threshold entities are streamed and compressed
+on the fly, so they are never cached.
+Reports bytes on the wire, CPU time per request and the time the body would
+take to transfer at a given bandwidth.
+
+Usage:
+    python bench_compression.py [--rows 100000] [--pages 100,1000,5000] [--requests 20] [--bandwidth-mbps 100]
+"""
+
+import argparse
+import json
+import random
+import time
+
+import mock_server
+from seed_data import generate_customers, merge_profile
+
+
+def measure(client, url, encoding, requests):
+    """Return (bytes, CPU ms) per request for GETs of url with an Accept-Encoding"""
+    size = 0
+    started = time.process_time()
+    for number in range(requests):
+        response = client.get(url(number), headers={"Accept-Encoding": encoding})
+        assert response.status_code == 200
+        assert response.headers.get("Content-Encoding", "identity") == encoding
+        size += len(response.get_data())
+    return size // requests, (time.process_time() - started) * 1000 / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000, help="customers to load")
+    parser.add_argument("--pages", default="100,1000,5000", help="comma separated $top values")
+    parser.add_argument("--requests", type=int, default=20, help="requests per page size, codec and mode")
+    parser.add_argument("--bandwidth-mbps", type=float, default=100, help="link speed for the transfer estimate")
+    args = parser.parse_args()
+
+    mock_server.customers.bulk_load(generate_customers(args.rows, random.Random(42), merge_profile()))
+    client = mock_server.app.test_client()
+    encodings = ["identity", *mock_server.content_encoder.codecs]
+    base = "/CustomersV3?cross-company=true&$select=CustomerAccount,OrganizationName,CreditLimit,CustomerGroupId"
+    results = []
+    print(f"{'top':>6} {'encoding':>9} {'bytes':>10} {'ratio':>6} {'uncached ms':>12} {'cached ms':>10} "
+          f"{'transfer ms':>12}")
+    skip = 0
+    for top in (int(value) for value in args.pages.split(",")):
+        identity_bytes = None
+        for encoding in encodings:
+            # Uncached: each request reads a page no earlier request has
+            first = skip
+            skip += args.requests
+
+            def uncached(number):
+                return f"{base}&$top={top}&$skip={first + number}"
+
+            size, uncached_ms = measure(client, uncached, encoding, args.requests)
+            streamed = top >= mock_server.STREAM_THRESHOLD
+            cached_ms = None
+            if not streamed:
+                _, cached_ms = measure(client, lambda number: f"{base}&$top={top}&$skip={first}", encoding,
+                                          args.requests)
+            identity_bytes = identity_bytes or size
+            transfer_ms = size * 8 / (args.bandwidth_mbps * 1000)
+            results.append({"top": top, "encoding": encoding, "bytes": size,
+                            "ratio": round(identity_bytes / size, 1),
+                            "uncached_cpu_ms": round(uncached_ms, 2),
+                            "cached_cpu_ms": None if streamed else round(cached_ms, 2),
+                            "transfer_ms": round(transfer_ms, 2)})
+            cached = "streamed" if streamed else f"{cached_ms:.2f}"
+            print(f"{top:>6} {encoding:>9} {size:>10} {identity_bytes / size:>6.1f} {uncached_ms:>12.2f} "
+                  f"{cached:>10} {transfer_ms:>12.2f}")
+    print(json.dumps({"bandwidth_mbps": args.bandwidth_mbps, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Benchmark unconditional vs conditional (If-None-Match) GET requests.
+
+Loads N synthetic customers into the in-process mock server, then fetches
+the same page repeatedly, once downloading it every time and once
+revalidating a cached copy with its ETag. Reports mean latency and bytes
+transferred per request, i.e. what a client-side cache saves when the data
+has not changed.
+
+Usage:
+    python bench_conditional.py [--rows 100000] [--pages 100,1000,10000] [--repeat 50]
+"""
+
+import argparse
+import json
+import random
+import time
+
+import mock_server
+from seed_data import generate_customers, merge_profile
+
+
+def fetch(client, url, repeat, headers=None):
+    """Request url repeat times, returning (mean ms, bytes per response, status)"""
+    size = 0
+    status = None
+    started = time.perf_counter()
+    for _ in range(repeat):
+        response = client.get(url, headers=headers or {})
+        size = len(response.get_data())
+        status = response.status_code
+    return (time.perf_counter() - started) * 1000 / repeat, size, status
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100000, help="customers to load")
+    parser.add_argument("--pages", default="100,1000,10000", help="comma separated page sizes ($top)")
+    parser.add_argument("--repeat", type=int, default=50, help="requests per measurement")
+    args = parser.parse_args()
+
+    mock_server.customers.clear()
+    mock_server.customers.bulk_load(generate_customers(args.rows, random.Random(42), merge_profile()))
+    mock_server.MAX_PAGE_SIZE = max(mock_server.MAX_PAGE_SIZE, args.rows)
+    client = mock_server.app.test_client()
+
+    results = []
+    for top in (int(page) for page in args.pages.split(",")):
+        url = f"/CustomersV3?$top={top}"
+        etag = client.get(url).headers["ETag"]
+        full_ms, full_bytes, _ = fetch(client, url, args.repeat)
+        cached_ms, cached_bytes, status = fetch(client, url, args.repeat, {"If-None-Match": etag})
+        result = {
+            "rows": top,
+            "full_ms": round(full_ms, 3),
+            "full_bytes": full_bytes,
+            "revalidated_ms": round(cached_ms, 3),
+            "revalidated_bytes": cached_bytes,
+            "revalidated_status": status
+        }
+        results.append(result)
+        print(f"{top:>7} rows  full {full_ms:>9.3f} ms {full_bytes:>10} B  "
+              f"revalidated ({status}) {cached_ms:>7.3f} ms {cached_bytes:>4} B")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
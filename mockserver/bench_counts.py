@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark $count over a large customer set.
+
+Seeds N customers across the sample companies, then times the counts the
+connector asks for ($count with cross-company and $filter on dataAreaId,
+CustomerGroupId and IsActive): by scanning the rows with the filter's
+predicate (what a count costs without maintained aggregates), through the
+store's maintained counts, and over HTTP against /CustomersV3/$count.
+Reports counts per second for each.
+
+Usage:
+    python bench_counts.py [--customers 1000000] [--counts 20000] [--requests 2000]
+"""
+
+import argparse
+import gc
+import json
+import random
+import time
+
+import mock_server
+from odata_filter import compile_filter
+from seed_data import generate_customers, merge_profile
+
+FILTERS = (
+    None,
+    "IsActive eq true",
+    "dataAreaId eq 'USMF' and IsActive eq true",
+    "CustomerGroupId eq '10' and IsActive eq false",
+    "dataAreaId in ('USMF', 'DEMF') and CustomerGroupId eq '20' and IsActive eq true",
+)
+
+
+def rate(runs, started, digits=None):
+    return round(runs / (time.perf_counter() - started), digits)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--customers", type=int, default=1000000, help="customers to seed")
+    parser.add_argument("--counts", type=int, default=20000, help="counts per filter through the store")
+    parser.add_argument("--scans", type=int, default=3, help="counts per filter by scanning")
+    parser.add_argument("--requests", type=int, default=2000, help="$count requests per filter over HTTP")
+    args = parser.parse_args()
+
+    store = mock_server.customers
+    store.clear()
+    store.bulk_load(generate_customers(args.customers, random.Random(42), merge_profile()))
+    # As the server does once its data is loaded
+    gc.freeze()
+    client = mock_server.app.test_client()
+    # The first request pays for Flask's lazy setup
+    client.get("/CustomersV3/$count")
+
+    results = {"customers": len(store), "filters": {}}
+    for text in FILTERS:
+        compiled_filter = compile_filter(text) if text else None
+        predicate = compiled_filter.predicate if compiled_filter else (lambda row: True)
+        expected = sum(1 for row in store.values() if predicate(row))
+
+        started = time.perf_counter()
+        for _ in range(args.scans):
+            sum(1 for row in store.values() if predicate(row))
+        scan = rate(args.scans, started, 2)
+
+        started = time.perf_counter()
+        for _ in range(args.counts):
+            assert store.count(compiled_filter) == expected
+        maintained = rate(args.counts, started)
+
+        query = {"cross-company": "true"}
+        if text:
+            query["$filter"] = text
+        started = time.perf_counter()
+        for _ in range(args.requests):
+            assert int(client.get("/CustomersV3/$count", query_string=query).get_data()) == expected
+        http = rate(args.requests, started)
+
+        label = text or "(all)"
+        results["filters"][label] = {"count": expected, "scan": scan, "maintained": maintained, "http": http}
+        print(f"{label}\n    {expected:>9} matches  scan {scan:>6.2f}/s  maintained {maintained:>9}/s  http {http:>6}/s")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
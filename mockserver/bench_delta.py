@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Benchmark incremental sync with $deltatoken vs reloading the whole entity set.
+
+Loads N synthetic customers into the in-process mock server and reads the
+whole set once to obtain a delta link. Then, for each change count, updates
+that many random customers and syncs them twice: once by paging through the
+full entity set again, and once by following the delta link. Reports time,
+bytes and entities transferred per sync.
+
+Usage:
+    python bench_delta.py [--rows 200000] [--changes 10,1000,10000] [--page-size 10000]
+"""
+
+import argparse
+import json
+import random
+import time
+
+import mock_server
+from seed_data import generate_customers, merge_profile
+
+
+def read_all(client, url, page_size):
+    """Follow nextLinks from url, returning (ms, bytes, entities, final delta link)"""
+    headers = {"Prefer": f"odata.maxpagesize={page_size}"}
+    size = entities = 0
+    started = time.perf_counter()
+    while url:
+        response = client.get(url, headers=headers)
+        size += len(response.get_data())
+        data = response.get_json()
+        entities += len(data["value"])
+        url = data.get("@odata.nextLink")
+    return (time.perf_counter() - started) * 1000, size, entities, data.get("@odata.deltaLink")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000, help="customers to load")
+    parser.add_argument("--changes", default="10,1000,10000", help="comma separated numbers of updates per sync")
+    parser.add_argument("--page-size", type=int, default=10000, help="odata.maxpagesize of every request")
+    args = parser.parse_args()
+
+    customers = mock_server.customers
+    customers.clear()
+    customers.bulk_load(generate_customers(args.rows, random.Random(42), merge_profile()))
+    client = mock_server.app.test_client()
+    keys = list(customers.keys())
+    rng = random.Random(7)
+
+    _, _, _, delta_link = read_all(client, "/CustomersV3", args.page_size)
+    results = []
+    for changes in (int(count) for count in args.changes.split(",")):
+        for key in rng.sample(keys, changes):
+            customers.update(key, lambda entity: entity.update(CreditLimit=float(rng.randrange(0, 500000, 500))))
+        full_ms, full_bytes, full_entities, _ = read_all(client, "/CustomersV3", args.page_size)
+        delta_ms, delta_bytes, delta_entities, delta_link = read_all(client, delta_link, args.page_size)
+        result = {
+            "rows": len(customers),
+            "changes": changes,
+            "full_ms": round(full_ms, 3),
+            "full_bytes": full_bytes,
+            "full_entities": full_entities,
+            "delta_ms": round(delta_ms, 3),
+            "delta_bytes": delta_bytes,
+            "delta_entities": delta_entities
+        }
+        results.append(result)
+        print(f"{changes:>7} changes  full {full_ms:>9.1f} ms {full_bytes:>11} B  "
+              f"delta {delta_ms:>8.1f} ms {delta_bytes:>10} B ({delta_entities} entities)")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Benchmark $expand against the N+1 requests it replaces.
+
+Seeds N customers across the sample companies and a customer group for every
+company and group they use, then times, page by page:
+
+- to-one: a page of customers with $expand=CustomerGroup, against the page
+  without it followed by one CustomerGroups request per customer
+- to-many: every customer group with $expand=Customers($top=K), against the
+  groups followed by one CustomersV3 request per group
+
+Each page is a different $skip, so neither side is answered from the
+response cache; the per-customer group lookups of the N+1 side are, which
+makes its numbers a lower bound. Reports the mean and p50/p99 latency per
+page in milliseconds.
+
+Usage:
+    python bench_expand.py [--customers 100000] [--page 100] [--pages 200] [--related 100]
+"""
+
+import argparse
+import gc
+import json
+import random
+import statistics
+import time
+
+import mock_server
+from seed_data import generate_customers, merge_profile
+
+
+def timed(pages, fetch):
+    latencies = []
+    for page in range(pages):
+        started = time.perf_counter()
+        fetch(page)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies.sort()
+    return {"mean_ms": round(statistics.fmean(latencies), 3),
+            "p50_ms": round(latencies[len(latencies) // 2], 3),
+            "p99_ms": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--customers", type=int, default=100000, help="customers to seed")
+    parser.add_argument("--page", type=int, default=100, help="customers per page")
+    parser.add_argument("--pages", type=int, default=200, help="pages timed per variant")
+    parser.add_argument("--related", type=int, default=100, help="$top of the customers expanded per group")
+    args = parser.parse_args()
+
+    profile = merge_profile()
+    customers, groups = mock_server.customers, mock_server.entity_stores["CustomerGroups"]
+    customers.clear()
+    customers.bulk_load(generate_customers(args.customers, random.Random(42), profile))
+    groups.clear()
+    groups.bulk_load((f"{company}_{group}", {
+        "@odata.etag": f'W/"{index}"', "dataAreaId": company, "CustomerGroupId": group,
+        "Description": f"Customer group {group}", "PaymentTermsId": "Net30"
+    }) for index, (company, group) in enumerate(
+        (company, group) for company in profile["companies"] for group in profile["customer_groups"]))
+    # As the server does once its data is loaded
+    gc.freeze()
+    client = mock_server.app.test_client()
+    # The first request pays for Flask's lazy setup
+    client.get("/CustomersV3", query_string={"$top": "1", "$expand": "CustomerGroup"})
+
+    def page_of(page, **options):
+        query = {"cross-company": "true", "$top": str(args.page), "$skip": str(page * args.page), **options}
+        response = client.get("/CustomersV3", query_string=query)
+        assert response.status_code == 200
+        return response.get_json()["value"]
+
+    def expanded_page(page):
+        assert all(customer["CustomerGroup"] for customer in page_of(page, **{"$expand": "CustomerGroup"}))
+
+    def fanned_out_page(page):
+        for customer in page_of(page):
+            response = client.get("/CustomerGroups", query_string={
+                "cross-company": "true",
+                "$filter": f"dataAreaId eq '{customer['dataAreaId']}' and "
+                           f"CustomerGroupId eq '{customer['CustomerGroupId']}'"})
+            assert response.get_json()["value"]
+
+    # The to-many variants page through customers per group with $skip
+    def expanded_groups(page):
+        expand = f"Customers($select=CustomerAccount;$top={args.related})"
+        response = client.get("/CustomerGroups", query_string={
+            "cross-company": "true", "$expand": expand, "$filter": f"CustomerGroupId ne 'page{page}'"})
+        assert response.status_code == 200
+
+    def fanned_out_groups(page):
+        response = client.get("/CustomerGroups", query_string={
+            "cross-company": "true", "$filter": f"CustomerGroupId ne 'page{page}'"})
+        for group in response.get_json()["value"]:
+            client.get("/CustomersV3", query_string={
+                "cross-company": "true", "$select": "CustomerAccount", "$top": str(args.related),
+                "$filter": f"dataAreaId eq '{group['dataAreaId']}' and CustomerGroupId eq '{group['CustomerGroupId']}' "
+                           f"and CustomerAccount ne 'page{page}'"})
+
+    pages = min(args.pages, args.customers // args.page)
+    results = {
+        "customers": len(customers),
+        "customer_groups": len(groups),
+        "to_one": {"expand": timed(pages, expanded_page), "n_plus_1": timed(pages, fanned_out_page)},
+        "to_many": {"expand": timed(pages, expanded_groups), "n_plus_1": timed(pages, fanned_out_groups)},
+    }
+    for name in ("to_one", "to_many"):
+        variants = results[name]
+        variants["speedup"] = round(variants["n_plus_1"]["mean_ms"] / variants["expand"]["mean_ms"], 1)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
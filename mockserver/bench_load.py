@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Concurrent load benchmark for a running Microsoft Dynamics 365 Finance Mock Server.
+
+test_server.py checks that each route works; this harness measures how fast
+they are under load. It drives a weighted mix of read and write operations
+covering every route over pooled keep-alive connections, from a pool of
+worker threads, using one of two arrival models:
+
+- closed loop (default): --concurrency workers each send their next request
+  as soon as the previous one completes (plus optional --think-time)
+- open loop (--rate N): requests arrive on a Poisson schedule of N per second
+  regardless of how fast the server answers; latency is measured from the
+  scheduled arrival time, so queueing behind a slow server is included
+
+Results (throughput, error counts and latency percentiles per operation) are
+printed as JSON and can be saved with --output. Passing a previous result
+with --baseline compares the two and exits non-zero when throughput or p99
+latency regressed by more than --tolerance.
+
+Usage:
+    python bench_load.py --duration 30 --concurrency 32 --write-ratio 0.1
+    python bench_load.py --rate 500 --duration 30 --output run.json
+    python bench_load.py --baseline previous.json --tolerance 0.1
+"""
+
+import argparse
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import LatencyHistogram, QUANTILES
+
+BASE_URL = "http://localhost:8080"
+
+CUSTOMER = "CustomersV3(dataAreaId='USMF',CustomerAccount='C000001')"
+
+
+def _new_customer():
+    return {"dataAreaId": "USMF", "OrganizationName": f"Load {uuid.uuid4().hex[:8]}", "CreditLimit": 1000.0}
+
+
+# name -> (kind, weight, method, path, body factory)
+OPERATIONS = {
+    "service_root": ("read", 1, "GET", "/data", None),
+    "metadata": ("read", 1, "GET", "/$metadata", None),
+    "health": ("read", 1, "GET", "/health", None),
+    "list_vendors": ("read", 4, "GET", "/VendorsV2?$top=100", None),
+    "list_customers": ("read", 6, "GET", "/CustomersV3?$top=100", None),
+    "filter_customers": ("read", 4, "GET", "/CustomersV3?$filter=CustomerGroupId eq '20'&$top=100", None),
+    "order_customers": ("read", 3, "GET", "/CustomersV3?$orderby=CreditLimit desc&$top=100", None),
+    "get_customer": ("read", 6, "GET", f"/{CUSTOMER}", None),
+    "count_customers": ("read", 2, "GET", "/CustomersV3/$count", None),
+    "exchange_rates": ("read", 2, "GET", "/ExchangeRates", None),
+    "system_users": ("read", 1, "GET", "/SystemUsers", None),
+    "create_customer": ("write", 4, "POST", "/CustomersV3", _new_customer),
+    "create_vendor": ("write", 2, "POST", "/VendorsV2",
+                      lambda: {"dataAreaId": "USMF", "OrganizationName": f"Load {uuid.uuid4().hex[:8]}"}),
+    "update_customer": ("write", 4, "PATCH", f"/{CUSTOMER}",
+                        lambda: {"CreditLimit": float(random.randrange(0, 500000, 500))}),
+    "batch": ("write", 1, "POST", "/$batch", lambda: {"requests": [
+        {"id": "1", "method": "GET", "url": "VendorsV2?$top=10"},
+        {"id": "2", "atomicityGroup": "g1", "method": "POST", "url": "CustomersV3", "body": _new_customer()}
+    ]}),
+}
+
+
+def build_mix(write_ratio, only=None):
+    """Return (names, weights) drawing writes with probability write_ratio"""
+    names = [name for name in OPERATIONS if not only or name in only]
+    reads = [name for name in names if OPERATIONS[name][0] == "read"]
+    writes = [name for name in names if OPERATIONS[name][0] == "write"]
+    read_total = sum(OPERATIONS[name][1] for name in reads) or 1
+    write_total = sum(OPERATIONS[name][1] for name in writes) or 1
+    if not writes:
+        write_ratio = 0
+    if not reads:
+        write_ratio = 1
+    weights = [OPERATIONS[name][1] / read_total * (1 - write_ratio) for name in reads]
+    weights += [OPERATIONS[name][1] / write_total * write_ratio for name in writes]
+    return reads + writes, weights
+
+
+class Recorder:
+    """Thread-safe latency and status recorder per operation"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.statuses = {}
+        self.errors = {}
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, status=None, size=0, error=None):
+        micros = int(seconds * 1_000_000)
+        with self.lock:
+            histogram = self.histograms.get(name) or self.histograms.setdefault(name, LatencyHistogram())
+            histogram.record(micros)
+            if error is not None:
+                self.errors[name] = self.errors.get(name, 0) + 1
+            else:
+                statuses = self.statuses.setdefault(name, {})
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                self.bytes += size
+
+    def summary(self, elapsed):
+        def latency(histogram):
+            # p50_ms, p90_ms, p99_ms, p999_ms
+            result = {f"p{q * 100:g}".replace(".", "") + "_ms": round(histogram.quantile(q) / 1000, 3)
+                      for q in QUANTILES}
+            result["mean_ms"] = round(histogram.sum / histogram.total / 1000, 3) if histogram.total else 0
+            result["max_ms"] = round(histogram.quantile(1.0) / 1000, 3)
+            return result
+
+        combined = LatencyHistogram()
+        operations = {}
+        for name, histogram in sorted(self.histograms.items()):
+            combined.merge(histogram)
+            operations[name] = {
+                "requests": histogram.total,
+                "throughput_rps": round(histogram.total / elapsed, 2),
+                "statuses": self.statuses.get(name, {}),
+                "errors": self.errors.get(name, 0) + sum(count for status, count in self.statuses.get(name, {}).items()
+                                                         if int(status) >= 500),
+                "latency": latency(histogram)
+            }
+        return {
+            "requests": combined.total,
+            "throughput_rps": round(combined.total / elapsed, 2),
+            "errors": sum(operation["errors"] for operation in operations.values()),
+            "response_bytes": self.bytes,
+            "latency": latency(combined),
+            "operations": operations
+        }
+
+
+def make_session(pool_size):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def send(session, name, recorder, started=None):
+    """Send one operation and record its latency from started (default: now)"""
+    _, _, method, path, body = OPERATIONS[name]
+    started = started if started is not None else time.perf_counter()
+    try:
+        response = session.request(method, BASE_URL + path, json=body() if body else None, timeout=60)
+        size = len(response.content)
+        recorder.record(name, time.perf_counter() - started, response.status_code, size)
+    except requests.RequestException as e:
+        recorder.record(name, time.perf_counter() - started, error=e)
+
+
+def run_closed_loop(args, names, weights, recorder):
+    """Each worker sends its next request when the previous one has completed"""
+    session = make_session(args.concurrency)
+    deadline = time.perf_counter() + args.duration
+
+    def worker(index):
+        rng = random.Random(f"{args.seed}:{index}")
+        while time.perf_counter() < deadline:
+            send(session, rng.choices(names, weights)[0], recorder)
+            if args.think_time:
+                time.sleep(args.think_time)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(worker, range(args.concurrency)))
+
+
+def run_open_loop(args, names, weights, recorder):
+    """Requests arrive on a Poisson schedule independent of response times"""
+    session = make_session(args.concurrency)
+    rng = random.Random(args.seed)
+    start = time.perf_counter()
+    deadline = start + args.duration
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        arrival = start
+        for _ in itertools.count():
+            arrival += rng.expovariate(args.rate)
+            if arrival >= deadline:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, session, rng.choices(names, weights)[0], recorder, arrival)
+
+
+def compare(result, baseline, tolerance):
+    """Return a list of regressions of result against baseline"""
+    regressions = []
+
+    def check(label, current, previous):
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{label}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} rps")
+        if previous["latency"]["p99_ms"] and current["latency"]["p99_ms"] > previous["latency"]["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{label}: p99 {previous['latency']['p99_ms']} -> {current['latency']['p99_ms']} ms")
+
+    check("overall", result["summary"], baseline["summary"])
+    for name, operation in result["summary"]["operations"].items():
+        previous = baseline["summary"]["operations"].get(name)
+        if previous is not None:
+            check(name, operation, previous)
+    return regressions
+
+
+def main():
+    global BASE_URL
+    parser = argparse.ArgumentParser(description="Concurrent load benchmark for the mock server")
+    parser.add_argument("--url", default=BASE_URL, help="base URL of the running mock server")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to generate load for")
+    parser.add_argument("--concurrency", type=int, default=16,
+                        help="worker threads and keep-alive connections")
+    parser.add_argument("--rate", type=float, help="open loop: mean arrivals per second (Poisson)")
+    parser.add_argument("--think-time", type=float, default=0, help="closed loop: seconds between requests")
+    parser.add_argument("--write-ratio", type=float, default=0.1, help="share of write operations")
+    parser.add_argument("--operations", help="comma separated operations to run (default: all)")
+    parser.add_argument("--seed", type=int, default=42, help="random seed for the operation mix")
+    parser.add_argument("--output", help="write the JSON result to this file")
+    parser.add_argument("--baseline", help="previous JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="allowed relative throughput drop / p99 increase against the baseline")
+    args = parser.parse_args()
+    BASE_URL = args.url.rstrip("/")
+
+    only = set(args.operations.split(",")) if args.operations else None
+    unknown = (only or set()) - set(OPERATIONS)
+    if unknown:
+        parser.error(f"unknown operations: {', '.join(sorted(unknown))}")
+    names, weights = build_mix(args.write_ratio, only)
+
+    recorder = Recorder()
+    started = time.perf_counter()
+    if args.rate:
+        run_open_loop(args, names, weights, recorder)
+    else:
+        run_closed_loop(args, names, weights, recorder)
+    elapsed = time.perf_counter() - started
+
+    result = {
+        "config": {
+            "url": BASE_URL,
+            "model": "open" if args.rate else "closed",
+            "duration_s": args.duration,
+            "concurrency": args.concurrency,
+            "rate": args.rate,
+            "think_time_s": args.think_time,
+            "write_ratio": args.write_ratio,
+            "operations": names,
+            "seed": args.seed
+        },
+        "elapsed_s": round(elapsed, 3),
+        "summary": recorder.summary(elapsed)
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare(result, json.load(baseline_file), args.tolerance)
+        result["regressions"] = regressions
+        exit_code = 1 if regressions else 0
+    print(json.dumps(result, indent=2))
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
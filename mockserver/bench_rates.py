@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Benchmark as-of exchange rate lookups.
+
+Seeds N days of daily rate history, then looks up random (pair, date) rates
+the way a currency conversion job does: by scanning a plain list of rates
+(how the mock used to keep them), by bisecting the pair's time series, and
+through the memoized rate() that also derives inverse and cross rates.
+Finally times the same as-of query over HTTP as a $filter on ValidFromDate
+with $orderby desc and $top=1. Reports lookups per second for each.
+
+Usage:
+    python bench_rates.py [--days 3650] [--lookups 200000] [--requests 2000]
+"""
+
+import argparse
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+import mock_server
+from rates import ExchangeRateStore
+from seed_data import generate_exchange_rates, merge_profile
+
+
+def timed(lookups, lookup):
+    """Run lookup over every (from, to, date) triple, returning (lookups per second, misses)"""
+    misses = 0
+    started = time.perf_counter()
+    for from_currency, to_currency, date in lookups:
+        if lookup(from_currency, to_currency, date) is None:
+            misses += 1
+    return round(len(lookups) / (time.perf_counter() - started)), misses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--days", type=int, default=3650, help="days of rate history per pair")
+    parser.add_argument("--lookups", type=int, default=200000, help="as-of lookups per method")
+    parser.add_argument("--scan-lookups", type=int, default=200, help="lookups for the list scan")
+    parser.add_argument("--requests", type=int, default=2000, help="as-of $filter requests over HTTP")
+    args = parser.parse_args()
+
+    profile = merge_profile()
+    rates = generate_exchange_rates(args.days, random.Random(42), profile)
+    store = ExchangeRateStore()
+    store.extend(rates)
+    # Only USD pairs are stored for the derived lookups, so every other
+    # pair is crossed through USD
+    usd_store = ExchangeRateStore()
+    usd_store.extend(rate for rate in rates if "USD" in (rate["FromCurrencyCode"], rate["ToCurrencyCode"]))
+
+    rng = random.Random(7)
+    currencies = list(profile["exchange_rates"]["base_rates"])
+    start = datetime.fromisoformat(profile["exchange_rates"]["start_date"]).replace(tzinfo=timezone.utc)
+    lookups = []
+    for _ in range(args.lookups):
+        from_currency, to_currency = rng.sample(currencies, 2)
+        # Transactions are converted at the rate of their posting date
+        date = start + timedelta(days=rng.randrange(args.days))
+        lookups.append((from_currency, to_currency, date.strftime("%Y-%m-%dT%H:%M:%SZ")))
+
+    def scan(from_currency, to_currency, date):
+        latest = None
+        for rate in rates:
+            if (rate["RateTypeId"] == "SPOT" and rate["FromCurrencyCode"] == from_currency
+                    and rate["ToCurrencyCode"] == to_currency and rate["ValidFromDate"] <= date
+                    and (latest is None or rate["ValidFromDate"] > latest["ValidFromDate"])):
+                latest = rate
+        return latest
+
+    results = {"rates": len(rates)}
+    results["list_scan"], _ = timed(lookups[:args.scan_lookups], scan)
+    results["series_bisect"], _ = timed(lookups, lambda f, t, d: store.as_of(f, t, d, "SPOT"))
+    # The first pass derives each (pair, date) once; the second is served from the memo
+    results["cross_first_pass"], _ = timed(lookups, lambda f, t, d: usd_store.rate(f, t, d, "SPOT"))
+    results["cross_memoized"], _ = timed(lookups, lambda f, t, d: usd_store.rate(f, t, d, "SPOT"))
+
+    mock_server.exchange_rates.clear()
+    mock_server.exchange_rates.extend(rates)
+    client = mock_server.app.test_client()
+    started = time.perf_counter()
+    for from_currency, to_currency, date in lookups[:args.requests]:
+        response = client.get("/ExchangeRates", query_string={
+            "$filter": f"RateTypeId eq 'SPOT' and FromCurrencyCode eq '{from_currency}' and "
+                       f"ToCurrencyCode eq '{to_currency}' and ValidFromDate le {date}",
+            "$orderby": "ValidFromDate desc",
+            "$top": "1"
+        })
+        assert len(response.get_json()["value"]) == 1
+    results["http_filter"] = round(args.requests / (time.perf_counter() - started))
+
+    for name, value in results.items():
+        print(f"{name:>16} {value:>12}" + ("" if name == "rates" else " lookups/s"))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
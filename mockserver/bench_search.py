@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark $search over a large customer set.
+
+Seeds N customers across the sample companies, then times the searches a
+customer lookup sends ($search on names and aliases, alone and with $filter,
+$top and $select): by scanning the rows with the search's predicate (what a
+search costs without the inverted index), through the store's index, and
+over HTTP against /CustomersV3 with cross-company=true. Reports the mean
+latency of each in milliseconds.
+
+Usage:
+    python bench_search.py [--customers 1000000] [--searches 200] [--requests 500]
+"""
+
+import argparse
+import gc
+import json
+import random
+import time
+
+import mock_server
+from odata_filter import compile_filter
+from search import compile_search
+from seed_data import generate_customers, merge_profile
+
+SEARCHES = (
+    ("Tailspin", None),
+    ("north", None),
+    ("\"Contoso Coffee\"", None),
+    ("Contoso0042", None),
+    ("summit AND energy NOT gmbh", None),
+    ("Harbor", "dataAreaId eq 'USMF' and IsActive eq true"),
+)
+
+
+def mean_ms(runs, started):
+    return round((time.perf_counter() - started) / runs * 1000, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--customers", type=int, default=1000000, help="customers to seed")
+    parser.add_argument("--searches", type=int, default=200, help="searches per expression through the store")
+    parser.add_argument("--scans", type=int, default=2, help="searches per expression by scanning")
+    parser.add_argument("--requests", type=int, default=500, help="$search requests per expression over HTTP")
+    parser.add_argument("--top", type=int, default=10, help="$top of the HTTP requests")
+    args = parser.parse_args()
+
+    store = mock_server.customers
+    store.clear()
+    started = time.perf_counter()
+    store.bulk_load(generate_customers(args.customers, random.Random(42), merge_profile()))
+    load_s = round(time.perf_counter() - started, 2)
+    # As the server does once its data is loaded
+    gc.freeze()
+    client = mock_server.app.test_client()
+    # The first search indexes the bulk loaded customers, the first request
+    # pays for Flask's lazy setup
+    started = time.perf_counter()
+    store.count(search=compile_search("contoso"))
+    index_s = round(time.perf_counter() - started, 2)
+    client.get("/CustomersV3", query_string={"$search": "contoso", "$top": "1"})
+
+    results = {"customers": len(store), "load_s": load_s, "index_s": index_s, "searches": {}}
+    fields = store.searched_fields()
+    for text, filter_text in SEARCHES:
+        compiled_search = compile_search(text)
+        compiled_filter = compile_filter(filter_text) if filter_text else None
+        searched = compiled_search.predicate(fields)
+        filtered = compiled_filter.predicate if compiled_filter else (lambda row: True)
+
+        started = time.perf_counter()
+        for _ in range(args.scans):
+            expected = sum(1 for row in store.values() if searched(row) and filtered(row))
+        scan = mean_ms(args.scans, started)
+
+        started = time.perf_counter()
+        for _ in range(args.searches):
+            entries, count = store.query(compiled_filter, search=compiled_search)
+            first = [key for key, _ in zip(entries, range(args.top))]
+        indexed = mean_ms(args.searches, started)
+        assert count == expected and len(first) == min(args.top, expected)
+
+        query = {"cross-company": "true", "$search": text, "$top": str(args.top),
+                 "$select": "CustomerAccount,OrganizationName,NameAlias"}
+        if filter_text:
+            query["$filter"] = filter_text
+        # Distinct $skip values keep the response cache out of the measurement
+        started = time.perf_counter()
+        for request_number in range(args.requests):
+            query["$skip"] = str(request_number)
+            response = client.get("/CustomersV3", query_string=query)
+            assert response.status_code == 200
+        http = mean_ms(args.requests, started)
+
+        label = text + (f" + $filter={filter_text}" if filter_text else "")
+        results["searches"][label] = {"matches": expected, "scan_ms": scan, "indexed_ms": indexed, "http_ms": http}
+        print(f"{label}\n    {expected:>9} matches  scan {scan:>9} ms  indexed {indexed:>7} ms  http {http:>7} ms")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
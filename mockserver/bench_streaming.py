@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Benchmark buffered vs streamed collection responses.
+
+Loads N synthetic customers into the in-process mock server and requests
+them all in one page, reporting time to first byte, total time and peak
+Python heap usage while the response is produced and consumed.
+
+Usage:
+    python bench_streaming.py [--sizes 10000,100000,1000000]
+"""
+
+import argparse
+import json
+import time
+import tracemalloc
+
+import mock_server
+
+
+def load_customers(count):
+    """Fill the customer store with count synthetic customers"""
+    mock_server.customers.clear()
+    for i in range(count):
+        account = f"C{i:08d}"
+        mock_server.customers[f"USMF_{account}"] = {
+            "@odata.etag": f'W/"{i}"',
+            "dataAreaId": "USMF",
+            "CustomerAccount": account,
+            "OrganizationName": f"Customer {i}",
+            "NameAlias": f"Cust{i}",
+            "CustomerGroupId": str(10 + i % 5 * 10),
+            "AddressCountryRegionId": "US",
+            "SalesCurrencyCode": "USD",
+            "PersonGender": "Unknown",
+            "CreditLimit": float(i % 1000 * 100),
+            "IsActive": i % 7 != 0
+        }
+
+
+def fetch(client, count):
+    """Request every customer in one page, returning (ttfb, total, bytes)"""
+    started = time.perf_counter()
+    response = client.get(f"/CustomersV3?$top={count}", buffered=False)
+    chunks = iter(response.response)
+    first = next(chunks)
+    ttfb = time.perf_counter() - started
+    size = len(first)
+    for chunk in chunks:
+        size += len(chunk)
+    response.close()
+    return ttfb, time.perf_counter() - started, size
+
+
+def measure(client, count, streaming):
+    mock_server.STREAM_THRESHOLD = 0 if streaming else count + 1
+    ttfb, total, size = fetch(client, count)
+    tracemalloc.start()
+    fetch(client, count)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "rows": count,
+        "mode": "streaming" if streaming else "buffered",
+        "ttfb_ms": round(ttfb * 1000, 2),
+        "total_ms": round(total * 1000, 2),
+        "response_bytes": size,
+        "peak_heap_mb": round(peak / (1024 * 1024), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", default="10000,100000,1000000",
+                        help="comma separated row counts to benchmark")
+    args = parser.parse_args()
+
+    client = mock_server.app.test_client()
+    results = []
+    for count in (int(size) for size in args.sizes.split(",")):
+        load_customers(count)
+        mock_server.MAX_PAGE_SIZE = count
+        for streaming in (False, True):
+            result = measure(client, count, streaming)
+            results.append(result)
+            print(f"{result['rows']:>9} rows  {result['mode']:<9}  "
+                  f"ttfb {result['ttfb_ms']:>9.2f} ms  total {result['total_ms']:>9.2f} ms  "
+                  f"peak {result['peak_heap_mb']:>8.2f} MB")
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Traffic capture for the Dynamics 365 Finance mock server.
+
+TrafficCapture wraps the WSGI app and appends every request it serves to a
+JSON Lines log, one compact object per request:
+
+- time: arrival of the request, in seconds since the epoch, which a replay
+  turns into offsets from the first request
+- method, path (e.g. /CustomersV3(dataAreaId='USMF',CustomerAccount='C000001'))
+  and the raw query string
+- headers, less hop-by-hop and redacted ones, and the body, as text or, when
+  it is not UTF-8, base64
+- route template, status and server-side duration in milliseconds, timed
+  until the last byte of the response was sent, for replay_traffic.py to
+  compare against
+
+Request threads only hand a tuple to a bounded queue; a writer thread
+encodes and appends the records in batches, so capturing adds a few
+microseconds per request. When the writer falls behind by max_pending
+records, further records are dropped and counted rather than slowing the
+server down.
+"""
+
+import atexit
+import base64
+import io
+import json
+import os
+import queue
+import threading
+import time
+
+# Headers a replay sets itself, or that only apply to the original connection
+_SKIPPED_HEADERS = {"host", "content-length", "connection", "keep-alive", "transfer-encoding", "upgrade"}
+
+# Written to the queue to make the writer flush and exit
+_STOP = object()
+
+
+def _request_headers(environ, redacted):
+    headers = {}
+    for name, value in environ.items():
+        if name.startswith("HTTP_"):
+            name = name[5:]
+        elif name not in ("CONTENT_TYPE", "CONTENT_LENGTH") or not value:
+            continue
+        name = name.replace("_", "-").title()
+        if name.lower() not in _SKIPPED_HEADERS and name.lower() not in redacted:
+            headers[name] = value
+    return headers
+
+
+def _read_body(environ, max_body_bytes):
+    """Read the request body and put it back for the app, returning it or None when too large"""
+    try:
+        length = int(environ.get("CONTENT_LENGTH") or 0)
+    except ValueError:
+        length = 0
+    if length:
+        if length > max_body_bytes:
+            return None
+        body = environ["wsgi.input"].read(length)
+    elif environ.get("wsgi.input_terminated"):
+        body = environ["wsgi.input"].read()
+    else:
+        return b""
+    environ["wsgi.input"] = io.BytesIO(body)
+    return body
+
+
+class _CapturedBody:
+    """Response iterable that enqueues the request's record once the response is sent"""
+
+    __slots__ = ("capture", "body", "environ", "entry", "started")
+
+    def __init__(self, capture, body, environ, entry, started):
+        self.capture = capture
+        self.body = body
+        self.environ = environ
+        self.entry = entry
+        self.started = started
+
+    def __iter__(self):
+        return iter(self.body)
+
+    def close(self):
+        try:
+            close = getattr(self.body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.capture._enqueue(self.entry, self.environ, self.started)
+
+
+class TrafficCapture:
+    """
+    Appends the requests a WSGI app serves to a JSON Lines log.
+
+    Capturing is off while path is None. exclude_paths lists request paths
+    never captured (the metrics scrape, health checks), redact_headers names
+    headers left out of the log, and bodies over max_body_bytes are logged
+    without their content.
+    """
+
+    def __init__(self, path=None, exclude_paths=("/metrics", "/health"),
+                 redact_headers=("Authorization", "Cookie"), max_body_bytes=1048576,
+                 max_pending=100000):
+        self.path = path
+        self.exclude_paths = set(exclude_paths)
+        self.redacted = {name.lower() for name in redact_headers}
+        self.max_body_bytes = max_body_bytes
+        self.max_pending = max_pending
+        self.written = 0
+        self.dropped = 0
+        self._queue = None
+        self._writer = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.wsgi_app = self._middleware(app.wsgi_app)
+
+    def start(self, path):
+        """Capture to path from now on, appending to it if it exists"""
+        self.close()
+        self.path = path
+
+    def _middleware(self, wsgi_app):
+        def captured(environ, start_response):
+            if self.path is None or environ.get("PATH_INFO", "") in self.exclude_paths:
+                return wsgi_app(environ, start_response)
+            started = time.perf_counter()
+            body = _read_body(environ, self.max_body_bytes)
+            # Wall-clock arrival times order the records of every process
+            # appending to the log, e.g. of each gunicorn worker
+            entry = (time.time(), environ.get("REQUEST_METHOD", "GET"),
+                     environ.get("SCRIPT_NAME", "") + environ.get("PATH_INFO", ""),
+                     environ.get("QUERY_STRING", ""), _request_headers(environ, self.redacted), body)
+
+            def record_status(status, headers, exc_info=None):
+                environ["mockserver.capture_status"] = status.split(" ", 1)[0]
+                return start_response(status, headers, exc_info)
+
+            try:
+                response = wsgi_app(environ, record_status)
+            except BaseException:
+                environ.setdefault("mockserver.capture_status", "500")
+                self._enqueue(entry, environ, started)
+                raise
+            return _CapturedBody(self, response, environ, entry, started)
+        return captured
+
+    def _enqueue(self, entry, environ, started):
+        self._ensure_writer()
+        record = (entry, environ.get("mockserver.route"), environ.get("mockserver.capture_status", "500"),
+                  time.perf_counter() - started)
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _ensure_writer(self):
+        # Threads do not survive a fork, so each process starts its own writer
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(self.max_pending)
+            self._writer = threading.Thread(target=self._write, args=(self.path, self._queue),
+                                            name="traffic-capture", daemon=True)
+            self._writer.start()
+            self._pid = os.getpid()
+        atexit.register(self.close)
+
+    def close(self):
+        """Write the records still queued and stop the writer"""
+        with self._lock:
+            writer, pending = self._writer, self._queue
+            if writer is None or self._pid != os.getpid():
+                return
+            self._writer = self._pid = None
+        pending.put(_STOP)
+        writer.join()
+
+    def _write(self, path, pending):
+        stopping = False
+        with open(path, "ab") as log:
+            while not stopping:
+                records = [pending.get()]
+                # Take whatever else is queued, so a busy server writes in batches
+                while len(records) < 1000:
+                    try:
+                        records.append(pending.get_nowait())
+                    except queue.Empty:
+                        break
+                if any(record is _STOP for record in records):
+                    stopping = True
+                    records = [record for record in records if record is not _STOP]
+                if not records:
+                    continue
+                # One write per batch keeps records whole when several
+                # processes append to the same file
+                log.write(b"".join(self._encode(record) for record in records))
+                log.flush()
+                with self._lock:
+                    self.written += len(records)
+
+    @staticmethod
+    def _encode(record):
+        (arrival, method, path, query, headers, body), route, status, duration = record
+        line = {"time": round(arrival, 6), "method": method, "path": path}
+        if query:
+            line["query"] = query
+        line["headers"] = headers
+        if body is None:
+            line["bodyTruncated"] = True
+        elif body:
+            try:
+                line["body"] = body.decode("utf-8")
+            except UnicodeDecodeError:
+                line["bodyBase64"] = base64.b64encode(body).decode("ascii")
+        line["route"] = route
+        line["status"] = int(status)
+        line["durationMs"] = round(duration * 1000, 3)
+        return json.dumps(line, separators=(",", ":")).encode("utf-8") + b"\n"
+
+
+def read_capture(path):
+    """Return the records of a capture log in arrival order, skipping a torn last line"""
+    records = []
+    with open(path, "rb") as log:
+        for line in log:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A line cut short by a crash or a concurrent append
+                continue
+    records.sort(key=lambda record: record["time"])
+    return records
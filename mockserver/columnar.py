@@ -0,0 +1,307 @@
+"""
+Column-oriented storage backend for the Dynamics 365 Finance mock server.
+
+ColumnarEntityStore keeps each field of an entity set in its own column
+instead of one dict per entity:
+
+- "float" and "int" columns are typed arrays with a one-byte null mask
+- "bool" columns are signed byte arrays
+- "category" columns dictionary-encode low-cardinality strings such as
+  dataAreaId or currency codes into integer codes
+- any other field is held in a plain list
+
+Entities are exposed as lightweight read-only views over their row, so
+filters, sorting and $select only read the columns they touch; a full dict
+is materialized only when an entity is serialized.
+"""
+
+from array import array
+from collections.abc import Mapping
+
+from store import EntityStore
+
+
+_ABSENT = object()
+
+# Null mask and bool column markers
+_PRESENT, _NULL, _MISSING = 0, 1, 2
+_BOOL_NULL, _BOOL_MISSING = -1, -2
+
+
+class _ObjectColumn:
+    """Column of arbitrary Python values"""
+
+    def __init__(self):
+        self.values = []
+
+    def append_missing(self):
+        self.values.append(_ABSENT)
+
+    def get(self, row_id):
+        return self.values[row_id]
+
+    def set(self, row_id, value):
+        self.values[row_id] = value
+        return True
+
+
+class _NumericColumn:
+    """Typed array column with a null mask"""
+
+    def __init__(self, typecode, python_type):
+        self.values = array(typecode)
+        self.mask = bytearray()
+        self.python_type = python_type
+
+    def append_missing(self):
+        self.values.append(0)
+        self.mask.append(_MISSING)
+
+    def get(self, row_id):
+        state = self.mask[row_id]
+        if state == _PRESENT:
+            return self.values[row_id]
+        return None if state == _NULL else _ABSENT
+
+    def set(self, row_id, value):
+        if value is _ABSENT or value is None:
+            self.mask[row_id] = _MISSING if value is _ABSENT else _NULL
+            return True
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return False
+        if self.python_type is int and not isinstance(value, int):
+            return False
+        try:
+            self.values[row_id] = self.python_type(value)
+        except OverflowError:
+            return False
+        self.mask[row_id] = _PRESENT
+        return True
+
+
+class _BoolColumn:
+    """Signed byte column holding booleans and null markers"""
+
+    def __init__(self):
+        self.values = array('b')
+
+    def append_missing(self):
+        self.values.append(_BOOL_MISSING)
+
+    def get(self, row_id):
+        value = self.values[row_id]
+        if value >= 0:
+            return bool(value)
+        return None if value == _BOOL_NULL else _ABSENT
+
+    def set(self, row_id, value):
+        if value is _ABSENT:
+            self.values[row_id] = _BOOL_MISSING
+        elif value is None:
+            self.values[row_id] = _BOOL_NULL
+        elif isinstance(value, bool):
+            self.values[row_id] = int(value)
+        else:
+            return False
+        return True
+
+
+class _CategoryColumn:
+    """Dictionary-encoded column; code 0 is missing and code 1 is null"""
+
+    def __init__(self):
+        self.codes = array('I')
+        self.dictionary = [_ABSENT, None]
+        self.lookup = {}
+
+    def append_missing(self):
+        self.codes.append(0)
+
+    def get(self, row_id):
+        return self.dictionary[self.codes[row_id]]
+
+    def set(self, row_id, value):
+        if value is _ABSENT:
+            code = 0
+        elif value is None:
+            code = 1
+        else:
+            try:
+                code = self.lookup.get(value)
+            except TypeError:
+                return False
+            if code is None:
+                code = len(self.dictionary)
+                self.dictionary.append(value)
+                self.lookup[value] = code
+        self.codes[row_id] = code
+        return True
+
+
+_COLUMN_TYPES = {
+    "float": lambda: _NumericColumn('d', float),
+    "int": lambda: _NumericColumn('q', int),
+    "bool": _BoolColumn,
+    "category": _CategoryColumn,
+    "object": _ObjectColumn,
+}
+
+
+class _RowView(Mapping):
+    """
+    Read-only view of one stored entity, reading columns on demand.
+
+    A row is never written again once a view of it may exist: writes append
+    new rows and compaction moves live rows to new columns, so a view keeps
+    reading the entity as it was when the view was made.
+    """
+
+    __slots__ = ("_columns", "_row_id")
+
+    def __init__(self, columns, row_id):
+        self._columns = columns
+        self._row_id = row_id
+
+    def __getitem__(self, field):
+        column = self._columns.get(field)
+        if column is None:
+            raise KeyError(field)
+        value = column.get(self._row_id)
+        if value is _ABSENT:
+            raise KeyError(field)
+        return value
+
+    def get(self, field, default=None):
+        column = self._columns.get(field)
+        if column is None:
+            return default
+        value = column.get(self._row_id)
+        return default if value is _ABSENT else value
+
+    def __contains__(self, field):
+        column = self._columns.get(field)
+        return column is not None and column.get(self._row_id) is not _ABSENT
+
+    def __iter__(self):
+        row_id = self._row_id
+        return (field for field, column in self._columns.items()
+                if column.get(row_id) is not _ABSENT)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def copy(self):
+        return dict(self)
+
+
+class _ColumnTable:
+    """
+    Mapping of entity key to row view, backed by per-field columns.
+
+    Every write appends a row, and the replaced or deleted row is left as it
+    was for views still reading it. Once dead rows outnumber live ones, live
+    rows are copied to new columns and the old ones are left to those views.
+    """
+
+    # Dead rows tolerated before compacting, whatever the number of live ones
+    min_compaction = 1024
+
+    def __init__(self, schema):
+        self.schema = dict(schema)
+        self.columns = {field: _COLUMN_TYPES[kind]() for field, kind in self.schema.items()}
+        self.row_ids = {}
+        self.row_count = 0
+        self.dead_rows = 0
+
+    def _add_column(self, field, kind="object"):
+        column = _COLUMN_TYPES[kind]()
+        for _ in range(self.row_count):
+            column.append_missing()
+        self.columns[field] = column
+        return column
+
+    def _demote(self, field):
+        """Replace a typed column with an object column when a value does not fit"""
+        old = self.columns[field]
+        column = _ObjectColumn()
+        column.values = [old.get(row_id) for row_id in range(self.row_count)]
+        self.columns[field] = column
+        return column
+
+    def __len__(self):
+        return len(self.row_ids)
+
+    def __contains__(self, key):
+        return key in self.row_ids
+
+    def __iter__(self):
+        return iter(self.row_ids)
+
+    def __getitem__(self, key):
+        return _RowView(self.columns, self.row_ids[key])
+
+    def get(self, key, default=None):
+        row_id = self.row_ids.get(key)
+        return default if row_id is None else _RowView(self.columns, row_id)
+
+    def __setitem__(self, key, entity):
+        if key in self.row_ids:
+            self._retire()
+        row_id = self.row_count
+        self.row_count += 1
+        for column in self.columns.values():
+            column.append_missing()
+        self.row_ids[key] = row_id
+        for field, value in entity.items():
+            column = self.columns.get(field) or self._add_column(field)
+            if not column.set(row_id, value):
+                self._demote(field).set(row_id, value)
+
+    def pop(self, key):
+        row_id = self.row_ids.pop(key)
+        entity = dict(_RowView(self.columns, row_id))
+        self._retire()
+        return entity
+
+    def _retire(self):
+        self.dead_rows += 1
+        if self.dead_rows > max(len(self.row_ids), self.min_compaction):
+            self._compact()
+
+    def _compact(self):
+        """Copy the live rows to new columns, in key order"""
+        columns, row_ids = self.columns, self.row_ids
+        self.columns = {field: _COLUMN_TYPES[kind]() for field, kind in self.schema.items()}
+        self.row_ids = {}
+        self.row_count = 0
+        self.dead_rows = 0
+        for key, row_id in row_ids.items():
+            self[key] = _RowView(columns, row_id)
+
+    def keys(self):
+        return self.row_ids.keys()
+
+    def values(self):
+        columns = self.columns
+        return (_RowView(columns, row_id) for row_id in self.row_ids.values())
+
+    def items(self):
+        columns = self.columns
+        return ((key, _RowView(columns, row_id)) for key, row_id in self.row_ids.items())
+
+    def clear(self):
+        self.columns = {field: _COLUMN_TYPES[kind]() for field, kind in self.schema.items()}
+        self.row_ids = {}
+        self.row_count = 0
+        self.dead_rows = 0
+
+
+class ColumnarEntityStore(EntityStore):
+    """EntityStore holding its entities column-wise according to a schema"""
+
+    def __init__(self, name, schema, indexed_fields=(), sorted_fields=(), counted_fields=(), searched_fields=()):
+        super().__init__(name, indexed_fields, sorted_fields, counted_fields, searched_fields)
+        self._rows = _ColumnTable(schema)
+
+    def materialize(self, entity):
+        return dict(entity)
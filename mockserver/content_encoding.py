@@ -0,0 +1,152 @@
+"""
+Response compression for the Dynamics 365 Finance mock server.
+
+ContentEncoder negotiates a Content-Encoding from the request's
+Accept-Encoding header and compresses responses with it:
+
+- gzip and deflate are always available; br and zstd are offered when the
+  brotli or zstandard package is installed
+- the client's quality values decide, and among equally acceptable codecs
+  the first in the configured order wins
+- bodies smaller than min_size are sent as they are, since compressing them
+  costs more time than it saves bytes
+- streamed responses are compressed chunk by chunk, so memory stays flat
+- cached responses are compressed once per codec by the response cache (see
+  ResponseCache.encoded) and the compressed copy is reused
+"""
+
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class _ZlibCodec:
+    """gzip or deflate (zlib format, as HTTP's deflate means) via zlib"""
+
+    def __init__(self, wbits, level):
+        self.wbits = wbits
+        self.level = level
+
+    def compress(self, body):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.wbits)
+        return compressor.compress(body) + compressor.flush()
+
+    def stream(self, chunks):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, self.wbits)
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+class _BrotliCodec:
+    def __init__(self, level):
+        self.level = level
+
+    def compress(self, body):
+        return brotli.compress(body, quality=self.level)
+
+    def stream(self, chunks):
+        compressor = brotli.Compressor(quality=self.level)
+        for chunk in chunks:
+            data = compressor.process(chunk)
+            if data:
+                yield data
+        yield compressor.finish()
+
+
+class _ZstdCodec:
+    def __init__(self, level):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+
+    def compress(self, body):
+        return self.compressor.compress(body)
+
+    def stream(self, chunks):
+        compressor = self.compressor.compressobj()
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+# Codec factories by Content-Encoding token, with each codec's default level
+_CODECS = {
+    "zstd": (lambda level: _ZstdCodec(level), 3, zstandard is not None),
+    "br": (lambda level: _BrotliCodec(level), 4, brotli is not None),
+    "gzip": (lambda level: _ZlibCodec(31, level), 6, True),
+    "deflate": (lambda level: _ZlibCodec(15, level), 6, True),
+}
+
+
+class ContentEncoder:
+    """
+    Compresses Flask responses with the best codec a client accepts.
+
+    codecs lists the Content-Encoding tokens to offer in order of
+    preference; those whose package is missing are skipped. levels maps a
+    token to its compression level, defaulting to 6 for gzip and deflate, 4
+    for br and 3 for zstd.
+    """
+
+    def __init__(self, enabled=True, min_size=1024, codecs=("zstd", "br", "gzip", "deflate"), levels=None):
+        self.enabled = enabled
+        self.min_size = min_size
+        levels = levels or {}
+        self.codecs = {}
+        for name in codecs:
+            if name not in _CODECS:
+                raise ValueError(f"unsupported content encoding {name!r}")
+            factory, level, available = _CODECS[name]
+            if available:
+                self.codecs[name] = factory(levels.get(name, level))
+
+    def init_app(self, app):
+        app.after_request(self.after_request)
+
+    def negotiate(self, accept_encodings):
+        """Return the codec token to encode a response with, or None for identity"""
+        if not self.enabled or not accept_encodings:
+            return None
+        best, best_quality = None, 0
+        for name in self.codecs:
+            quality = accept_encodings.quality(name)
+            if quality > best_quality:
+                best, best_quality = name, quality
+        return best
+
+    def compress(self, name, body):
+        return self.codecs[name].compress(body)
+
+    def after_request(self, response):
+        # $batch sub-responses are embedded in the batch body and never encoded
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or request.method == "HEAD" or "Content-Encoding" in response.headers
+                or request.environ.get("mockserver.batch_part")):
+            return response
+        response.vary.add("Accept-Encoding")
+        name = self.negotiate(request.accept_encodings)
+        if name is None:
+            return response
+        if response.is_streamed:
+            response.response = self.codecs[name].stream(response.iter_encoded())
+            response.headers.pop("Content-Length", None)
+        else:
+            body = response.get_data()
+            if len(body) < self.min_size:
+                return response
+            response.set_data(self.compress(name, body))
+        response.headers["Content-Encoding"] = name
+        return response
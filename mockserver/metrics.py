@@ -0,0 +1,238 @@
+"""
+Request instrumentation for the Dynamics 365 Finance mock server.
+
+Metrics wraps the WSGI app to record, per route template and method:
+
+- requests by status code
+- latency, from the start of the request until the last byte of the body
+  has been handed to the server (so streamed responses are timed in full),
+  in a log-linear histogram with ~3% relative precision in the spirit of
+  HdrHistogram, reported as p50/p90/p99/p999 quantiles
+- requests currently in flight
+- response body bytes
+
+plus any gauges registered by the app (store sizes, cache statistics). The
+whole registry is rendered in the Prometheus text exposition format.
+
+Recording costs two clock reads, one lock round-trip and a few integer
+increments per request, so it can stay on during load tests.
+"""
+
+import threading
+import time
+
+from flask import request
+
+
+# Top bits kept per value: 2**_PRECISION_BITS / 2 sub-buckets per power of two
+_PRECISION_BITS = 6
+_SUB_BUCKETS = 1 << _PRECISION_BITS
+_HALF = _SUB_BUCKETS // 2
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+
+class LatencyHistogram:
+    """Log-linear histogram of durations in microseconds"""
+
+    __slots__ = ("counts", "total", "sum")
+
+    def __init__(self):
+        self.counts = []
+        self.total = 0
+        self.sum = 0
+
+    @staticmethod
+    def _index(value):
+        if value < _SUB_BUCKETS:
+            return value
+        shift = value.bit_length() - _PRECISION_BITS
+        return shift * _HALF + (value >> shift)
+
+    @staticmethod
+    def _midpoint(index):
+        if index < _SUB_BUCKETS:
+            return index
+        shift = index // _HALF - 1
+        top = index - shift * _HALF
+        return (top << shift) + (1 << shift) // 2
+
+    def record(self, micros):
+        index = self._index(micros)
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.total += 1
+        self.sum += micros
+
+    def merge(self, other):
+        """Add the values recorded by another histogram to this one"""
+        counts = self.counts
+        if len(other.counts) > len(counts):
+            counts.extend([0] * (len(other.counts) - len(counts)))
+        for index, count in enumerate(other.counts):
+            counts[index] += count
+        self.total += other.total
+        self.sum += other.sum
+
+    def quantile(self, q):
+        """Return the value in microseconds at quantile q, or 0 when empty"""
+        if not self.total:
+            return 0
+        rank = max(1, -int(-q * self.total // 1))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self._midpoint(index)
+        return self._midpoint(len(self.counts) - 1)
+
+
+class _Series:
+    """Everything recorded for one route and method"""
+
+    __slots__ = ("statuses", "latency", "bytes")
+
+    def __init__(self):
+        self.statuses = {}
+        self.latency = LatencyHistogram()
+        self.bytes = 0
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+class _TimedBody:
+    """Response iterable that counts bytes and records the request when closed"""
+
+    __slots__ = ("metrics", "body", "environ", "started", "size")
+
+    def __init__(self, metrics, body, environ, started):
+        self.metrics = metrics
+        self.body = body
+        self.environ = environ
+        self.started = started
+        self.size = 0
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.size += len(chunk)
+            yield chunk
+
+    def close(self):
+        try:
+            close = getattr(self.body, "close", None)
+            if close is not None:
+                close()
+        finally:
+            self.metrics._finish(self.environ, self.started, self.size)
+
+
+class Metrics:
+    """Per-route request metrics recorded by a WSGI middleware"""
+
+    def __init__(self, enabled=True, prefix="mockserver"):
+        self.enabled = enabled
+        self.prefix = prefix
+        self._series = {}
+        self._in_flight = {}
+        self._gauges = []
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        # Label requests with their route template before any other hook can
+        # answer them, so throttled requests are attributed to their route
+        app.before_request_funcs.setdefault(None, []).insert(0, self._label_route)
+        app.wsgi_app = self._middleware(app.wsgi_app)
+
+    def register_gauge(self, name, help_text, collect):
+        """Add a gauge whose collect() returns a list of (labels dict, value)"""
+        self._gauges.append((name, help_text, collect))
+
+    def _label_route(self):
+        rule = request.url_rule
+        request.environ["mockserver.route"] = rule.rule if rule is not None else "<unmatched>"
+
+    def _middleware(self, wsgi_app):
+        def instrumented(environ, start_response):
+            if not self.enabled:
+                return wsgi_app(environ, start_response)
+            started = time.perf_counter()
+            method = environ.get("REQUEST_METHOD", "GET")
+            with self._lock:
+                self._in_flight[method] = self._in_flight.get(method, 0) + 1
+
+            def record_status(status, headers, exc_info=None):
+                environ["mockserver.status"] = status.split(" ", 1)[0]
+                return start_response(status, headers, exc_info)
+
+            try:
+                body = wsgi_app(environ, record_status)
+            except BaseException:
+                environ.setdefault("mockserver.status", "500")
+                self._finish(environ, started, 0)
+                raise
+            return _TimedBody(self, body, environ, started)
+        return instrumented
+
+    def _finish(self, environ, started, size):
+        micros = int((time.perf_counter() - started) * 1_000_000)
+        method = environ.get("REQUEST_METHOD", "GET")
+        key = (method, environ.get("mockserver.route", "<unmatched>"))
+        status = environ.get("mockserver.status", "500")
+        with self._lock:
+            self._in_flight[method] -= 1
+            series = self._series.get(key) or self._series.setdefault(key, _Series())
+            series.statuses[status] = series.statuses.get(status, 0) + 1
+            series.latency.record(micros)
+            series.bytes += size
+
+    def render(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        prefix = self.prefix
+        with self._lock:
+            series = sorted(((method, route, s) for (method, route), s in self._series.items()),
+                            key=lambda item: (item[1], item[0]))
+            requests_lines, latency_lines, flight_lines, bytes_lines = [], [], [], []
+            for method, route, s in series:
+                for status, count in sorted(s.statuses.items()):
+                    requests_lines.append(
+                        f"{prefix}_http_requests_total{_labels(route=route, method=method, status=status)} {count}")
+                for q in QUANTILES:
+                    latency_lines.append(
+                        f"{prefix}_http_request_duration_seconds"
+                        f"{_labels(route=route, method=method, quantile=q)} {s.latency.quantile(q) / 1e6:.6f}")
+                latency_lines.append(f"{prefix}_http_request_duration_seconds_sum"
+                                     f"{_labels(route=route, method=method)} {s.latency.sum / 1e6:.6f}")
+                latency_lines.append(f"{prefix}_http_request_duration_seconds_count"
+                                     f"{_labels(route=route, method=method)} {s.latency.total}")
+                bytes_lines.append(f"{prefix}_http_response_bytes_total{_labels(route=route, method=method)} {s.bytes}")
+            for method, count in sorted(self._in_flight.items()):
+                flight_lines.append(f"{prefix}_http_requests_in_flight{_labels(method=method)} {count}")
+
+        lines = [
+            f"# HELP {prefix}_http_requests_total Requests handled, by route template, method and status",
+            f"# TYPE {prefix}_http_requests_total counter",
+            *requests_lines,
+            f"# HELP {prefix}_http_request_duration_seconds Time until the last response byte was sent",
+            f"# TYPE {prefix}_http_request_duration_seconds summary",
+            *latency_lines,
+            f"# HELP {prefix}_http_requests_in_flight Requests currently being handled",
+            f"# TYPE {prefix}_http_requests_in_flight gauge",
+            *flight_lines,
+            f"# HELP {prefix}_http_response_bytes_total Response body bytes sent",
+            f"# TYPE {prefix}_http_response_bytes_total counter",
+            *bytes_lines,
+        ]
+        for name, help_text, collect in self._gauges:
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} gauge")
+            for labels, value in collect():
+                lines.append(f"{prefix}_{name}{_labels(**labels)} {value}")
+        return "\n".join(lines) + "\n"
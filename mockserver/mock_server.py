@@ -1,75 +1,693 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from datetime import datetime, timezone
-from dateutil.relativedelta import relativedelta
-import uuid
+from functools import wraps
+from itertools import count as counter, islice
+from urllib.parse import urlencode
+from werkzeug.http import unquote_etag
+import argparse
+import gc
+import os
+import re
 import json
+import time
+import uuid
+import zlib
+
+from odata_filter import compile_filter, parse_orderby, FilterError
+from store import EntityStore, encode_cursor, decode_cursor, transactions_lock
+from columnar import ColumnarEntityStore
+from partitions import PartitionedStore
+from openapi import load_spec, SpecError, ValidationError
+from imports import ImportManager, PackageError
+from rates import ExchangeRateStore, as_of_date
+from navigation import Navigations, NavigationError
+from search import compile_search, SearchError
+from seed_data import seed_stores
+from odata_batch import BatchExecutor, BatchError
+from response_cache import ResponseCache
+from content_encoding import ContentEncoder
+from throttling import ServiceProtection
+from metrics import Metrics
+from capture import TrafficCapture
+from snapshot import save_snapshot, load_snapshot, SnapshotError, WriteLog
 
 app = Flask(__name__)
 CORS(app)
 
+# Load server configuration from config.json next to this script
+def load_config(path=None):
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')
+    try:
+        with open(path) as config_file:
+            return json.load(config_file)
+    except FileNotFoundError:
+        return {}
+
+config = load_config()
+
+# Server-driven paging: collection responses never return more than this many
+# entities and emit @odata.nextLink with a $skiptoken cursor for the rest
+MAX_PAGE_SIZE = config.get("odata", {}).get("max_page_size", 10000)
+
+# Collection responses of at least this many entities are streamed with
+# chunked transfer encoding instead of being built in memory
+STREAM_THRESHOLD = config.get("odata", {}).get("stream_threshold", 1000)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Storage backend for entity sets: "dict" keeps one dict per entity, while
+# "columnar" stores each field column-wise with dictionary-encoded strings
+STORE_BACKEND = config.get("store", {}).get("backend", "dict")
+
+# Vendors and customers are partitioned by company (dataAreaId). Requests see
+# the default company only, unless they pass cross-company=true, in which case
+# the partitions are queried on this many threads (default: one per CPU)
+DEFAULT_COMPANY = config.get("odata", {}).get("default_company", "USMF")
+FANOUT_WORKERS = config.get("store", {}).get("fanout_workers") or os.cpu_count() or 1
+
+# Delta queries: each entity set logs this many of its latest changes, and
+# $deltatoken links older than that, or issued before a restart, return 410
+MAX_TRACKED_CHANGES = config.get("change_tracking", {}).get("max_changes", 1000000)
+DELTA_EPOCH = uuid.uuid4().hex[:8]
+
+# OpenAPI description of the service, relative to this script. Request bodies
+# are checked against its schemas by validators compiled here at startup, and
+# operations it lists that no handler below implements get generated routes
+SPEC_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         config.get("openapi", {}).get("spec", "../docs/spec/openapi.json"))
+try:
+    service_spec = load_spec(SPEC_PATH)
+except SpecError as e:
+    raise SystemExit(f"Cannot load the OpenAPI spec: {e}")
+
+# Encoded responses of read-mostly GET endpoints, reused until the data behind
+# them changes
+response_cache = ResponseCache(**config.get("response_cache", {}))
+
+# Emulated service protection limits: 429 throttling, concurrency caps and
+# injected latency, configured per route in config.json
+service_protection = ServiceProtection(config.get("service_protection", {}))
+service_protection.init_app(app)
+
+# Accept-Encoding negotiation: responses of at least min_size bytes are
+# compressed with the best codec the client accepts
+content_encoder = ContentEncoder(**config.get("compression", {}))
+content_encoder.init_app(app)
+
+# Per-route request counters, latency histograms and gauges served on /metrics
+metrics = Metrics(enabled=config.get("metrics", {}).get("enabled", True))
+metrics.init_app(app)
+
+# Request log for replay_traffic.py, written off the request threads; off
+# until a capture path is set
+traffic_capture = TrafficCapture(**config.get("capture", {}))
+traffic_capture.init_app(app)
+
+# Column types used by the columnar backend
+VENDOR_SCHEMA = {
+    "@odata.etag": "object",
+    "dataAreaId": "category",
+    "VendorAccount": "object",
+    "OrganizationName": "object",
+    "VendorGroupId": "category",
+    "AddressCountryRegionId": "category",
+    "PurchaseCurrencyCode": "category",
+    "IsActive": "bool"
+}
+CUSTOMER_SCHEMA = {
+    "@odata.etag": "object",
+    "dataAreaId": "category",
+    "CustomerAccount": "object",
+    "OrganizationName": "object",
+    "NameAlias": "object",
+    "CustomerGroupId": "category",
+    "AddressCountryRegionId": "category",
+    "SalesCurrencyCode": "category",
+    "PersonGender": "category",
+    "CreditLimit": "float",
+    "IsActive": "bool"
+}
+SYSTEM_USER_SCHEMA = {
+    "@odata.etag": "object",
+    "UserId": "object",
+    "UserName": "object",
+    "Email": "object",
+    "IsActive": "bool"
+}
+
+# Helper function to create an entity store for the configured backend
+def create_store(name, schema, indexed_fields=(), sorted_fields=(), counted_fields=(), searched_fields=()):
+    if STORE_BACKEND == "columnar":
+        store = ColumnarEntityStore(name, schema, indexed_fields, sorted_fields, counted_fields, searched_fields)
+    else:
+        store = EntityStore(name, indexed_fields, sorted_fields, counted_fields, searched_fields)
+    store.max_changes = MAX_TRACKED_CHANGES
+    return store
+
+# Helper function to create an entity store with one partition per company
+def create_company_store(name, schema, indexed_fields=(), sorted_fields=(), counted_fields=(),
+                         searched_fields=()):
+    store = PartitionedStore(
+        name,
+        lambda partition_name: create_store(partition_name, schema, indexed_fields, sorted_fields,
+                                            counted_fields, searched_fields),
+        fanout_workers=FANOUT_WORKERS
+    )
+    store.max_changes = MAX_TRACKED_CHANGES
+    return store
+
 # In-memory data stores
-vendors = {}
-customers = {}
-system_users = {}
+vendors = create_company_store(
+    "VendorsV2",
+    VENDOR_SCHEMA,
+    indexed_fields=("dataAreaId", "VendorGroupId", "IsActive"),
+    sorted_fields=("VendorAccount", "OrganizationName"),
+    counted_fields=(("VendorGroupId", "IsActive"),),
+    searched_fields=("OrganizationName",)
+)
+customers = create_company_store(
+    "CustomersV3",
+    CUSTOMER_SCHEMA,
+    indexed_fields=("dataAreaId", "CustomerGroupId", "IsActive"),
+    sorted_fields=("CustomerAccount", "OrganizationName", "CreditLimit"),
+    counted_fields=(("CustomerGroupId", "IsActive"),),
+    searched_fields=("OrganizationName", "NameAlias")
+)
+system_users = create_store("SystemUsers", SYSTEM_USER_SCHEMA)
+# Exchange rates are kept as one rate history per rate type and currency pair
+EXCHANGE_RATES = config.get("exchange_rates", {})
+DEFAULT_RATE_TYPE = EXCHANGE_RATES.get("default_rate_type", "SPOT")
+exchange_rates = ExchangeRateStore(
+    pivot_currency=EXCHANGE_RATES.get("pivot_currency", "USD"),
+    max_memoized=EXCHANGE_RATES.get("max_memoized", 100000)
+)
 
 # Helper function to generate OData response format
-def odata_response(data, count=None, context_url=None):
+def odata_response(data, count=None, context_url=None, next_link=None, delta_link=None):
     response = {
         "@odata.context": context_url or "https://your-org.cloud.onebox.dynamics.com/data/$metadata",
         "value": data
     }
     if count is not None:
         response["@odata.count"] = count
+    if next_link is not None:
+        response["@odata.nextLink"] = next_link
+    if delta_link is not None:
+        response["@odata.deltaLink"] = delta_link
     return response
 
-# Helper function to generate etag
+# Helper function to stream an OData collection response in chunks, so peak
+# memory stays flat regardless of how many entities are returned
+def stream_odata_response(entries, limit, project, count=None, context_url=None, next_link_for=None,
+                          delta_link=None):
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    head = {"@odata.context": context_url or "https://your-org.cloud.onebox.dynamics.com/data/$metadata"}
+    if count is not None:
+        head["@odata.count"] = count
+    chunk = [encode(head)[:-1], ',"value":[']
+    size = 0
+    emitted = 0
+    last = None
+    more = False
+    for key, row in entries:
+        if emitted == limit:
+            more = True
+            break
+        text = encode(project(row))
+        chunk.append(',' + text if emitted else text)
+        size += len(text) + 1
+        emitted += 1
+        last = (key, row)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    tail = ']'
+    next_link = next_link_for(*last) if more and next_link_for else None
+    if next_link is not None:
+        tail += ',"@odata.nextLink":' + encode(next_link)
+    elif delta_link is not None:
+        tail += ',"@odata.deltaLink":' + encode(delta_link)
+    chunk.append(tail + '}')
+    yield ''.join(chunk)
+
+# Entity versions are drawn from one process-wide counter, so an entity's
+# ETag only changes when it is written and never repeats for another version
+entity_versions = counter(1)
+
+# Helper function to generate etag for a new version of an entity
 def generate_etag():
-    return f'W/"{str(uuid.uuid4())}"'
+    return f'W/"{next(entity_versions)}"'
+
+# Helper function to build a normalized key for a GET request from its path,
+# its query options in a canonical order and its Prefer header
+def request_key():
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return f"{request.path}?{query}|{request.headers.get('Prefer', '')}"
+
+# Helper function to build the ETag of a collection response from the version
+# of its entity set and everything in the request that shapes the response
+def collection_etag(version):
+    return f'W/"{version}-{zlib.crc32(request_key().encode()):08x}"'
+
+# Helper function to check an If-Match/If-None-Match header against an ETag.
+# OData ETags are weak, so the weak comparison is used for both headers
+def etag_matches(conditions, etag):
+    return conditions.contains_weak(unquote_etag(etag)[0])
+
+# Helper function to answer a conditional GET whose cached copy is still valid
+def not_modified(etag):
+    if etag_matches(request.if_none_match, etag):
+        response = Response(status=304)
+        response.headers['ETag'] = etag
+        return response
+    return None
+
+# Helper function to return a single entity with its ETag header
+def entity_response(entity, status=200):
+    response = jsonify(entity)
+    response.status_code = status
+    response.headers['ETag'] = entity["@odata.etag"]
+    return response
+
+# Decorator serving a GET endpoint from the response cache. version_of returns
+# the current version of the data behind the endpoint; cached responses built
+# from an older version are discarded and rebuilt
+def cached_response(version_of):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            # Streamed responses are never buffered, so there is nothing to cache
+            if 'odata.streaming=true' in request.headers.get('Accept', ''):
+                return view(*args, **kwargs)
+            key = request_key()
+            # Read the version first so a concurrent write only ever makes the
+            # entry stale, never labels newer data with an older version
+            version = version_of()
+            entry = response_cache.get(key, version)
+            if entry is None:
+                response = app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                body = response.get_data()
+                headers = {name: value for name, value in response.headers.items()
+                           if name.lower() != 'content-length'}
+                headers.setdefault('ETag', f'W/"{zlib.crc32(body):08x}"')
+                entry = response_cache.put(key, version, body, headers, g.get('result_rows', 0))
+                if entry is None:
+                    return response
+            g.result_rows = entry.rows
+            return not_modified(entry.headers['ETag']) or cached_body(entry)
+        return wrapper
+    return decorator
+
+# Helper function to send a cached response, compressed with the best encoding
+# the client accepts; each encoding of a cached body is compressed only once
+def cached_body(entry):
+    response = Response(entry.body, headers=entry.headers)
+    encoding = content_encoder.negotiate(request.accept_encodings)
+    if encoding is not None and len(entry.body) >= content_encoder.min_size:
+        response.set_data(response_cache.encoded(
+            entry, encoding, lambda body: content_encoder.compress(encoding, body)))
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+class PreconditionFailed(Exception):
+    """Raised inside an atomic update when If-Match names a stale ETag"""
+
+# Helper function to allocate an unused key from a store's sequence; safe to
+# call from concurrent requests as each sequence number is handed out once
+def allocate_key(store, format_key):
+    while True:
+        key = format_key(store.next_sequence())
+        if key not in store:
+            return key
+
+# Helper function to allocate an unused account number within a company
+def allocate_account(store, data_area_id, prefix):
+    key = allocate_key(store, lambda number: f"{data_area_id}_{prefix}{number:06d}")
+    return key[len(data_area_id) + 1:]
+
+# Helper function to read a JSON request body and check it against the entity
+# type of an entity set. Returns (data, None), or (None, error response) when
+# the body does not match the schema
+def read_entity(entity_set, partial=False):
+    data = request.get_json(silent=True)
+    spec = service_spec.entity_sets.get(entity_set)
+    try:
+        if spec is None:
+            if not isinstance(data, dict):
+                raise ValidationError("request body must be a JSON object")
+        elif partial:
+            spec.validate_update(data)
+        else:
+            spec.validate_create(data)
+    except ValidationError as e:
+        return None, (jsonify({"error": f"Invalid {spec.entity_type if spec else entity_set}: {e}"}), 400)
+    return data, None
+
+# Helper function to apply a PATCH body to a stored entity atomically. Key
+# fields identify the entity and are left unchanged
+def patch_entity(store, key, data, key_fields, label):
+    if_match = request.if_match if 'If-Match' in request.headers else None
+    
+    def apply_changes(entity):
+        # Only update the version the client last read, when it names one
+        if if_match is not None and not etag_matches(if_match, entity["@odata.etag"]):
+            raise PreconditionFailed()
+        
+        # Update fields from request
+        for field, value in data.items():
+            if field != "@odata.etag" and field not in key_fields:
+                entity[field] = value
+        
+        # Update etag
+        entity["@odata.etag"] = generate_etag()
+    
+    # Read, modify and store the entity atomically
+    try:
+        entity = store.update(key, apply_changes)
+    except PreconditionFailed:
+        return jsonify({"error": f"{label} has been modified since it was read (If-Match failed)"}), 412
+    if entity is None:
+        return jsonify({"error": f"{label} not found"}), 404
+    
+    return entity_response(entity)
 
 # Helper function to get current ISO datetime
 def get_current_datetime():
     return datetime.now(timezone.utc).isoformat()
 
+# Helper function to read the client's preferred page size from the Prefer header
+def preferred_page_size():
+    match = re.search(r'odata\.maxpagesize=(\d+)', request.headers.get('Prefer', ''))
+    if match and int(match.group(1)) > 0:
+        return min(int(match.group(1)), MAX_PAGE_SIZE), True
+    return MAX_PAGE_SIZE, False
+
+# Helper function to return the companies a request can read: all of them with
+# cross-company=true, otherwise only the default company, as in D365
+def request_companies():
+    if request.args.get('cross-company', '').lower() == 'true':
+        return None
+    return (DEFAULT_COMPANY,)
+
+# Helper function to read $count=true|false; returns (include count, error response)
+def requested_count():
+    value = request.args.get('$count', 'true').lower()
+    if value not in ('true', 'false'):
+        return None, (jsonify({"error": f"Invalid $count: {value!r}, expected true or false"}), 400)
+    return value == 'true', None
+
+# Helper function to read $skip and $top as non-negative integers;
+# returns (skip, top or None, error response)
+def requested_paging():
+    values = {}
+    for name in ('$skip', '$top'):
+        value = request.args.get(name)
+        if value is None:
+            continue
+        if not value.strip().isdecimal():
+            return None, None, (jsonify({"error": f"Invalid {name}: {value!r}, expected a non-negative integer"}), 400)
+        values[name] = int(value)
+    return values.get('$skip', 0), values.get('$top'), None
+
+# Helper function to answer GET {entity set}/$count with the store's maintained
+# counts, honoring $filter and cross-company as a collection GET does
+def count_entity_set(store):
+    compiled_filter, error = requested_filter(store.name)
+    if error is not None:
+        return error
+    compiled_search, error = requested_search(store)
+    if error is not None:
+        return error
+    if isinstance(store, PartitionedStore):
+        return str(store.count(compiled_filter, request_companies(), compiled_search))
+    return str(store.count(compiled_filter, search=compiled_search))
+
+# Helper function to compile the request's $filter for an entity set, checking
+# that properties tested on their own are boolean ones; returns (compiled
+# filter or None, error response)
+def requested_filter(entity_set):
+    text = request.args.get('$filter', '')
+    if not text.strip():
+        return None, None
+    try:
+        compiled_filter = compile_filter(text)
+        spec_set = service_spec.entity_sets.get(entity_set)
+        if spec_set is not None and compiled_filter.condition_properties:
+            compiled_filter.check_types({field: schema.get("type") for field, schema in spec_set.properties.items()})
+    except FilterError as e:
+        return None, (jsonify({"error": f"Invalid $filter: {e}"}), 400)
+    return compiled_filter, None
+
+# Helper function to compile the request's $search for an entity store;
+# returns (compiled search or None, error response)
+def requested_search(store):
+    text = request.args.get('$search', '')
+    if not text.strip():
+        return None, None
+    if not store.searched_fields():
+        return None, (jsonify({"error": f"$search is not supported on {store.name}"}), 400)
+    try:
+        return compile_search(text), None
+    except SearchError as e:
+        return None, (jsonify({"error": f"Invalid $search: {e}"}), 400)
+
+# Helper function to parse the request's $expand of an entity set's navigation
+# properties; returns (expansions, error response)
+def requested_expansions(entity_set):
+    text = request.args.get('$expand', '')
+    if not text.strip():
+        return (), None
+    try:
+        return navigations.parse(entity_set, text), None
+    except NavigationError as e:
+        return None, (jsonify({"error": f"Invalid $expand: {e}"}), 400)
+
+# Helper function to return the version of the data a GET of an entity set
+# reads: its store's, joined with those of the entity sets it expands
+def expanded_version(store, entity_set):
+    expansions, _ = requested_expansions(entity_set)
+    if not expansions:
+        return store.version
+    return ".".join(str(target.version) for target in (store, *navigations.targets(expansions)))
+
+# Helper function to add expanded navigation properties to projected entities
+def with_expansions(project, expansions):
+    if not expansions:
+        return project
+    def expanded(row):
+        entity = dict(project(row))
+        for expansion in expansions:
+            entity[expansion.property.name] = expansion.expand(row)
+        return entity
+    return expanded
+
+# Helper functions to encode a store version as a $deltatoken and back. A
+# token issued by another server process decodes to None
+def encode_delta_token(version):
+    return f"{version}.{DELTA_EPOCH}"
+
+def decode_delta_token(token):
+    version, _, epoch = token.partition('.')
+    if not version.isdigit() or not epoch:
+        raise ValueError("Invalid $deltatoken")
+    return int(version) if epoch == DELTA_EPOCH else None
+
+# Helper function to build the delta link of the current request for changes
+# after a store version; it keeps the options that shape the delta
+def delta_link_for(version):
+    link_args = {name: value for name, value in request.args.items()
+                 if name in ('$filter', '$search', '$select', 'cross-company')}
+    link_args['$deltatoken'] = encode_delta_token(version)
+    return f"{request.base_url}?{urlencode(link_args)}"
+
+# Helper function to answer a $deltatoken request from the store's change log.
+# Changed entities that match $filter are returned in full, deleted ones and
+# ones that no longer match as $deletedEntity entries
+def delta_response(store, entity_set, key_fields, token, compiled_filter, compiled_search, project, etag):
+    try:
+        since = decode_delta_token(token)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    page_size, prefer_applied = preferred_page_size()
+    changes = store.changes(since, page_size) if since is not None else None
+    if changes is None:
+        return jsonify({"error": "The $deltatoken has expired, reload the entity set for a new delta link"}), 410
+    entries, through, more = changes
+    companies = request_companies() if isinstance(store, PartitionedStore) else None
+    matches = compiled_filter.predicate if compiled_filter is not None else None
+    if compiled_search is not None:
+        searched = compiled_search.predicate(store.searched_fields())
+        matches = searched if matches is None else (lambda row, matched=matches: matched(row) and searched(row))
+
+    context_url = f"https://your-org.cloud.onebox.dynamics.com/data/$metadata#{entity_set}"
+    values = []
+    for key, row in entries:
+        # Changes in companies the request cannot see are left out
+        if companies is not None and store.partition_of(key) not in companies:
+            continue
+        if row is not None and (matches is None or matches(row)):
+            values.append(project(row))
+        else:
+            key_values = key.split('_', len(key_fields) - 1)
+            entity_id = ",".join(f"{field}='{value}'" for field, value in zip(key_fields, key_values))
+            values.append({
+                "@odata.context": f"{context_url}/$deletedEntity",
+                "id": f"{entity_set}({entity_id})",
+                "reason": "deleted" if row is None else "changed"
+            })
+    g.result_rows = len(values)
+
+    link = delta_link_for(through)
+    response = jsonify(odata_response(
+        values,
+        context_url=f"{context_url}/$delta",
+        next_link=link if more else None,
+        delta_link=None if more else link
+    ))
+    if prefer_applied:
+        response.headers['Preference-Applied'] = f'odata.maxpagesize={page_size}'
+    response.headers['ETag'] = etag
+    return response
+
+# Helper function to apply OData query options to an entity store
+def query_entity_set(store, entity_set, key_fields):
+    skip, top, error = requested_paging()
+    if error is not None:
+        return error
+    orderby = request.args.get('$orderby', '')
+    select_fields = request.args.get('$select', '')
+    skip_token = request.args.get('$skiptoken', '')
+    delta_token = request.args.get('$deltatoken')
+    include_count, error = requested_count()
+    if error is not None:
+        return error
+    expansions, error = requested_expansions(entity_set)
+    if error is not None:
+        return error
+
+    # Revalidate cached copies first; the version is read before querying so
+    # a concurrent write can only make the ETag stale, never the body, and is
+    # resent to delta readers rather than missed
+    version = store.version
+    etag = collection_etag(expanded_version(store, entity_set))
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
+
+    # Apply filter and ordering, served from the store's indexes where possible
+    compiled_filter, error = requested_filter(entity_set)
+    if error is not None:
+        return error
+    try:
+        ordering = parse_orderby(orderby)
+    except FilterError as e:
+        return jsonify({"error": f"Invalid $orderby: {e}"}), 400
+    compiled_search, error = requested_search(store)
+    if error is not None:
+        return error
+
+    # Apply field selection if specified, reading only the selected fields
+    project = store.materialize
+    if select_fields:
+        fields = [field.strip() for field in select_fields.split(',')]
+        def project(entity):
+            selected_entity = {field: entity.get(field) for field in fields if field in entity}
+            selected_entity['@odata.etag'] = entity.get('@odata.etag')
+            return selected_entity
+    project = with_expansions(project, expansions)
+
+    # Delta query: only the entities changed since the token was issued
+    if delta_token is not None:
+        return delta_response(store, entity_set, key_fields, delta_token, compiled_filter, compiled_search,
+                              project, etag)
+
+    # Resume from the keyset cursor of the previous page, if any, keeping the
+    # store version of the first page for the final delta link
+    after = None
+    read_version = version
+    if skip_token:
+        try:
+            after, first_version = decode_cursor(skip_token, ordering)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        if first_version is not None:
+            read_version = first_version
+        skip = 0
+    if isinstance(store, PartitionedStore):
+        entries, count = store.query(compiled_filter, ordering, after, companies=request_companies(),
+                                     search=compiled_search)
+    else:
+        entries, count = store.query(compiled_filter, ordering, after, search=compiled_search)
+
+    # Apply pagination, capped at the server page size
+    page_size, prefer_applied = preferred_page_size()
+    limit = page_size if top is None else min(top, page_size)
+    window = islice(entries, skip, skip + limit + 1)
+
+    base_url = request.base_url
+    next_args = {name: value for name, value in request.args.items()
+                 if name not in ('$skip', '$skiptoken', '$top')}
+
+    def next_link_for(last_key, last_row):
+        if top is not None and top <= limit:
+            return None
+        link_args = dict(next_args)
+        if top is not None:
+            link_args['$top'] = top - limit
+        link_args['$skiptoken'] = encode_cursor(last_key, last_row, ordering, read_version)
+        return f"{base_url}?{urlencode(link_args)}"
+
+    # The last page of a whole entity set links to the changes made since its
+    # first page was read
+    delta_link = delta_link_for(read_version) if top is None and skip == 0 else None
+
+    # Entities in this page, which service protection latency scales with
+    g.result_rows = max(0, min(limit, count - skip))
+
+    context_url = f"https://your-org.cloud.onebox.dynamics.com/data/$metadata#{entity_set}"
+    streaming = 'odata.streaming=true' in request.headers.get('Accept', '')
+    if streaming or min(limit, count) >= STREAM_THRESHOLD:
+        response = Response(
+            stream_odata_response(window, limit, project, count if include_count else None, context_url,
+                                  next_link_for, delta_link),
+            mimetype='application/json'
+        )
+    else:
+        page = list(window)
+        next_link = next_link_for(*page[limit - 1]) if len(page) > limit else None
+        response = jsonify(odata_response(
+            [project(row) for _, row in page[:limit]],
+            count=count if include_count else None,
+            context_url=context_url,
+            next_link=next_link,
+            delta_link=None if next_link is not None else delta_link
+        ))
+    if prefer_applied:
+        response.headers['Preference-Applied'] = f'odata.maxpagesize={page_size}'
+    response.headers['ETag'] = etag
+    return response
+
 # Vendor endpoints
 @app.route('/VendorsV2', methods=['GET'])
+@cached_response(lambda: expanded_version(vendors, "VendorsV2"))
 def get_vendors():
     """Get all vendors"""
-    vendor_list = list(vendors.values())
-    
-    # Handle OData query parameters
-    skip = request.args.get('$skip', type=int, default=0)
-    top = request.args.get('$top', type=int, default=len(vendor_list))
-    filter_query = request.args.get('$filter', '')
-    select_fields = request.args.get('$select', '')
-    
-    # Apply pagination
-    paginated_vendors = vendor_list[skip:skip + top]
-    
-    # Apply field selection if specified
-    if select_fields:
-        fields = [field.strip() for field in select_fields.split(',')]
-        filtered_vendors = []
-        for vendor in paginated_vendors:
-            filtered_vendor = {field: vendor.get(field) for field in fields if field in vendor}
-            filtered_vendor['@odata.etag'] = vendor.get('@odata.etag')
-            filtered_vendors.append(filtered_vendor)
-        paginated_vendors = filtered_vendors
-    
-    return jsonify(odata_response(
-        paginated_vendors, 
-        count=len(vendor_list),
-        context_url="https://your-org.cloud.onebox.dynamics.com/data/$metadata#VendorsV2"
-    ))
+    return query_entity_set(vendors, "VendorsV2", ("dataAreaId", "VendorAccount"))
 
 @app.route('/VendorsV2', methods=['POST'])
 def create_vendor():
     """Create a new vendor"""
-    data = request.get_json()
+    data, error = read_entity("VendorsV2")
+    if error is not None:
+        return error
     
     # Generate vendor account if not provided
     if 'VendorAccount' not in data or not data['VendorAccount']:
-        data['VendorAccount'] = f"V{len(vendors) + 1:06d}"
+        data['VendorAccount'] = allocate_account(vendors, data.get("dataAreaId", "USMF"), "V")
     
     # Set default values
     vendor = {
@@ -83,57 +701,46 @@ def create_vendor():
         "IsActive": data.get("IsActive", True)
     }
     
-    # Store vendor
+    # Store vendor, refusing to overwrite an existing account
     vendor_key = f"{vendor['dataAreaId']}_{vendor['VendorAccount']}"
-    vendors[vendor_key] = vendor
+    if not vendors.insert(vendor_key, vendor):
+        return jsonify({"error": "Vendor already exists"}), 409
     
-    return jsonify(vendor), 201
+    return entity_response(vendor, 201)
+
+@app.route("/VendorsV2(dataAreaId='<data_area_id>',VendorAccount='<vendor_account>')", methods=['GET'])
+def get_vendor(data_area_id, vendor_account):
+    """Get a single vendor"""
+    expansions, error = requested_expansions("VendorsV2")
+    if error is not None:
+        return error
+    vendor = vendors.get(f"{data_area_id}_{vendor_account}")
+    if vendor is None:
+        return jsonify({"error": "Vendor not found"}), 404
+    return not_modified(vendor["@odata.etag"]) or entity_response(with_expansions(vendors.materialize, expansions)(vendor))
 
 @app.route('/VendorsV2/$count', methods=['GET'])
 def get_vendors_count():
-    """Get count of vendors"""
-    return str(len(vendors))
+    """Get count of vendors, optionally filtered"""
+    return count_entity_set(vendors)
 
 # Customer endpoints
 @app.route('/CustomersV3', methods=['GET'])
+@cached_response(lambda: expanded_version(customers, "CustomersV3"))
 def get_customers():
     """Get all customers"""
-    customer_list = list(customers.values())
-    
-    # Handle OData query parameters
-    skip = request.args.get('$skip', type=int, default=0)
-    top = request.args.get('$top', type=int, default=len(customer_list))
-    filter_query = request.args.get('$filter', '')
-    orderby = request.args.get('$orderby', '')
-    select_fields = request.args.get('$select', '')
-    
-    # Apply pagination
-    paginated_customers = customer_list[skip:skip + top]
-    
-    # Apply field selection if specified
-    if select_fields:
-        fields = [field.strip() for field in select_fields.split(',')]
-        filtered_customers = []
-        for customer in paginated_customers:
-            filtered_customer = {field: customer.get(field) for field in fields if field in customer}
-            filtered_customer['@odata.etag'] = customer.get('@odata.etag')
-            filtered_customers.append(filtered_customer)
-        paginated_customers = filtered_customers
-    
-    return jsonify(odata_response(
-        paginated_customers, 
-        count=len(customer_list),
-        context_url="https://your-org.cloud.onebox.dynamics.com/data/$metadata#CustomersV3"
-    ))
+    return query_entity_set(customers, "CustomersV3", ("dataAreaId", "CustomerAccount"))
 
 @app.route('/CustomersV3', methods=['POST'])
 def create_customer():
     """Create a new customer"""
-    data = request.get_json()
+    data, error = read_entity("CustomersV3")
+    if error is not None:
+        return error
     
     # Generate customer account if not provided
     if 'CustomerAccount' not in data or not data['CustomerAccount']:
-        data['CustomerAccount'] = f"C{len(customers) + 1:06d}"
+        data['CustomerAccount'] = allocate_account(customers, data.get("dataAreaId", "USMF"), "C")
     
     # Set default values
     customer = {
@@ -150,110 +757,179 @@ def create_customer():
         "IsActive": data.get("IsActive", True)
     }
     
-    # Store customer
+    # Store customer, refusing to overwrite an existing account
     customer_key = f"{customer['dataAreaId']}_{customer['CustomerAccount']}"
-    customers[customer_key] = customer
+    if not customers.insert(customer_key, customer):
+        return jsonify({"error": "Customer already exists"}), 409
     
-    return jsonify(customer), 201
+    return entity_response(customer, 201)
+
+@app.route("/CustomersV3(dataAreaId='<data_area_id>',CustomerAccount='<customer_account>')", methods=['GET'])
+def get_customer(data_area_id, customer_account):
+    """Get a single customer"""
+    expansions, error = requested_expansions("CustomersV3")
+    if error is not None:
+        return error
+    customer = customers.get(f"{data_area_id}_{customer_account}")
+    if customer is None:
+        return jsonify({"error": "Customer not found"}), 404
+    return not_modified(customer["@odata.etag"]) or entity_response(
+        with_expansions(customers.materialize, expansions)(customer))
 
 @app.route("/CustomersV3(dataAreaId='<data_area_id>',CustomerAccount='<customer_account>')", methods=['PATCH'])
 def update_customer(data_area_id, customer_account):
     """Update an existing customer"""
-    customer_key = f"{data_area_id}_{customer_account}"
-    
-    if customer_key not in customers:
-        return jsonify({"error": "Customer not found"}), 404
-    
-    data = request.get_json()
-    customer = customers[customer_key].copy()
-    
-    # Update fields from request
-    for field, value in data.items():
-        if field != "@odata.etag":
-            customer[field] = value
-    
-    # Update etag
-    customer["@odata.etag"] = generate_etag()
-    
-    # Store updated customer
-    customers[customer_key] = customer
-    
-    return jsonify(customer)
+    data, error = read_entity("CustomersV3", partial=True)
+    if error is not None:
+        return error
+    return patch_entity(customers, f"{data_area_id}_{customer_account}", data,
+                        ("dataAreaId", "CustomerAccount"), "Customer")
 
 @app.route('/CustomersV3/$count', methods=['GET'])
 def get_customers_count():
-    """Get count of customers"""
-    return str(len(customers))
+    """Get count of customers, optionally filtered"""
+    return count_entity_set(customers)
 
 # Exchange Rate endpoints
 @app.route('/ExchangeRates', methods=['GET'])
+@cached_response(lambda: exchange_rates.version)
 def get_exchange_rates():
-    """Get exchange rates"""
-    # Sample exchange rates data
-    exchange_rates = [
-        {
-            "@odata.etag": generate_etag(),
-            "FromCurrencyCode": "USD",
-            "ToCurrencyCode": "EUR",
-            "ExchangeRateValue": 0.85,
-            "ValidFromDate": "2025-01-01T00:00:00Z",
-            "RateTypeId": "SPOT"
-        },
-        {
-            "@odata.etag": generate_etag(),
-            "FromCurrencyCode": "USD",
-            "ToCurrencyCode": "GBP",
-            "ExchangeRateValue": 0.75,
-            "ValidFromDate": "2025-01-01T00:00:00Z",
-            "RateTypeId": "SPOT"
-        },
-        {
-            "@odata.etag": generate_etag(),
-            "FromCurrencyCode": "EUR",
-            "ToCurrencyCode": "USD",
-            "ExchangeRateValue": 1.18,
-            "ValidFromDate": "2025-01-01T00:00:00Z",
-            "RateTypeId": "SPOT"
-        },
-        {
-            "@odata.etag": generate_etag(),
-            "FromCurrencyCode": "GBP",
-            "ToCurrencyCode": "USD",
-            "ExchangeRateValue": 1.33,
-            "ValidFromDate": "2025-01-01T00:00:00Z",
-            "RateTypeId": "SPOT"
-        }
-    ]
+    """Get exchange rates, answering as-of filters from each pair's rate history"""
+    skip, top, error = requested_paging()
+    if error is not None:
+        return error
+    orderby = request.args.get('$orderby', '')
+    select_fields = request.args.get('$select', '')
+    include_count, error = requested_count()
+    if error is not None:
+        return error
+    # Exchange rates have no navigation properties, so any $expand is a 400
+    _, error = requested_expansions("ExchangeRates")
+    if error is not None:
+        return error
+    
+    etag = collection_etag(exchange_rates.version)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
     
-    # Handle filter parameter
-    filter_query = request.args.get('$filter', '')
+    compiled_filter, error = requested_filter("ExchangeRates")
+    if error is not None:
+        return error
+    try:
+        ordering = parse_orderby(orderby)
+    except FilterError as e:
+        return jsonify({"error": f"Invalid $orderby: {e}"}), 400
+    rates, count = exchange_rates.query(compiled_filter, ordering)
+    
+    # Apply pagination, capped at the server page size; later pages are
+    # linked by $skip, as rates have no single key field for a cursor
+    page_size, prefer_applied = preferred_page_size()
+    limit = page_size if top is None else min(top, page_size)
+    page = list(islice(rates, skip, skip + limit))
+    next_link = None
+    if len(page) == limit and skip + limit < count and (top is None or top > limit):
+        link_args = {name: value for name, value in request.args.items() if name not in ('$skip', '$top')}
+        link_args['$skip'] = skip + limit
+        if top is not None:
+            link_args['$top'] = top - limit
+        next_link = f"{request.base_url}?{urlencode(link_args)}"
+    if select_fields:
+        fields = [field.strip() for field in select_fields.split(',')]
+        page = [{**{field: rate.get(field) for field in fields if field in rate},
+                 '@odata.etag': rate.get('@odata.etag')} for rate in page]
+    g.result_rows = len(page)
     
-    return jsonify(odata_response(
-        exchange_rates,
-        count=len(exchange_rates),
-        context_url="https://your-org.cloud.onebox.dynamics.com/data/$metadata#ExchangeRates"
+    response = jsonify(odata_response(
+        page,
+        count=count if include_count else None,
+        context_url="https://your-org.cloud.onebox.dynamics.com/data/$metadata#ExchangeRates",
+        next_link=next_link
     ))
+    if prefer_applied:
+        response.headers['Preference-Applied'] = f'odata.maxpagesize={page_size}'
+    response.headers['ETag'] = etag
+    return response
+
+@app.route('/ExchangeRates', methods=['POST'])
+def create_exchange_rate():
+    """Create an exchange rate, replacing the pair's rate of the same type and date"""
+    data, error = read_entity("ExchangeRates")
+    if error is not None:
+        return error
+    missing = [field for field in ("FromCurrencyCode", "ToCurrencyCode", "ExchangeRateValue", "ValidFromDate")
+               if data.get(field) in (None, "")]
+    if missing:
+        return jsonify({"error": f"Invalid ExchangeRate: missing required property '{missing[0]}'"}), 400
+    if data["ExchangeRateValue"] <= 0:
+        return jsonify({"error": "Invalid ExchangeRate: ExchangeRateValue must be positive"}), 400
+    
+    rate = {
+        "@odata.etag": generate_etag(),
+        "FromCurrencyCode": data["FromCurrencyCode"],
+        "ToCurrencyCode": data["ToCurrencyCode"],
+        "ExchangeRateValue": data["ExchangeRateValue"],
+        "ValidFromDate": as_of_date(data["ValidFromDate"]),
+        "RateTypeId": data.get("RateTypeId") or DEFAULT_RATE_TYPE
+    }
+    # Writing a rate drops the memoized cross rates
+    exchange_rates.add(rate)
+    return entity_response(rate, 201)
+
+@app.route('/fx/rate', methods=['GET'])
+def get_exchange_rate_as_of():
+    """Get the rate converting one currency to another on a date, derived if need be"""
+    from_currency = request.args.get('from', '').upper()
+    to_currency = request.args.get('to', '').upper()
+    if not from_currency or not to_currency:
+        return jsonify({"error": "Both from and to currency codes are required"}), 400
+    date = as_of_date(request.args.get('date') or get_current_datetime())
+    if date is None:
+        return jsonify({"error": f"Invalid date {request.args.get('date')!r}"}), 400
+    rate_type = request.args.get('rateType') or DEFAULT_RATE_TYPE
+    
+    rate = exchange_rates.rate(from_currency, to_currency, date, rate_type)
+    if rate is None:
+        return jsonify({"error": f"No {rate_type} rate from {from_currency} to {to_currency} on {date}"}), 404
+    return jsonify(rate)
 
 # System User endpoints
 @app.route('/SystemUsers', methods=['GET'])
+@cached_response(lambda: system_users.version)
 def get_system_users():
     """Get all system users"""
-    user_list = list(system_users.values())
+    include_count, error = requested_count()
+    if error is not None:
+        return error
+    # System users have no navigation properties, so any $expand is a 400
+    _, error = requested_expansions("SystemUsers")
+    if error is not None:
+        return error
+    etag = collection_etag(system_users.version)
+    cached = not_modified(etag)
+    if cached is not None:
+        return cached
     
-    return jsonify(odata_response(
+    user_list = [system_users.materialize(user) for user in system_users.values()]
+    
+    response = jsonify(odata_response(
         user_list,
-        count=len(user_list),
+        count=len(user_list) if include_count else None,
         context_url="https://your-org.cloud.onebox.dynamics.com/data/$metadata#SystemUsers"
     ))
+    response.headers['ETag'] = etag
+    return response
 
 @app.route('/SystemUsers', methods=['POST'])
 def create_system_user():
     """Create a new system user"""
-    data = request.get_json()
+    data, error = read_entity("SystemUsers")
+    if error is not None:
+        return error
     
     # Generate user ID if not provided
     if 'UserId' not in data or not data['UserId']:
-        data['UserId'] = f"USER{len(system_users) + 1:04d}"
+        data['UserId'] = allocate_key(system_users, lambda number: f"USER{number:04d}")
     
     # Set default values
     user = {
@@ -264,48 +940,333 @@ def create_system_user():
         "IsActive": data.get("IsActive", True)
     }
     
-    # Store user
-    system_users[user["UserId"]] = user
+    # Store user, refusing to overwrite an existing user
+    if not system_users.insert(user["UserId"], user):
+        return jsonify({"error": "System user already exists"}), 409
     
-    return jsonify(user), 201
+    return entity_response(user, 201)
+
+# Entity sets of the OpenAPI spec without hand-written handlers are served by
+# generated routes, on stores created from their entity types
+spec_stores = {}
+spec_routes = []
+
+# Helper function to derive the column types of a generated entity set
+def spec_column_schema(entity_set, indexed_fields):
+    kinds = {"number": "float", "integer": "int", "boolean": "bool"}
+    schema = {"@odata.etag": "object"}
+    for field, property_schema in entity_set.properties.items():
+        kind = kinds.get(property_schema.get("type"), "object")
+        schema[field] = "category" if kind == "object" and field in indexed_fields else kind
+    return schema
+
+# Helper function to create the store of a generated entity set, with the
+# indexes configured for it under openapi.entity_sets in config.json
+def create_spec_store(entity_set):
+    options = config.get("openapi", {}).get("entity_sets", {}).get(entity_set.name, {})
+    indexed_fields = tuple(options.get("indexed_fields", ()))
+    sorted_fields = tuple(options.get("sorted_fields", entity_set.key[-1:]))
+    counted_fields = tuple(tuple(fields) for fields in options.get("counted_fields", ()))
+    searched_fields = tuple(options.get("searched_fields", ()))
+    schema = spec_column_schema(entity_set, indexed_fields)
+    if entity_set.key[0] == "dataAreaId":
+        return create_company_store(entity_set.name, schema, indexed_fields, sorted_fields, counted_fields,
+                                    searched_fields)
+    return create_store(entity_set.name, schema, indexed_fields, sorted_fields, counted_fields, searched_fields)
+
+# Helper function to build the handler of a spec operation on a generated store
+def spec_view(operation, entity_set, store):
+    label = entity_set.entity_type
+    params = dict(operation.key_params)
+
+    def entity_key(path_values):
+        return "_".join(path_values[params[field]] for field in entity_set.key)
+
+    if operation.kind == "collection" and operation.method == "GET":
+        @cached_response(lambda: expanded_version(store, entity_set.name))
+        def view():
+            return query_entity_set(store, entity_set.name, entity_set.key)
+    elif operation.kind == "collection" and operation.method == "POST":
+        def view():
+            data, error = read_entity(entity_set.name)
+            if error is not None:
+                return error
+            missing = [field for field in entity_set.key if not data.get(field)]
+            if missing:
+                return jsonify({"error": f"Invalid {label}: missing key property '{missing[0]}'"}), 400
+            entity = dict(data)
+            entity["@odata.etag"] = generate_etag()
+            if not store.insert(entity_set.key_of(entity), entity):
+                return jsonify({"error": f"{label} already exists"}), 409
+            return entity_response(entity, 201)
+    elif operation.kind == "count" and operation.method == "GET":
+        def view():
+            return count_entity_set(store)
+    elif operation.kind == "entity" and operation.method == "GET":
+        def view(**path_values):
+            expansions, error = requested_expansions(entity_set.name)
+            if error is not None:
+                return error
+            entity = store.get(entity_key(path_values))
+            if entity is None:
+                return jsonify({"error": f"{label} not found"}), 404
+            return not_modified(entity["@odata.etag"]) or entity_response(
+                with_expansions(store.materialize, expansions)(entity))
+    elif operation.kind == "entity" and operation.method == "PATCH":
+        def view(**path_values):
+            data, error = read_entity(entity_set.name, partial=True)
+            if error is not None:
+                return error
+            return patch_entity(store, entity_key(path_values), data, entity_set.key, label)
+    else:
+        return None
+    return view
+
+# Register a generated route for every spec operation on an entity set that
+# has no handler yet
+def register_spec_routes():
+    def signature(rule):
+        return re.sub(r"<[^>]*>", "<>", rule)
+
+    handled = {(signature(rule.rule), method) for rule in app.url_map.iter_rules() for method in rule.methods}
+    for operation in service_spec.operations:
+        if operation.entity_set is None or (signature(operation.rule), operation.method) in handled:
+            continue
+        entity_set = service_spec.entity_sets[operation.entity_set]
+        store = spec_stores.get(entity_set.name)
+        if store is None:
+            store = create_spec_store(entity_set)
+        view = spec_view(operation, entity_set, store)
+        if view is None:
+            continue
+        spec_stores[entity_set.name] = store
+        app.add_url_rule(operation.rule, endpoint=operation.operation_id or f"{operation.method} {operation.path}",
+                         view_func=view, methods=[operation.method])
+        spec_routes.append(operation)
+
+register_spec_routes()
+
+# Data management package API: bulk imports of CSV or JSON Lines packages run
+# as background jobs, as with D365's DataManagementDefinitionGroups actions
+DMF_ACTIONS = '/DataManagementDefinitionGroups/Microsoft.Dynamics.DataEntities.'
+import_manager = ImportManager(
+    generate_etag,
+    directory=config.get("imports", {}).get("package_dir"),
+    batch_size=config.get("imports", {}).get("batch_size", 20000),
+    max_errors=config.get("imports", {}).get("max_errors", 100)
+)
+
+# Helper function to return the value of a data management action
+def dmf_response(value):
+    return jsonify({
+        "@odata.context": "https://your-org.cloud.onebox.dynamics.com/data/$metadata#Edm.String",
+        "value": value
+    })
+
+# Helper function to read the executionId of a DMF action's body; returns
+# (execution id, error response)
+def requested_execution_id():
+    data = request.get_json(silent=True)
+    execution_id = data.get("executionId") if isinstance(data, dict) else None
+    if not isinstance(execution_id, str) or not execution_id:
+        return None, (jsonify({"error": "executionId must be a non-empty string"}), 400)
+    return execution_id, None
+
+@app.route(DMF_ACTIONS + 'GetAzureWriteUrl', methods=['POST'])
+def get_azure_write_url():
+    """Get a URL to upload an import package to"""
+    data = request.get_json(silent=True) or {}
+    blob_id = import_manager.create_package(str(data.get("uniqueFileName") or ""))
+    return dmf_response(json.dumps({"BlobId": blob_id, "BlobUrl": f"{request.host_url}dmf/packages/{blob_id}"}))
+
+@app.route('/dmf/packages/<blob_id>', methods=['PUT'])
+def upload_package(blob_id):
+    """Upload an import package, streamed to disk"""
+    try:
+        import_manager.write_package(blob_id, request.stream)
+    except KeyError:
+        return jsonify({"error": "Package not found, request a write URL first"}), 404
+    return "", 201
+
+@app.route(DMF_ACTIONS + 'ImportFromPackage', methods=['POST'])
+def import_from_package():
+    """Start importing an uploaded package into an entity set"""
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Invalid ImportFromPackage: request body must be a JSON object"}), 400
+    # The definition group names the entity set the package is imported into
+    name = data.get("definitionGroupId")
+    store = entity_stores.get(name)
+    entity_set = service_spec.entity_sets.get(name)
+    if store is None or entity_set is None:
+        return jsonify({"error": f"Unknown definitionGroupId {name!r}, expected an entity set name"}), 400
+    if data.get("executionId") is not None and not isinstance(data["executionId"], str):
+        return jsonify({"error": "Invalid ImportFromPackage: executionId must be a string"}), 400
+    blob_id = str(data.get("packageUrl") or "").rstrip("/").rsplit("/", 1)[-1]
+    try:
+        job = import_manager.submit(blob_id, entity_set, store, execution_id=data.get("executionId") or None,
+                                    legal_entity=data.get("legalEntityId") or DEFAULT_COMPANY)
+    except PackageError as e:
+        return jsonify({"error": f"Invalid ImportFromPackage: {e}"}), 400
+    return dmf_response(job.execution_id)
+
+@app.route(DMF_ACTIONS + 'GetExecutionSummaryStatus', methods=['POST'])
+def get_execution_summary_status():
+    """Get the status of an import execution"""
+    execution_id, error = requested_execution_id()
+    if error is not None:
+        return error
+    job = import_manager.job(execution_id)
+    return dmf_response("Unknown" if job is None else job.status)
+
+@app.route(DMF_ACTIONS + 'GetExecutionErrors', methods=['POST'])
+def get_execution_errors():
+    """Get the rows an import execution rejected"""
+    execution_id, error = requested_execution_id()
+    if error is not None:
+        return error
+    job = import_manager.job(execution_id)
+    if job is None:
+        return jsonify({"error": "Execution not found"}), 404
+    return dmf_response(json.dumps(job.errors))
+
+@app.route('/dmf/jobs/<execution_id>', methods=['GET'])
+def get_import_job(execution_id):
+    """Get the progress of an import execution"""
+    job = import_manager.job(execution_id)
+    if job is None:
+        return jsonify({"error": "Execution not found"}), 404
+    return jsonify(job.summary())
+
+# OData JSON batch endpoint
+batch_executor = BatchExecutor(
+    app,
+    max_workers=config.get("batch", {}).get("max_workers", 8),
+    max_requests=config.get("batch", {}).get("max_requests", 1000)
+)
+
+@app.route('/$batch', methods=['POST'])
+def execute_batch():
+    """Execute an OData JSON batch of requests"""
+    data = request.get_json(silent=True)
+    try:
+        result = batch_executor.execute(data)
+    except BatchError as e:
+        return jsonify({"error": f"Invalid $batch: {e}"}), 400
+    return jsonify(result)
+
+# Prometheus metrics endpoint
+metrics.register_gauge("store_entities", "Entities held by each entity set", lambda: [
+    ({"entity_set": "VendorsV2"}, len(vendors)),
+    ({"entity_set": "CustomersV3"}, len(customers)),
+    ({"entity_set": "SystemUsers"}, len(system_users)),
+    ({"entity_set": "ExchangeRates"}, len(exchange_rates)),
+    *(({"entity_set": name}, len(store)) for name, store in spec_stores.items())
+])
+metrics.register_gauge("store_partitions", "Company partitions of each entity set", lambda: [
+    ({"entity_set": store.name}, len(store.partitions))
+    for store in (vendors, customers, *spec_stores.values()) if isinstance(store, PartitionedStore)
+])
+metrics.register_gauge("response_cache", "Response cache entries, bytes, hits and misses", lambda: [
+    ({"stat": stat}, value) for stat, value in response_cache.stats().items()
+])
+metrics.register_gauge("throttled_requests", "Requests rejected by service protection, by limit", lambda: [
+    ({"limit": limit}, count) for limit, count in service_protection.throttled.items()
+])
+metrics.register_gauge("captured_requests", "Requests written to or dropped from the traffic capture", lambda: [
+    ({"state": "written"}, traffic_capture.written),
+    ({"state": "dropped"}, traffic_capture.dropped)
+])
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Get request metrics in Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Snapshot endpoint: persist the current state and truncate the write log
+@app.route('/$snapshot', methods=['POST'])
+def create_snapshot():
+    """Save all entity sets to the snapshot file"""
+    if snapshot_path is None:
+        return jsonify({"error": "No snapshot file configured (start with --snapshot)"}), 409
+    # Hold every store's lock so the snapshot and the log truncation agree,
+    # once no $batch changeset holds some of them
+    stores = [*entity_stores.values(), exchange_rates]
+    with transactions_lock:
+        for store in stores:
+            store.lock.acquire()
+        try:
+            started = time.perf_counter()
+            write_snapshot(snapshot_path)
+            if write_log is not None:
+                write_log.truncate()
+        finally:
+            for store in reversed(stores):
+                store.lock.release()
+    return jsonify({
+        "snapshot": snapshot_path,
+        "entities": {name: len(store) for name, store in entity_stores.items()},
+        "seconds": round(time.perf_counter() - started, 3)
+    })
 
 # OData service root
 @app.route('/data', methods=['GET'])
+@cached_response(lambda: None)
 def get_service_root():
     """Get OData service root"""
     service_root = {
         "@odata.context": "https://your-org.cloud.onebox.dynamics.com/data/$metadata",
-        "value": [
-            {"name": "VendorsV2", "kind": "EntitySet", "url": "VendorsV2"},
-            {"name": "CustomersV3", "kind": "EntitySet", "url": "CustomersV3"},
-            {"name": "ExchangeRates", "kind": "EntitySet", "url": "ExchangeRates"},
-            {"name": "SystemUsers", "kind": "EntitySet", "url": "SystemUsers"},
-            {"name": "ReleasedProductsV2", "kind": "EntitySet", "url": "ReleasedProductsV2"},
-            {"name": "CustomerGroups", "kind": "EntitySet", "url": "CustomerGroups"}
-        ]
+        "value": [{"name": name, "kind": "EntitySet", "url": name} for name in service_spec.entity_sets]
     }
     
     return jsonify(service_root)
 
-# OData metadata
-@app.route('/$metadata', methods=['GET'])
-def get_metadata():
-    """Get OData metadata"""
-    metadata = '''<?xml version="1.0" encoding="UTF-8"?>
+# Helper function to render the $metadata document of the spec's entity sets
+def render_metadata():
+    namespace = config.get("odata", {}).get("metadata_namespace", "Microsoft.Dynamics365.Finance")
+    edm_types = {"string": "Edm.String", "number": "Edm.Decimal", "integer": "Edm.Int32", "boolean": "Edm.Boolean"}
+    types, sets = [], []
+    for name, entity_set in service_spec.entity_sets.items():
+        keys = "".join(f'<PropertyRef Name="{field}"/>' for field in entity_set.key)
+        types.append(f'      <EntityType Name="{entity_set.entity_type}">')
+        types.append(f'        <Key>{keys}</Key>')
+        for field, property_schema in entity_set.properties.items():
+            edm_type = edm_types.get(property_schema.get("type"), "Edm.String")
+            if property_schema.get("format") == "date-time":
+                edm_type = "Edm.DateTimeOffset"
+            nullable = ' Nullable="false"' if field in entity_set.key else ''
+            types.append(f'        <Property Name="{field}" Type="{edm_type}"{nullable}/>')
+        bindings = []
+        for navigation in navigations.properties.get(name, {}).values():
+            target_type = f"{namespace}.{service_spec.entity_sets[navigation.target_set].entity_type}"
+            if navigation.many:
+                target_type = f"Collection({target_type})"
+            types.append(f'        <NavigationProperty Name="{navigation.name}" Type="{target_type}"/>')
+            bindings.append(f'<NavigationPropertyBinding Path="{navigation.name}" Target="{navigation.target_set}"/>')
+        types.append('      </EntityType>')
+        if bindings:
+            sets.append(f'        <EntitySet Name="{name}" EntityType="{namespace}.{entity_set.entity_type}">'
+                        f'{"".join(bindings)}</EntitySet>')
+        else:
+            sets.append(f'        <EntitySet Name="{name}" EntityType="{namespace}.{entity_set.entity_type}"/>')
+    return '''<?xml version="1.0" encoding="UTF-8"?>
 <edmx:Edmx xmlns:edmx="http://docs.oasis-open.org/odata/ns/edmx" Version="4.0">
   <edmx:DataServices>
-    <Schema xmlns="http://docs.oasis-open.org/odata/ns/edm" Namespace="Microsoft.Dynamics365.Finance">
+    <Schema xmlns="http://docs.oasis-open.org/odata/ns/edm" Namespace="%s">
+%s
       <EntityContainer Name="Container">
-        <EntitySet Name="VendorsV2" EntityType="Microsoft.Dynamics365.Finance.VendorV2"/>
-        <EntitySet Name="CustomersV3" EntityType="Microsoft.Dynamics365.Finance.CustomerV3"/>
-        <EntitySet Name="ExchangeRates" EntityType="Microsoft.Dynamics365.Finance.ExchangeRate"/>
-        <EntitySet Name="SystemUsers" EntityType="Microsoft.Dynamics365.Finance.SystemUser"/>
+%s
       </EntityContainer>
     </Schema>
   </edmx:DataServices>
-</edmx:Edmx>'''
-    
-    return metadata, 200, {'Content-Type': 'application/xml'}
+</edmx:Edmx>''' % (namespace, "\n".join(types), "\n".join(sets))
+
+# OData metadata
+@app.route('/$metadata', methods=['GET'])
+@cached_response(lambda: None)
+def get_metadata():
+    """Get OData metadata"""
+    return render_metadata(), 200, {'Content-Type': 'application/xml'}
 
 # Health check endpoint
 @app.route('/health', methods=['GET'])
@@ -324,10 +1285,11 @@ def health_check():
 
 # Initialize with some sample data
 def initialize_sample_data():
-    """Initialize the mock server with sample data"""
+    """Initialize the mock server with sample data from config.json"""
+    sample_data = config.get("sample_data", {})
     
     # Sample vendors
-    sample_vendors = [
+    sample_vendors = sample_data.get("vendors", [
         {
             "dataAreaId": "USMF",
             "VendorAccount": "V000001",
@@ -346,7 +1308,7 @@ def initialize_sample_data():
             "PurchaseCurrencyCode": "USD",
             "IsActive": True
         }
-    ]
+    ])
     
     for vendor_data in sample_vendors:
         vendor = vendor_data.copy()
@@ -355,7 +1317,7 @@ def initialize_sample_data():
         vendors[vendor_key] = vendor
     
     # Sample customers
-    sample_customers = [
+    sample_customers = sample_data.get("customers", [
         {
             "dataAreaId": "USMF",
             "CustomerAccount": "C000001",
@@ -380,7 +1342,7 @@ def initialize_sample_data():
             "CreditLimit": 100000.0,
             "IsActive": True
         }
-    ]
+    ])
     
     for customer_data in sample_customers:
         customer = customer_data.copy()
@@ -389,7 +1351,7 @@ def initialize_sample_data():
         customers[customer_key] = customer
     
     # Sample system users
-    sample_users = [
+    sample_users = sample_data.get("system_users", [
         {
             "UserId": "ADMIN",
             "UserName": "admin",
@@ -402,15 +1364,176 @@ def initialize_sample_data():
             "Email": "testuser@company.com",
             "IsActive": True
         }
-    ]
+    ])
     
     for user_data in sample_users:
         user = user_data.copy()
         user["@odata.etag"] = generate_etag()
         system_users[user["UserId"]] = user
+    
+    # Sample exchange rates
+    sample_rates = sample_data.get("exchange_rates", [
+        {
+            "FromCurrencyCode": "USD",
+            "ToCurrencyCode": "EUR",
+            "ExchangeRateValue": 0.85,
+            "ValidFromDate": "2025-01-01T00:00:00Z",
+            "RateTypeId": "SPOT"
+        },
+        {
+            "FromCurrencyCode": "USD",
+            "ToCurrencyCode": "GBP",
+            "ExchangeRateValue": 0.75,
+            "ValidFromDate": "2025-01-01T00:00:00Z",
+            "RateTypeId": "SPOT"
+        },
+        {
+            "FromCurrencyCode": "EUR",
+            "ToCurrencyCode": "USD",
+            "ExchangeRateValue": 1.18,
+            "ValidFromDate": "2025-01-01T00:00:00Z",
+            "RateTypeId": "SPOT"
+        },
+        {
+            "FromCurrencyCode": "GBP",
+            "ToCurrencyCode": "USD",
+            "ExchangeRateValue": 1.33,
+            "ValidFromDate": "2025-01-01T00:00:00Z",
+            "RateTypeId": "SPOT"
+        }
+    ])
+    
+    for rate_data in sample_rates:
+        rate = {"@odata.etag": generate_etag()}
+        rate.update(rate_data)
+        exchange_rates.add(rate)
+    
+    # Sample rows of generated entity sets, listed under their entity set name
+    for name, store in spec_stores.items():
+        entity_set = service_spec.entity_sets[name]
+        for row_data in sample_data.get(name, []):
+            row = row_data.copy()
+            row["@odata.etag"] = generate_etag()
+            store[entity_set.key_of(row)] = row
 
-if __name__ == '__main__':
-    initialize_sample_data()
+# Snapshot persistence: the entity stores by name, and where they were saved
+entity_stores = {store.name: store for store in (vendors, customers, system_users, *spec_stores.values())}
+
+# Navigation properties between entity sets, followed by $expand through the
+# foreign-key indexes of their targets
+navigations = Navigations(config.get("navigation", {}), entity_stores)
+snapshot_path = None
+write_log = None
+
+# Helper function to save all entity sets to a snapshot file
+def write_snapshot(path):
+    global snapshot_path
+    save_snapshot(path, entity_stores, {"ExchangeRates": exchange_rates},
+                  meta={"entity_version": next(entity_versions)})
+    snapshot_path = path
+
+# Helper function to start from a snapshot instead of the sample data
+def restore_snapshot(path):
+    global entity_versions, snapshot_path
+    started = time.perf_counter()
+    try:
+        meta = load_snapshot(path, entity_stores, {"ExchangeRates": exchange_rates})
+    except SnapshotError as e:
+        raise SystemExit(f"Cannot load snapshot: {e}")
+    entity_versions = counter(meta.get("entity_version", 1))
+    snapshot_path = path
+    print(f"Loaded snapshot {path} ({', '.join(f'{len(store)} {name}' for name, store in entity_stores.items())}) "
+          f"in {time.perf_counter() - started:.3f}s")
+
+# Helper function to replay the write log and record every later write to it
+def open_write_log(path):
+    global entity_versions, write_log
+    newest = [0]
+
+    def track_version(entity):
+        match = re.fullmatch(r'W/"(\d+)"', str(entity.get("@odata.etag", "")))
+        if match:
+            newest[0] = max(newest[0], int(match.group(1)))
+
+    logged_stores = {**entity_stores, exchange_rates.name: exchange_rates}
+    replayed = WriteLog.replay(path, logged_stores, track_version)
+    if newest[0]:
+        entity_versions = counter(max(newest[0] + 1, next(entity_versions)))
+    if replayed:
+        print(f"Replayed {replayed} writes from {path}")
+    write_log = WriteLog(path, fsync=config.get("persistence", {}).get("fsync", False))
+    for store in logged_stores.values():
+        store.write_log = write_log
+
+# Seed a large synthetic dataset on top of the sample data
+def seed_synthetic_data(counts, seed=None):
+    """Bulk load generated entities, bypassing the per-request handlers"""
+    seeding = config.get("seeding", {})
+    summary = seed_stores(
+        vendors=vendors,
+        customers=customers,
+        system_users=system_users,
+        exchange_rates=exchange_rates,
+        counts=counts,
+        seed=seeding.get("seed", 42) if seed is None else seed,
+        profile=seeding.get("profile")
+    )
+    for name, result in summary.items():
+        print(f"Seeded {result['rows']} {name} in {result['seconds']}s")
+    return summary
+
+def build_arg_parser(description="Microsoft Dynamics 365 Finance Mock Server"):
+    seeding = config.get("seeding", {})
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--vendors", type=int, default=seeding.get("vendors", 0),
+                        help="number of synthetic vendors to seed")
+    parser.add_argument("--customers", type=int, default=seeding.get("customers", 0),
+                        help="number of synthetic customers to seed")
+    parser.add_argument("--system-users", type=int, default=seeding.get("system_users", 0),
+                        help="number of synthetic system users to seed")
+    parser.add_argument("--exchange-rate-days", type=int, default=seeding.get("exchange_rate_days", 0),
+                        help="days of synthetic exchange rate history to seed")
+    parser.add_argument("--seed", type=int, default=seeding.get("seed", 42),
+                        help="random seed for the synthetic dataset")
+    persistence = config.get("persistence", {})
+    parser.add_argument("--snapshot", default=persistence.get("snapshot"),
+                        help="snapshot file to start from; written after seeding if it does not exist")
+    parser.add_argument("--write-log", default=persistence.get("write_log"),
+                        help="append-only log of writes, replayed on startup")
+    parser.add_argument("--capture", default=config.get("capture", {}).get("path"),
+                        help="append every request served to this traffic log, for replay_traffic.py")
+    parser.add_argument("--service-protection", action="store_true",
+                        default=service_protection.enabled,
+                        help="apply the throttling and latency rules of config.json")
+    return parser
+
+# Load the sample data and any requested synthetic dataset
+def prepare_data(args):
+    service_protection.enabled = args.service_protection
+    if args.snapshot and os.path.exists(args.snapshot):
+        restore_snapshot(args.snapshot)
+    else:
+        initialize_sample_data()
+        seed_synthetic_data({
+            "vendors": args.vendors,
+            "customers": args.customers,
+            "system_users": args.system_users,
+            "exchange_rate_days": args.exchange_rate_days
+        }, seed=args.seed)
+        if args.snapshot:
+            write_snapshot(args.snapshot)
+            print(f"Saved snapshot to {args.snapshot}")
+    if args.write_log:
+        open_write_log(args.write_log)
+    if args.capture:
+        traffic_capture.start(args.capture)
+        print(f"Capturing traffic to {args.capture}")
+    # The loaded rows live for the whole run: keep them out of the cyclic
+    # garbage collector's scans, which otherwise stall requests on big datasets
+    gc.freeze()
+
+# Print the startup banner
+def print_banner(url):
     print("Microsoft Dynamics 365 Finance Mock Server")
     print("==========================================")
     print("Available endpoints:")
@@ -422,11 +1545,29 @@ if __name__ == '__main__':
     print("  PATCH  /CustomersV3(...)          - Update customer")
     print("  GET    /CustomersV3/$count        - Get customer count")
     print("  GET    /ExchangeRates             - Get exchange rates")
+    print("  POST   /ExchangeRates             - Create an exchange rate")
+    print("  GET    /fx/rate                   - As-of rate of a currency pair, with cross rates")
     print("  GET    /SystemUsers               - Get system users")
     print("  POST   /SystemUsers               - Create system user")
+    print("  POST   /$batch                    - OData JSON batch")
+    print("  POST   /$snapshot                 - Save a snapshot")
+    print("  POST   /DataManagementDefinitionGroups/... - Bulk import packages")
+    print("  GET    /dmf/jobs/<executionId>    - Bulk import progress")
     print("  GET    /data                      - OData service root")
     print("  GET    /$metadata                 - OData metadata")
     print("  GET    /health                    - Health check")
+    for operation in spec_routes:
+        print(f"  {operation.method:<6} {operation.path:<26} - Generated from the OpenAPI spec")
     print("==========================================")
-    print("Server starting on http://localhost:8080")
-    app.run(debug=True, host='0.0.0.0', port=8080)
+    print(f"Server starting on {url}")
+
+if __name__ == '__main__':
+    server_config = config.get("server", {})
+    parser = build_arg_parser()
+    parser.add_argument("--debug", action="store_true", default=server_config.get("debug", False),
+                        help="run Flask's debugger and reloader (development only)")
+    args = parser.parse_args()
+    prepare_data(args)
+    port = server_config.get("port", 8080)
+    print_banner(f"http://localhost:{port}")
+    app.run(debug=args.debug, threaded=True, host=server_config.get("host", "0.0.0.0"), port=port)
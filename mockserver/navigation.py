@@ -0,0 +1,142 @@
+"""
+Navigation properties and $expand for the Dynamics 365 Finance mock server.
+
+A navigation property relates the entities of one entity set to those of
+another by equal field values, e.g. a customer's dataAreaId and
+CustomerGroupId to the customer group with the same ones. Navigation
+properties are declared under "navigation" in config.json:
+
+    "CustomersV3": {
+        "CustomerGroup": {"target": "CustomerGroups",
+                          "fields": {"dataAreaId": "dataAreaId", "CustomerGroupId": "CustomerGroupId"}}
+    }
+
+fields maps each field of the source entity to the target field it has to
+equal; "many": true makes the property a collection. Every target field must
+be hash indexed (or be the target's partition field), so following a
+property looks up the maintained foreign-key indexes instead of scanning the
+target, in both directions: CustomerGroups' Customers reads the
+CustomerGroupId index of CustomersV3.
+
+$expand lists navigation properties separated by commas, each optionally
+with $select and $top in parentheses:
+
+    $expand=CustomerGroup
+    $expand=Customers($select=CustomerAccount,OrganizationName;$top=10)
+"""
+
+import re
+from functools import lru_cache
+
+
+class NavigationError(ValueError):
+    """Raised for a navigation property or $expand option that cannot be served"""
+
+
+class NavigationProperty:
+    """A to-one or to-many relationship between two entity sets"""
+
+    def __init__(self, name, source_set, target_set, target, fields, many=False):
+        self.name = name
+        self.source_set = source_set
+        self.target_set = target_set
+        self.target = target
+        self.fields = tuple(fields.items())
+        self.many = many
+        unindexed = [field for field in fields.values() if not target.is_indexed(field)]
+        if unindexed:
+            raise NavigationError(f"{source_set}/{name}: {target_set}.{unindexed[0]} is not indexed, "
+                                  f"add it to the indexed fields of {target_set}")
+
+    def related(self, entity, limit=None):
+        """Return the (key, row) pairs of the target entities related to entity, in key order"""
+        values = {target_field: entity.get(source_field) for source_field, target_field in self.fields}
+        if any(value is None for value in values.values()):
+            return []
+        return self.target.find(values, limit)
+
+
+class Expansion:
+    """One navigation property of $expand with its nested $select and $top"""
+
+    __slots__ = ("property", "select", "top")
+
+    def __init__(self, navigation_property, select=None, top=None):
+        self.property = navigation_property
+        self.select = select
+        self.top = top
+
+    def project(self, row):
+        entity = self.property.target.materialize(row)
+        if self.select is None:
+            return entity
+        return {field: entity[field] for field in ("@odata.etag", *self.select) if field in entity}
+
+    def expand(self, entity):
+        """Return the value of the navigation property for entity"""
+        if not self.property.many:
+            related = self.property.related(entity, 1)
+            return self.project(related[0][1]) if related else None
+        return [self.project(row) for _, row in self.property.related(entity, self.top)]
+
+
+_ITEM = re.compile(r"\s*(\w+)\s*(?:\(([^()]*)\))?\s*(?:,|$)")
+
+
+def parse_expand(text, properties, entity_set):
+    """
+    Parse a $expand option into Expansions of the navigation properties
+    of entity_set (name -> NavigationProperty), raising NavigationError.
+    """
+    expansions = []
+    position = 0
+    text = text.strip()
+    while position < len(text):
+        match = _ITEM.match(text, position)
+        if match is None or match.end() == position:
+            raise NavigationError(f"unexpected {text[position:]!r}")
+        name, options = match.group(1), match.group(2)
+        navigation_property = properties.get(name)
+        if navigation_property is None:
+            raise NavigationError(f"{entity_set} has no navigation property {name!r}")
+        expansions.append(Expansion(navigation_property, *_parse_options(options or "")))
+        position = match.end()
+    return expansions
+
+
+def _parse_options(text):
+    select = top = None
+    for option in filter(None, (option.strip() for option in text.split(";"))):
+        name, _, value = option.partition("=")
+        if name == "$select":
+            select = tuple(field.strip() for field in value.split(",") if field.strip())
+        elif name == "$top" and value.strip().isdigit():
+            top = int(value)
+        else:
+            raise NavigationError(f"unsupported nested option {option!r}, only $select and $top are")
+    return select, top
+
+
+class Navigations:
+    """The navigation properties of every entity set, with cached $expand parsing"""
+
+    def __init__(self, declared, stores):
+        self.properties = {}
+        for source_set, properties in declared.items():
+            if source_set not in stores:
+                raise NavigationError(f"unknown entity set {source_set!r}")
+            for name, declaration in properties.items():
+                target_set = declaration["target"]
+                if target_set not in stores:
+                    raise NavigationError(f"{source_set}/{name}: unknown entity set {target_set!r}")
+                self.properties.setdefault(source_set, {})[name] = NavigationProperty(
+                    name, source_set, target_set, stores[target_set], declaration["fields"],
+                    declaration.get("many", False))
+        self.parse = lru_cache(maxsize=256)(self._parse)
+
+    def _parse(self, entity_set, text):
+        return tuple(parse_expand(text, self.properties.get(entity_set, {}), entity_set))
+
+    def targets(self, expansions):
+        """Return the stores expansions read from, for versioning responses"""
+        return [expansion.property.target for expansion in expansions]
@@ -0,0 +1,189 @@
+"""
+OData v4 JSON $batch support for the Dynamics 365 Finance mock server.
+
+A batch body is {"requests": [...]} where each request has an id, method,
+url and optional headers, body, atomicityGroup and dependsOn. Requests are
+dispatched through the Flask app's normal routing, so every route works
+inside a batch exactly as it does on its own.
+
+Independent requests run concurrently on a worker pool. Requests sharing an
+atomicityGroup form a changeset: they run in order on one worker and, if
+any of them fails, every write made by the group is rolled back. Changesets
+run one at a time, and each entity set a changeset writes to stays locked
+until it ends, so the rollback never undoes another request's writes. A request
+only starts once everything it dependsOn has finished, and is answered with
+424 Failed Dependency if one of those failed. Responses are returned in the
+order of the requests.
+"""
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from store import Transaction
+
+
+class BatchError(ValueError):
+    """Raised when a $batch request body is malformed"""
+
+
+def _error(status, message):
+    return {"status": status, "headers": {"Content-Type": "application/json"},
+            "body": {"error": message}}
+
+
+def _validate(payload, max_requests):
+    if not isinstance(payload, dict) or not isinstance(payload.get("requests"), list):
+        raise BatchError("body must be an object with a 'requests' array")
+    requests = payload["requests"]
+    if len(requests) > max_requests:
+        raise BatchError(f"a batch may contain at most {max_requests} requests")
+    seen_ids, seen_groups = set(), set()
+    previous_group = None
+    for request in requests:
+        if not isinstance(request, dict):
+            raise BatchError("each request must be an object")
+        for field in ("id", "method", "url"):
+            if not isinstance(request.get(field), str) or not request[field]:
+                raise BatchError(f"each request needs a string '{field}'")
+        if request["id"] in seen_ids:
+            raise BatchError(f"duplicate request id {request['id']!r}")
+        group = request.get("atomicityGroup")
+        if group is not None and (not isinstance(group, str) or not group):
+            raise BatchError(f"atomicityGroup of request {request['id']!r} must be a string")
+        if group is not None and group != previous_group and group in seen_groups:
+            raise BatchError(f"requests of atomicityGroup {group!r} must be adjacent")
+        if not isinstance(request.get("dependsOn", []), list):
+            raise BatchError(f"dependsOn of request {request['id']!r} must be an array")
+        for dependency in request.get("dependsOn", []):
+            if not isinstance(dependency, str):
+                raise BatchError(f"dependsOn of request {request['id']!r} must list string ids")
+            if dependency not in seen_ids and dependency not in seen_groups:
+                raise BatchError(f"request {request['id']!r} depends on unknown or later id {dependency!r}")
+        seen_ids.add(request["id"])
+        if group is not None:
+            seen_groups.add(group)
+        previous_group = group
+    return requests
+
+
+def _units(requests):
+    """Group requests into units of work: single requests and changesets"""
+    units = []
+    for request in requests:
+        group = request.get("atomicityGroup")
+        if group is not None and units and units[-1]["group"] == group:
+            units[-1]["requests"].append(request)
+        else:
+            units.append({"group": group, "requests": [request]})
+    return units
+
+
+class BatchExecutor:
+    """Executes JSON batches against a Flask app on a shared worker pool"""
+
+    def __init__(self, app, max_workers=8, max_requests=1000):
+        self.app = app
+        self.max_requests = max_requests
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+
+    def dispatch(self, request):
+        """Run one sub-request through the app's routing and return its batch response"""
+        parts = urlsplit(request["url"])
+        path = parts.path if parts.path.startswith("/") else "/" + parts.path
+        if path == "/$batch":
+            return _error(400, "$batch requests cannot be nested")
+        # Sub-responses are embedded in the batch body, so they are never
+        # content-encoded on their own
+        headers = {name: value for name, value in (request.get("headers") or {}).items()
+                   if name.lower() not in ("content-length", "accept-encoding")}
+        body = request.get("body")
+        options = {"method": request["method"].upper(), "query_string": parts.query, "headers": headers,
+                   "environ_base": {"mockserver.batch_part": True}}
+        if body is not None:
+            options["data"] = body if isinstance(body, str) else json.dumps(body)
+            options["content_type"] = headers.get("Content-Type", "application/json")
+        with self.app.test_request_context(path, **options):
+            response = self.app.full_dispatch_request()
+            data = response.get_data(as_text=True)
+        result = {
+            "status": response.status_code,
+            "headers": {name: value for name, value in response.headers.items()
+                        if name.lower() not in ("content-length", "transfer-encoding")}
+        }
+        if data:
+            try:
+                result["body"] = json.loads(data) if response.is_json else data
+            except ValueError:
+                result["body"] = data
+        return result
+
+    def _run_unit(self, unit, dependencies):
+        """Run a single request or a changeset once its dependencies have finished"""
+        failed = [dependency for dependency in dependencies if not dependency.result()]
+        if failed:
+            return [_error(424, "a request this request depends on failed") for _ in unit["requests"]]
+
+        if unit["group"] is None:
+            return [self.dispatch(unit["requests"][0])]
+
+        with Transaction() as transaction:
+            results = []
+            for request in unit["requests"]:
+                result = self.dispatch(request)
+                results.append(result)
+                if result["status"] >= 400:
+                    transaction.rollback()
+                    rolled_back = _error(424, f"changeset {unit['group']!r} was rolled back")
+                    results = [rolled_back if r is not result else r for r in results]
+                    results.extend(rolled_back for _ in unit["requests"][len(results):])
+                    return results
+            return results
+
+    def execute(self, payload):
+        """Execute a parsed $batch body and return the response body"""
+        requests = _validate(payload, self.max_requests)
+        units = _units(requests)
+
+        # Map request ids and group names to the future of the unit running them
+        futures, owners = [], {}
+        for unit in units:
+            dependencies = {owners[dependency]
+                            for request in unit["requests"]
+                            for dependency in request.get("dependsOn", [])
+                            if dependency in owners}
+            # Units are submitted in request order and may only depend on
+            # earlier ones, so a waiting unit never starves its dependencies
+            future = self.pool.submit(self._run_unit, unit, list(dependencies))
+            futures.append((unit, future))
+            for request in unit["requests"]:
+                owners[request["id"]] = _Succeeded(future, request["id"], unit)
+            if unit["group"] is not None:
+                owners[unit["group"]] = _Succeeded(future, None, unit)
+
+        responses = []
+        for unit, future in futures:
+            for request, result in zip(unit["requests"], future.result()):
+                response = {"id": request["id"]}
+                if unit["group"] is not None:
+                    response["atomicityGroup"] = unit["group"]
+                response.update(result)
+                responses.append(response)
+        return {"responses": responses}
+
+
+class _Succeeded:
+    """Adapter exposing whether one request (or a whole unit) succeeded"""
+
+    def __init__(self, future, request_id, unit):
+        self.future = future
+        self.request_id = request_id
+        self.unit = unit
+
+    def result(self):
+        results = self.future.result()
+        if self.request_id is None:
+            return all(result["status"] < 400 for result in results)
+        position = next(i for i, request in enumerate(self.unit["requests"])
+                        if request["id"] == self.request_id)
+        return results[position]["status"] < 400
@@ -0,0 +1,484 @@
+"""
+OData $filter and $orderby support for the Dynamics 365 Finance mock server.
+
+Filter expressions are parsed once into a small AST and compiled into a
+Python predicate. Compiled filters are cached by expression text, so the
+connector's repeated queries only pay the parsing cost on first use.
+"""
+
+import re
+from functools import lru_cache
+
+
+class FilterError(ValueError):
+    """Raised when a $filter or $orderby expression cannot be parsed"""
+
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<string>'(?:[^']|'')*')
+      | (?P<datetime>\d{4}-\d{2}-\d{2}(?:T\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?(?:Z|[+-]\d{2}:\d{2})?)?)
+      | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+      | (?P<punct>[(),])
+      | (?P<name>[A-Za-z_][\w./]*)
+    )""", re.VERBOSE)
+
+_PROPERTY_RE = re.compile(r"[A-Za-z_][\w./]*")
+
+_COMPARISON_OPERATORS = {"eq", "ne", "gt", "ge", "lt", "le"}
+_KEYWORDS = _COMPARISON_OPERATORS | {"and", "or", "not", "in"}
+_LITERALS = {"true": True, "false": False, "null": None}
+
+# Function name -> (callable, number of arguments)
+_FUNCTIONS = {
+    "contains": (lambda value, sub: isinstance(value, str) and sub in value, 2),
+    "startswith": (lambda value, prefix: isinstance(value, str) and value.startswith(prefix), 2),
+    "endswith": (lambda value, suffix: isinstance(value, str) and value.endswith(suffix), 2),
+    "tolower": (lambda value: value.lower() if isinstance(value, str) else value, 1),
+    "toupper": (lambda value: value.upper() if isinstance(value, str) else value, 1),
+    "trim": (lambda value: value.strip() if isinstance(value, str) else value, 1),
+    "length": (lambda value: len(value) if isinstance(value, str) else None, 1),
+}
+
+# Functions returning true or false, which can stand as conditions
+_BOOLEAN_FUNCTIONS = {"contains", "startswith", "endswith"}
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match or match.end() == position:
+            raise FilterError(f"unexpected input at position {position}: {text[position:position + 20]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "string":
+            tokens.append(("lit", value[1:-1].replace("''", "'")))
+        elif kind == "datetime":
+            tokens.append(("lit", value))
+        elif kind == "number":
+            tokens.append(("lit", float(value) if any(c in value for c in ".eE") else int(value)))
+        elif kind == "punct":
+            tokens.append((value, value))
+        elif value in _LITERALS:
+            tokens.append(("lit", _LITERALS[value]))
+        elif value in _KEYWORDS:
+            tokens.append(("op", value))
+        else:
+            tokens.append(("name", value))
+    return tokens
+
+
+class _Parser:
+    """Recursive descent parser producing a tuple-based AST"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return (None, None)
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if token[0] is None or (kind and token[0] != kind) or (value and token[1] != value):
+            expected = value or kind or "token"
+            raise FilterError(f"expected {expected} but found {token[1]!r}")
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise FilterError(f"unexpected token {self.peek()[1]!r}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == ("op", "or"):
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", *nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        while self.peek() == ("op", "and"):
+            self.take()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", *nodes)
+
+    def parse_not(self):
+        if self.peek() == ("op", "not"):
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_comparison()
+
+    def parse_comparison(self):
+        left = self.parse_primary()
+        kind, value = self.peek()
+        if kind == "op" and value in _COMPARISON_OPERATORS:
+            self.take()
+            return ("cmp", value, left, self.parse_primary())
+        if (kind, value) == ("op", "in"):
+            self.take()
+            self.take("(")
+            values = [self.take("lit")[1]]
+            while self.peek()[0] == ",":
+                self.take(",")
+                values.append(self.take("lit")[1])
+            self.take(")")
+            return ("in", left, tuple(values))
+        return left
+
+    def parse_primary(self):
+        kind, value = self.peek()
+        if kind == "(":
+            self.take("(")
+            node = self.parse_or()
+            self.take(")")
+            return node
+        if kind == "lit":
+            self.take()
+            return ("lit", value)
+        if kind == "name":
+            self.take()
+            if self.peek()[0] == "(":
+                if value not in _FUNCTIONS:
+                    raise FilterError(f"unsupported function {value!r}")
+                self.take("(")
+                args = [self.parse_or()]
+                while self.peek()[0] == ",":
+                    self.take(",")
+                    args.append(self.parse_or())
+                self.take(")")
+                _, arity = _FUNCTIONS[value]
+                if len(args) != arity:
+                    raise FilterError(f"{value}() takes {arity} argument{'s' if arity > 1 else ''}, "
+                                      f"{len(args)} given")
+                return ("call", value, tuple(args))
+            return ("prop", value)
+        raise FilterError(f"unexpected token {value!r}")
+
+
+def _compare(op, left, right):
+    try:
+        if op == "eq":
+            return left == right
+        if op == "ne":
+            return left != right
+        if left is None or right is None:
+            return False
+        if op == "gt":
+            return left > right
+        if op == "ge":
+            return left >= right
+        if op == "lt":
+            return left < right
+        return left <= right
+    except TypeError:
+        return False
+
+
+def _condition_properties(node):
+    """
+    Return the properties node tests on their own as conditions, like
+    IsActive in "IsActive and CreditLimit gt 0", raising FilterError if node
+    is not a boolean expression.
+    """
+    kind = node[0]
+    if kind in ("and", "or"):
+        return tuple(field for child in node[1:] for field in _condition_properties(child))
+    if kind == "not":
+        return _condition_properties(node[1])
+    if kind == "prop":
+        return (node[1],)
+    if kind in ("cmp", "in") or (kind == "call" and node[1] in _BOOLEAN_FUNCTIONS) or \
+            (kind == "lit" and isinstance(node[1], bool)):
+        return ()
+    if kind == "call":
+        described = f"{node[1]}()"
+    else:
+        described = "null" if node[1] is None else repr(node[1])
+    raise FilterError(f"{described} is not a boolean expression")
+
+
+def _compile_condition(node):
+    """Compile a node standing as a condition; a property on its own has to be true"""
+    if node[0] == "prop":
+        field = node[1]
+        return lambda row: row.get(field) is True
+    return _compile(node)
+
+
+def _compile(node):
+    """Turn an AST node into a closure evaluated against an entity dict"""
+    kind = node[0]
+    if kind == "lit":
+        value = node[1]
+        return lambda row: value
+    if kind == "prop":
+        field = node[1]
+        return lambda row: row.get(field)
+    if kind == "call":
+        function, _ = _FUNCTIONS[node[1]]
+        args = [_compile(arg) for arg in node[2]]
+        def call(row):
+            try:
+                return function(*(arg(row) for arg in args))
+            except TypeError:
+                return None
+        return call
+    if kind == "cmp":
+        op, left, right = node[1], _compile(node[2]), _compile(node[3])
+        return lambda row: _compare(op, left(row), right(row))
+    if kind == "in":
+        left, values = _compile(node[1]), node[2]
+        return lambda row: left(row) in values
+    if kind == "not":
+        operand = _compile_condition(node[1])
+        return lambda row: not operand(row)
+    if kind == "and":
+        operands = [_compile_condition(child) for child in node[1:]]
+        return lambda row: all(operand(row) for operand in operands)
+    if kind == "or":
+        operands = [_compile_condition(child) for child in node[1:]]
+        return lambda row: any(operand(row) for operand in operands)
+    raise FilterError(f"unsupported expression {kind!r}")
+
+
+def _equality_terms(node):
+    """Return (field, values) when the node is an indexable equality test"""
+    if node[0] == "cmp" and node[1] == "eq":
+        left, right = node[2], node[3]
+        if left[0] == "prop" and right[0] == "lit":
+            return left[1], (right[1],)
+        if left[0] == "lit" and right[0] == "prop":
+            return right[1], (left[1],)
+    if node[0] == "in" and node[1][0] == "prop":
+        return node[1][1], node[2]
+    return None
+
+
+def _plan(node, lookup):
+    """
+    Resolve the parts of a filter that can be answered by hash indexes.
+
+    Returns (keys, exact) where keys is an ordered dict of candidate keys or
+    None when a full scan is needed, and exact is True when every candidate
+    is known to match without evaluating the predicate.
+    """
+    terms = _equality_terms(node)
+    if terms:
+        field, values = terms
+        buckets = [lookup(field, value) for value in values]
+        if any(bucket is None for bucket in buckets):
+            return None, False
+        if len(buckets) == 1:
+            return buckets[0], True
+        keys = {}
+        for bucket in buckets:
+            keys.update(bucket)
+        return keys, True
+    if node[0] == "and":
+        plans = [_plan(child, lookup) for child in node[1:]]
+        indexed = [keys for keys, _ in plans if keys is not None]
+        if not indexed:
+            return None, False
+        indexed.sort(key=len)
+        smallest, others = indexed[0], indexed[1:]
+        keys = {key: None for key in smallest if all(key in other for other in others)}
+        return keys, all(child_keys is not None and exact for child_keys, exact in plans)
+    if node[0] == "or":
+        plans = [_plan(child, lookup) for child in node[1:]]
+        if any(keys is None for keys, _ in plans):
+            return None, False
+        keys = {}
+        for child_keys, _ in plans:
+            keys.update(child_keys)
+        return keys, all(exact for _, exact in plans)
+    return None, False
+
+
+def _field_values(node, field):
+    """Return the set of values node restricts field to, or None if it does not"""
+    terms = _equality_terms(node)
+    if terms:
+        return set(terms[1]) if terms[0] == field else None
+    if node[0] == "and":
+        restricted = [values for values in (_field_values(child, field) for child in node[1:])
+                      if values is not None]
+        return set.intersection(*restricted) if restricted else None
+    if node[0] == "or":
+        children = [_field_values(child, field) for child in node[1:]]
+        if any(values is None for values in children):
+            return None
+        return set().union(*children)
+    return None
+
+
+_FLIPPED = {"gt": "lt", "ge": "le", "lt": "gt", "le": "ge", "eq": "eq"}
+
+
+def _range_term(node):
+    """Return (field, op, value) for a comparison of a property with a literal"""
+    if node[0] != "cmp" or node[1] == "ne":
+        return None
+    op, left, right = node[1], node[2], node[3]
+    if left[0] == "prop" and right[0] == "lit":
+        return left[1], op, right[1]
+    if left[0] == "lit" and right[0] == "prop":
+        return right[1], _FLIPPED[op], left[1]
+    return None
+
+
+def _conjuncts(node):
+    return node[1:] if node[0] == "and" else (node,)
+
+
+def _field_bounds(node, field):
+    """Return (lower, upper) bounds on field from the top-level and of node"""
+    lower = upper = None
+    for term in _conjuncts(node):
+        term = _range_term(term)
+        if term is None or term[0] != field or term[2] is None:
+            continue
+        _, op, value = term
+        # Each bound is (value, inclusive); the tighter of two bounds wins
+        try:
+            if op in ("gt", "ge", "eq"):
+                bound = (value, op != "gt")
+                if lower is None or (bound[0], not bound[1]) > (lower[0], not lower[1]):
+                    lower = bound
+            if op in ("lt", "le", "eq"):
+                bound = (value, op != "lt")
+                if upper is None or (bound[0], bound[1]) < (upper[0], upper[1]):
+                    upper = bound
+        except TypeError:
+            # Values of different types match nothing; leave that to the predicate
+            continue
+    return lower, upper
+
+
+def _converted_literals(node, field, convert):
+    """Return node with the literals compared with field passed through convert"""
+    kind = node[0]
+    if kind in ("and", "or"):
+        return (kind, *(_converted_literals(child, field, convert) for child in node[1:]))
+    if kind == "not":
+        return ("not", _converted_literals(node[1], field, convert))
+    if kind == "cmp":
+        op, left, right = node[1], node[2], node[3]
+        if left == ("prop", field) and right[0] == "lit" and right[1] is not None:
+            return ("cmp", op, left, ("lit", convert(right[1])))
+        if right == ("prop", field) and left[0] == "lit" and left[1] is not None:
+            return ("cmp", op, ("lit", convert(left[1])), right)
+    if kind == "in" and node[1] == ("prop", field):
+        return ("in", node[1], tuple(value if value is None else convert(value) for value in node[2]))
+    return node
+
+
+class CompiledFilter:
+    """A parsed $filter expression with its predicate and index plan"""
+
+    def __init__(self, text, ast=None):
+        self.text = text
+        self.ast = _Parser(_tokenize(text)).parse() if ast is None else ast
+        # Properties tested on their own, which have to be boolean ones
+        self.condition_properties = frozenset(_condition_properties(self.ast))
+        self.predicate = _compile_condition(self.ast)
+        self._converted = {}
+
+    def converting(self, field, convert):
+        """
+        Return the filter with every literal field is compared with passed
+        through convert, like date literals normalized to the form a store
+        keeps its dates in. The result is cached per field and convert.
+        """
+        converted = self._converted.get((field, convert))
+        if converted is None:
+            converted = CompiledFilter(self.text, _converted_literals(self.ast, field, convert))
+            self._converted[(field, convert)] = converted
+        return converted
+
+    def check_types(self, property_types):
+        """
+        Raise FilterError if a property tested on its own is not boolean,
+        given a {field: OpenAPI type} mapping of the entity set's properties.
+        """
+        for field in sorted(self.condition_properties):
+            property_type = property_types.get(field)
+            if property_type is not None and property_type != "boolean":
+                raise FilterError(f"{field} is not a boolean property, compare it with a value")
+
+    def plan(self, lookup):
+        """Return (candidate keys or None, exact) using the given index lookup"""
+        return _plan(self.ast, lookup)
+
+    def field_values(self, field):
+        """Return the only values field can take in matching entities, or None if unrestricted"""
+        return _field_values(self.ast, field)
+
+    def field_bounds(self, field):
+        """
+        Return (lower, upper) bounds the filter puts on field, each a
+        (value, inclusive) pair or None when that side is unbounded.
+        """
+        return _field_bounds(self.ast, field)
+
+    def equality_terms(self):
+        """
+        Return {field: set of values} when the filter is an and of equality
+        and in tests of fields against literals, which it then matches
+        exactly, or None otherwise.
+        """
+        terms = {}
+        for term in _conjuncts(self.ast):
+            term = _equality_terms(term)
+            if term is None:
+                return None
+            field, values = term
+            values = set(values)
+            terms[field] = terms[field] & values if field in terms else values
+        return terms
+
+    def only_restricts(self, fields):
+        """
+        Return True if the filter is an and of equality, in and range tests
+        of the given fields against literals, so that field_values and
+        field_bounds describe exactly the entities it matches.
+        """
+        for term in _conjuncts(self.ast):
+            terms = _equality_terms(term)
+            if terms is not None and terms[0] in fields:
+                continue
+            term = _range_term(term)
+            if term is None or term[0] not in fields or term[2] is None:
+                return False
+        return True
+
+
+@lru_cache(maxsize=512)
+def compile_filter(text):
+    """Parse and compile a $filter expression, caching by expression text"""
+    return CompiledFilter(text)
+
+
+@lru_cache(maxsize=512)
+def parse_orderby(text):
+    """Parse a $orderby expression into a tuple of (field, descending) pairs"""
+    clauses = []
+    for part in text.split(','):
+        words = part.split()
+        if not words:
+            continue
+        if not _PROPERTY_RE.fullmatch(words[0]):
+            raise FilterError(f"invalid property {words[0]!r}")
+        if len(words) > 2 or (len(words) == 2 and words[1].lower() not in ("asc", "desc")):
+            raise FilterError(f"invalid ordering {part.strip()!r}")
+        clauses.append((words[0], len(words) == 2 and words[1].lower() == "desc"))
+    return tuple(clauses)
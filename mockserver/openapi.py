@@ -0,0 +1,261 @@
+"""
+OpenAPI description of the Dynamics 365 Finance service for the mock server.
+
+load_spec reads the connector's OpenAPI document (docs/spec/openapi.json)
+into a ServiceSpec:
+
+- entity_sets: every entity set the paths expose, with its entity type, the
+  type's properties and its key fields, in the order the paths list them
+- operations: every path and method, classified as a collection, $count or
+  single entity request on an entity set
+
+The mock server generates routes and entity stores from it for operations
+it has no hand-written handler for, and builds its service root and
+$metadata from the entity sets.
+
+Request bodies are checked by validators compiled once per entity type:
+each property's schema is reduced to a set of accepted JSON types plus an
+optional enum and format check, so validating a body costs one dict lookup
+and a set membership test per property. As in OpenAPI, properties the
+schema does not declare are accepted unless it sets additionalProperties
+to false.
+"""
+
+import json
+import re
+
+
+class SpecError(ValueError):
+    """Raised when the OpenAPI document cannot be loaded or understood"""
+
+
+class ValidationError(ValueError):
+    """Raised when a request body does not match its schema"""
+
+
+_JSON_TYPES = {
+    "string": (str,),
+    "number": (int, float),
+    "integer": (int,),
+    "boolean": (bool,),
+    "object": (dict,),
+    "array": (list,),
+}
+
+_TYPE_NAMES = {str: "a string", int: "an integer", float: "a number", bool: "a boolean",
+               dict: "an object", list: "an array", type(None): "null"}
+
+_FORMATS = {
+    "date-time": re.compile(r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}(:\d{2}(\.\d+)?)?(Z|[+-]\d{2}:\d{2})$").match,
+    "date": re.compile(r"\d{4}-\d{2}-\d{2}$").match,
+}
+_FORMAT_NAMES = {matches: name for name, matches in _FORMATS.items()}
+
+# Path shapes: /EntitySet, /EntitySet/$count and /EntitySet(key='{param}',...)
+_PATH_RE = re.compile(r"^/(?P<name>[A-Za-z_]\w*)(?:(?P<count>/\$count)|\((?P<key>[^)]*)\))?$")
+_KEY_RE = re.compile(r"(\w+)='?\{(\w+)\}'?")
+
+
+def _ref(spec, reference):
+    if not reference.startswith("#/"):
+        raise SpecError(f"unsupported $ref {reference!r}")
+    node = spec
+    for part in reference[2:].split("/"):
+        if not isinstance(node, dict) or part not in node:
+            raise SpecError(f"unresolved $ref {reference!r}")
+        node = node[part]
+    return node
+
+
+def resolve_schema(spec, schema):
+    """Return schema with $ref followed and allOf merged into one object schema"""
+    while "$ref" in schema:
+        schema = _ref(spec, schema["$ref"])
+    if "allOf" not in schema:
+        return schema
+    merged = {key: value for key, value in schema.items() if key != "allOf"}
+    properties = dict(merged.get("properties", {}))
+    required = list(merged.get("required", ()))
+    for part in schema["allOf"]:
+        part = resolve_schema(spec, part)
+        properties.update(part.get("properties", {}))
+        required += [name for name in part.get("required", ()) if name not in required]
+        for key, value in part.items():
+            if key not in ("properties", "required"):
+                merged.setdefault(key, value)
+    merged["properties"] = properties
+    if required:
+        merged["required"] = required
+    return merged
+
+
+def _property_check(spec, schema):
+    """Return (accepted types, enum or None, format match or None) for a property schema"""
+    schema = resolve_schema(spec, schema)
+    enum = schema.get("enum")
+    if "type" in schema:
+        types = set(_JSON_TYPES.get(schema["type"], ()))
+        if not types:
+            raise SpecError(f"unsupported type {schema['type']!r}")
+    elif enum is not None:
+        types = {type(value) for value in enum}
+    else:
+        types = {type(None)}.union(*_JSON_TYPES.values())
+    if schema.get("nullable"):
+        types.add(type(None))
+    matches = _FORMATS.get(schema.get("format")) if schema.get("type") == "string" else None
+    return frozenset(types), frozenset(enum) if enum is not None else None, matches
+
+
+def _describe(name, value, check):
+    types, enum, matches = check
+    if type(value) not in types:
+        expected = " or ".join(sorted({_TYPE_NAMES[t] for t in types if t is not int or float not in types}))
+        return f"property '{name}' must be {expected}, not {_TYPE_NAMES.get(type(value), type(value).__name__)}"
+    if enum is not None and value not in enum:
+        return f"property '{name}' must be one of {', '.join(repr(option) for option in sorted(enum, key=str))}"
+    return f"property '{name}' must be a {_FORMAT_NAMES[matches]} string"
+
+
+def compile_validator(spec, schema, partial=False):
+    """
+    Return a function that raises ValidationError unless its argument is a
+    JSON object matching schema. With partial=True (PATCH bodies) required
+    properties may be left out.
+    """
+    schema = resolve_schema(spec, schema)
+    checks = {name: _property_check(spec, property_schema)
+              for name, property_schema in schema.get("properties", {}).items()}
+    required = () if partial else tuple(schema.get("required", ()))
+    closed = schema.get("additionalProperties") is False
+
+    def validate(body):
+        if type(body) is not dict:
+            raise ValidationError("request body must be a JSON object")
+        for name in required:
+            if name not in body:
+                raise ValidationError(f"missing required property '{name}'")
+        for name, value in body.items():
+            check = checks.get(name)
+            if check is None:
+                # Instance annotations such as @odata.etag are always allowed
+                if closed and not name.startswith("@"):
+                    raise ValidationError(f"unknown property '{name}'")
+                continue
+            types, enum, matches = check
+            if (type(value) not in types or (enum is not None and value not in enum)
+                    or (matches is not None and type(value) is str and not matches(value))):
+                raise ValidationError(_describe(name, value, check))
+    return validate
+
+
+class EntitySet:
+    """An entity set of the service: its entity type, properties and key fields"""
+
+    def __init__(self, spec, name, entity_type, key=None):
+        self.name = name
+        self.entity_type = entity_type
+        schema = resolve_schema(spec, {"$ref": f"#/components/schemas/{entity_type}"})
+        self.properties = {field: resolve_schema(spec, property_schema)
+                           for field, property_schema in schema.get("properties", {}).items()
+                           if not field.startswith("@")}
+        self.key = tuple(key) if key else self._default_key()
+        self.validate_create = compile_validator(spec, schema)
+        self.validate_update = compile_validator(spec, schema, partial=True)
+
+    def _default_key(self):
+        # D365 entities are keyed by company and their first identifying field
+        fields = list(self.properties)
+        if not fields:
+            raise SpecError(f"entity type {self.entity_type} has no properties")
+        if "dataAreaId" in fields and len(fields) > 1:
+            return ("dataAreaId", next(field for field in fields if field != "dataAreaId"))
+        return (fields[0],)
+
+    @property
+    def company_scoped(self):
+        return "dataAreaId" in self.properties
+
+    def key_of(self, entity):
+        """Return the store key of an entity, its key field values joined by '_'"""
+        return "_".join(str(entity[field]) for field in self.key)
+
+
+class Operation:
+    """One path and method of the spec"""
+
+    def __init__(self, method, path, operation_id, entity_set=None, kind=None, key_params=()):
+        self.method = method
+        self.path = path
+        self.operation_id = operation_id
+        self.entity_set = entity_set
+        # "collection", "count" or "entity"; None for service documents
+        self.kind = kind
+        # (key field, path parameter) pairs of single entity paths
+        self.key_params = tuple(key_params)
+        self.rule = re.sub(r"\{(\w+)\}", r"<\1>", path)
+
+
+def _body_type(spec, operation):
+    """Return the entity type of an operation's request body or collection response"""
+    schemas = []
+    body = operation.get("requestBody", {}).get("content", {}).get("application/json", {})
+    if "schema" in body:
+        schemas.append(body["schema"])
+    response = operation.get("responses", {}).get("200", {}).get("content", {}).get("application/json", {})
+    if "schema" in response:
+        collection = resolve_schema(spec, response["schema"])
+        schemas.append(collection.get("properties", {}).get("value", {}).get("items", {}))
+    for schema in schemas:
+        reference = schema.get("$ref", "")
+        if reference.startswith("#/components/schemas/"):
+            return reference.rsplit("/", 1)[1]
+    return None
+
+
+class ServiceSpec:
+    """Entity sets and operations described by an OpenAPI document"""
+
+    def __init__(self, document):
+        if not isinstance(document.get("paths"), dict):
+            raise SpecError("the document has no paths")
+        self.document = document
+        self.entity_sets = {}
+        self.operations = []
+
+        types, keys, shapes = {}, {}, []
+        for path, methods in document["paths"].items():
+            match = _PATH_RE.match(path)
+            for method, operation in methods.items():
+                if not isinstance(operation, dict) or "responses" not in operation:
+                    continue
+                shapes.append((method.upper(), path, operation, match))
+                if match is None:
+                    continue
+                entity_type = _body_type(document, operation)
+                if entity_type is not None:
+                    types.setdefault(match.group("name"), entity_type)
+                if match.group("key"):
+                    keys[match.group("name")] = [field for field, _ in _KEY_RE.findall(match.group("key"))]
+
+        for name, entity_type in types.items():
+            self.entity_sets[name] = EntitySet(document, name, entity_type, keys.get(name))
+
+        for method, path, operation, match in shapes:
+            name = match.group("name") if match else None
+            if name not in self.entity_sets:
+                self.operations.append(Operation(method, path, operation.get("operationId")))
+                continue
+            kind = "count" if match.group("count") else "entity" if match.group("key") is not None else "collection"
+            key_params = _KEY_RE.findall(match.group("key") or "")
+            self.operations.append(Operation(method, path, operation.get("operationId"), name, kind, key_params))
+
+
+def load_spec(path):
+    """Load the OpenAPI document at path into a ServiceSpec"""
+    try:
+        with open(path) as spec_file:
+            document = json.load(spec_file)
+    except (OSError, ValueError) as e:
+        raise SpecError(f"cannot read {path}: {e}") from e
+    return ServiceSpec(document)
@@ -0,0 +1,273 @@
+"""
+Company-partitioned entity stores for the Dynamics 365 Finance mock server.
+
+Dynamics 365 Finance scopes data by legal entity: every vendor and customer
+belongs to one company (dataAreaId), a request sees only the user's default
+company, and cross-company=true queries span all of them. PartitionedStore
+mirrors that layout with one EntityStore per company, each with its own
+rows, indexes and lock:
+
+- a company-scoped query, or one whose $filter pins dataAreaId, runs
+  against the matching partitions only, so its cost does not grow with the
+  number of companies
+- a count sums the maintained counts of the selected partitions; within a
+  partition, its dataAreaId test is known to hold, so a filter on
+  dataAreaId and one indexed field is counted in constant time per company
+- a cross-company query fans out to the partitions, on a thread pool when
+  fanout_workers > 1, and lazily merges their ordered results, so $top only pulls as many rows from
+  each partition as the merged page needs
+
+Writes go through the PartitionedStore, which keeps the entity set's lock,
+version, change log and write log, so ETags, the response cache, delta
+queries and snapshots work across partitions as they do for a single store.
+"""
+
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from store import EntityStore, merge_ordered
+
+
+def _key_prefix(key):
+    return key.partition("_")[0]
+
+
+class _PartitionedRows:
+    """Read-only mapping of entity key to row across the partitions of a store"""
+
+    def __init__(self, store):
+        self._store = store
+
+    def _partition(self, key):
+        return self._store.partitions.get(self._store.partition_of(key))
+
+    def get(self, key, default=None):
+        partition = self._partition(key)
+        return default if partition is None else partition._rows.get(key, default)
+
+    def __getitem__(self, key):
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def __contains__(self, key):
+        partition = self._partition(key)
+        return partition is not None and key in partition._rows
+
+    def __len__(self):
+        return sum(len(partition) for partition in self._store.partitions.values())
+
+    def __iter__(self):
+        return self.keys()
+
+    def keys(self):
+        for partition in self._store.partitions.values():
+            yield from partition._rows.keys()
+
+    def values(self):
+        for partition in self._store.partitions.values():
+            yield from partition._rows.values()
+
+    def items(self):
+        for partition in self._store.partitions.values():
+            yield from partition._rows.items()
+
+
+class PartitionedStore(EntityStore):
+    """
+    EntityStore split into one partition per company.
+
+    create_partition(name) returns an empty EntityStore (of any backend) for
+    a new partition. partition_of(key) names the partition of an entity key,
+    by default its prefix up to the first "_" (keys are "{dataAreaId}_{id}"),
+    and partition_field is the entity field holding the same value, used to
+    prune partitions from $filter expressions. Queries spanning several
+    partitions run on fanout_workers threads, or sequentially when it is 1.
+    """
+
+    def __init__(self, name, create_partition, partition_field="dataAreaId", partition_of=_key_prefix,
+                 fanout_workers=1):
+        super().__init__(name)
+        self.partition_field = partition_field
+        self.partition_of = partition_of
+        self.fanout_workers = fanout_workers
+        self._create_partition = create_partition
+        # Replaced rather than mutated when a partition is added, so readers
+        # can iterate it without the lock
+        self.partitions = {}
+        self._rows = _PartitionedRows(self)
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self._probe = None
+
+    def partition(self, value):
+        """Return the partition for value, creating it if needed"""
+        partition = self.partitions.get(value)
+        if partition is None:
+            with self.lock:
+                partition = self.partitions.get(value)
+                if partition is None:
+                    partition = self._create_partition(f"{self.name}({value})")
+                    # Partitions leave change tracking and logging to this store
+                    partition.max_changes = 0
+                    self.partitions = {**self.partitions, value: partition}
+        return partition
+
+    def materialize(self, entity):
+        return entity if isinstance(entity, dict) else dict(entity)
+
+    def _store(self, key, entity):
+        partition = self.partition(self.partition_of(key))
+        with partition.lock:
+            partition._store(key, entity)
+        self.version += 1
+        self._log_change(key)
+        if self.write_log is not None:
+            self.write_log.record(self.name, key, self.materialize(entity))
+
+    def _delete(self, key):
+        partition = self.partitions[self.partition_of(key)]
+        with partition.lock:
+            partition._delete(key)
+        self.version += 1
+        self._log_change(key)
+        if self.write_log is not None:
+            self.write_log.record(self.name, key, None)
+
+    def _bulk_load(self, entries, log_changes=False):
+        grouped = {}
+        write_log = self.write_log
+        partition_of = self.partition_of
+        for entry in entries:
+            value = partition_of(entry[0])
+            group = grouped.get(value)
+            if group is None:
+                group = grouped[value] = []
+            group.append(entry)
+            if write_log is not None:
+                write_log.record(self.name, entry[0], self.materialize(entry[1]))
+        loaded = 0
+        for value, group in grouped.items():
+            partition = self.partition(value)
+            with partition.lock:
+                loaded += partition._bulk_load(group)
+            # Logged once stored, so a delta reader never finds a change
+            # whose row is not there yet
+            if log_changes:
+                for key, _ in group:
+                    self.version += 1
+                    self._log_change(key)
+        if not log_changes:
+            self.version += 1
+            self._reset_changes()
+        return loaded
+
+    def clear(self):
+        with self.lock:
+            self.partitions = {}
+            self.version += 1
+            self._reset_changes()
+
+    def lookup(self, field, value):
+        """Return the keys whose field equals value across all partitions"""
+        keys = {}
+        for partition in self.partitions.values():
+            bucket = partition.lookup(field, value)
+            if bucket is None:
+                return None
+            keys.update(bucket)
+        return keys
+
+    def _probe_partition(self):
+        # Partitions are created alike, so an unused one tells for all of them
+        if self._probe is None:
+            self._probe = self._create_partition(f"{self.name}(probe)")
+        return self._probe
+
+    def is_indexed(self, field):
+        return field == self.partition_field or self._probe_partition().is_indexed(field)
+
+    def searched_fields(self):
+        return self._probe_partition().searched_fields()
+
+    def find(self, values, limit=None):
+        """Return the (key, row) pairs whose fields equal values, as EntityStore.find does"""
+        values = dict(values)
+        if self.partition_field in values:
+            partition = self.partitions.get(values.pop(self.partition_field))
+            return [] if partition is None else partition.find(values, limit)
+        found = []
+        for partition in self.partitions.values():
+            entries = partition.find(values, limit)
+            if entries is None:
+                return None
+            found.append(entries)
+        return list(islice(heapq.merge(*found), limit))
+
+    def select_partitions(self, compiled_filter=None, companies=None):
+        """
+        Return the partitions a query has to read: those named in companies
+        (all when None) that compiled_filter does not rule out.
+        """
+        values = None if companies is None else set(companies)
+        if compiled_filter is not None:
+            pinned = compiled_filter.field_values(self.partition_field)
+            if pinned is not None:
+                values = pinned if values is None else values & pinned
+        partitions = self.partitions
+        if values is None:
+            return list(partitions.values())
+        return [partitions[value] for value in sorted(values, key=str) if value in partitions]
+
+    def query(self, compiled_filter=None, orderby=(), after=None, companies=None, search=None):
+        """
+        Return (entries, count) as EntityStore.query does, over the partitions
+        selected by select_partitions.
+
+        Each partition plans and counts its part of the query under its own
+        lock, in parallel when there are several; their ordered entries are
+        then merged lazily into one result in $orderby order.
+        """
+        selected = self.select_partitions(compiled_filter, companies)
+        # Partitions are selected by the partition field, so its tests hold in each
+        implied = (self.partition_field,)
+        if len(selected) == 1:
+            return selected[0].query(compiled_filter, orderby, after, implied, search)
+
+        def run(chunk):
+            return [partition.query(compiled_filter, orderby, after, implied, search) for partition in chunk]
+
+        # One task per worker rather than per partition keeps the hand-off
+        # cost independent of the number of companies
+        pool = self._fanout_pool()
+        if pool is None or len(selected) < 2:
+            results = run(selected)
+        else:
+            step = -(-len(selected) // self.fanout_workers)
+            chunks = [selected[start:start + step] for start in range(0, len(selected), step)]
+            results = [result for chunk_results in pool.map(run, chunks) for result in chunk_results]
+        entries = merge_ordered([entries for entries, _ in results], orderby)
+        return entries, sum(count for _, count in results)
+
+    def count(self, compiled_filter=None, companies=None, search=None):
+        """
+        Return the number of entities in the given companies (all when None)
+        matching a compiled $filter and $search, summed over the selected
+        partitions.
+        """
+        implied = (self.partition_field,)
+        return sum(partition.count(compiled_filter, implied, search)
+                   for partition in self.select_partitions(compiled_filter, companies))
+
+    def _fanout_pool(self):
+        if self.fanout_workers <= 1:
+            return None
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self.fanout_workers,
+                                                    thread_name_prefix=f"{self.name}-fanout")
+        return self._pool
@@ -0,0 +1,299 @@
+"""
+Exchange rates for the Dynamics 365 Finance mock server.
+
+ExchangeRateStore keeps the rate history of every rate type and currency
+pair as a time series of its own, sorted by ValidFromDate:
+
+- an as-of lookup, the latest rate valid on a date, bisects one series, so
+  it costs O(log n) however long the history grows
+- $filter tests of the rate type and currency codes pick the series a query
+  reads, and ValidFromDate ranges are bisected within each of them; the
+  predicate only runs over the rates left, and not at all when the filter
+  has no other terms
+- a pair without a rate of its own is converted through its inverse or
+  crossed through a pivot currency (USD). Every derived rate is memoized
+  per rate type, pair and date, and the memo is dropped whenever a rate is
+  written
+"""
+
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from itertools import chain
+from operator import itemgetter
+
+from store import _active_transaction, _sort_key
+
+# Fields identifying a series, in the order of its key
+SERIES_FIELDS = ("RateTypeId", "FromCurrencyCode", "ToCurrencyCode")
+DATE_FIELD = "ValidFromDate"
+
+_MISSING = object()
+
+
+def as_of_date(value):
+    """
+    Return a date or date-time as a ValidFromDate string (UTC, whole
+    seconds), or None when value is neither. A date stands for midnight UTC.
+    """
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc)
+    return moment.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _date_literal(value):
+    """Normalize a $filter literal compared with ValidFromDate, keeping non-dates as they are"""
+    normalized = as_of_date(value)
+    return value if normalized is None else normalized
+
+
+def _run(rows, start, end, descending):
+    """Yield rows[start:end] by position, last first when descending"""
+    positions = range(end - 1, start - 1, -1) if descending else range(start, end)
+    for position in positions:
+        yield rows[position]
+
+
+class _Series:
+    """The rates of one rate type and currency pair, in ValidFromDate order"""
+
+    __slots__ = ("dates", "rows")
+
+    def __init__(self):
+        self.dates = []
+        self.rows = []
+
+
+class ExchangeRateStore:
+    """
+    Exchange rates grouped into one time series per (rate type, from
+    currency, to currency). A series holds one rate per ValidFromDate; a
+    later write for the same date replaces it.
+
+    Iterating yields every rate, so the store can stand in for the plain
+    list of rates snapshots and seeding work with.
+    """
+
+    def __init__(self, pivot_currency="USD", max_memoized=100000, name="ExchangeRates"):
+        self.name = name
+        self.pivot_currency = pivot_currency
+        self.max_memoized = max_memoized
+        self.lock = threading.RLock()
+        self.version = 0
+        # Replaced rather than mutated when a series is added, so readers
+        # can iterate it without the lock
+        self._series = {}
+        self._size = 0
+        self._memo = {}
+        # Set to a snapshot.WriteLog to record every rate added
+        self.write_log = None
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for series in self._series.values():
+            yield from series.rows
+
+    def _put(self, rate):
+        """Store a rate and return its (series key, ValidFromDate) key"""
+        key = tuple(rate.get(field) for field in SERIES_FIELDS)
+        series = self._series.get(key)
+        if series is None:
+            series = _Series()
+            self._series = {**self._series, key: series}
+        date = rate[DATE_FIELD]
+        dates = series.dates
+        # History usually arrives in date order, so appending is the common case
+        if not dates or date > dates[-1]:
+            series.rows.append(rate)
+            dates.append(date)
+            self._size += 1
+            return key + (date,)
+        position = bisect_left(dates, date)
+        if dates[position] == date:
+            series.rows[position] = rate
+        else:
+            series.rows.insert(position, rate)
+            dates.insert(position, date)
+            self._size += 1
+        return key + (date,)
+
+    def _get(self, key):
+        """Return the rate stored under a (series key, ValidFromDate) key, or None"""
+        series = self._series.get(key[:-1])
+        if series is None:
+            return None
+        position = bisect_left(series.dates, key[-1])
+        if position < len(series.dates) and series.dates[position] == key[-1]:
+            return series.rows[position]
+        return None
+
+    def _remove(self, key):
+        series = self._series.get(key[:-1])
+        if series is None:
+            return
+        position = bisect_left(series.dates, key[-1])
+        if position < len(series.dates) and series.dates[position] == key[-1]:
+            del series.rows[position]
+            del series.dates[position]
+            self._size -= 1
+
+    def _written(self):
+        self.version += 1
+        self._memo = {}
+
+    def add(self, rate):
+        """Store a rate, replacing the rate of its series with the same ValidFromDate"""
+        key = tuple(rate.get(field) for field in SERIES_FIELDS) + (rate[DATE_FIELD],)
+        with self.lock:
+            transaction = _active_transaction()
+            if transaction is not None:
+                transaction.record(self, key, self._get(key))
+            self._restore(key, rate)
+
+    def _restore(self, key, rate):
+        # Stores rate under key, or removes the rate there when it is None, as
+        # EntityStore._restore does for rollbacks and write log replays
+        if rate is None:
+            self._remove(key)
+        else:
+            self._put(rate)
+        self._written()
+        if self.write_log is not None:
+            self.write_log.record(self.name, key, rate)
+
+    def extend(self, rates):
+        with self.lock:
+            for rate in rates:
+                self._put(rate)
+            self._written()
+
+    def clear(self):
+        with self.lock:
+            self._series = {}
+            self._size = 0
+            self._written()
+
+    def as_of(self, from_currency, to_currency, date, rate_type):
+        """Return the stored rate of a pair valid on date, or None"""
+        with self.lock:
+            series = self._series.get((rate_type, from_currency, to_currency))
+            if series is None:
+                return None
+            position = bisect_right(series.dates, date)
+            return series.rows[position - 1] if position else None
+
+    def _leg(self, from_currency, to_currency, date, rate_type):
+        """Return (value, valid from, source) of a stored rate or its inverse, or None"""
+        rate = self.as_of(from_currency, to_currency, date, rate_type)
+        if rate is not None:
+            return rate["ExchangeRateValue"], rate[DATE_FIELD], "direct"
+        rate = self.as_of(to_currency, from_currency, date, rate_type)
+        if rate is not None and rate["ExchangeRateValue"]:
+            return 1 / rate["ExchangeRateValue"], rate[DATE_FIELD], "inverse"
+        return None
+
+    def _derive(self, from_currency, to_currency, date, rate_type):
+        if from_currency == to_currency:
+            return 1.0, None, "identity"
+        leg = self._leg(from_currency, to_currency, date, rate_type)
+        if leg is not None or self.pivot_currency in (from_currency, to_currency):
+            return leg
+        first = self._leg(from_currency, self.pivot_currency, date, rate_type)
+        second = self._leg(self.pivot_currency, to_currency, date, rate_type)
+        if first is None or second is None:
+            return None
+        # A cross rate changes whenever either leg does
+        return first[0] * second[0], max(first[1], second[1]), "cross"
+
+    def rate(self, from_currency, to_currency, date, rate_type):
+        """
+        Return the rate converting from_currency to to_currency on date, as
+        a dict with the rate, the ValidFromDate it takes effect from and its
+        Source (direct, inverse, cross or identity), or None when there is
+        none. date must be in the ValidFromDate format (see as_of_date).
+        """
+        key = (rate_type, from_currency, to_currency, date)
+        result = self._memo.get(key, _MISSING)
+        if result is not _MISSING:
+            return result
+        with self.lock:
+            derived = self._derive(from_currency, to_currency, date, rate_type)
+            if derived is not None:
+                value, valid_from, source = derived
+                result = {
+                    "FromCurrencyCode": from_currency,
+                    "ToCurrencyCode": to_currency,
+                    "RateTypeId": rate_type,
+                    "AsOfDate": date,
+                    "ExchangeRateValue": value,
+                    "ValidFromDate": valid_from,
+                    "Source": source
+                }
+            else:
+                result = None
+            if len(self._memo) >= self.max_memoized:
+                self._memo = {}
+            self._memo[key] = result
+        return result
+
+    def query(self, compiled_filter=None, orderby=()):
+        """
+        Return (rates, count) for a compiled $filter and parsed $orderby.
+
+        Rates are listed series by series, each in ValidFromDate order,
+        unless orderby says otherwise. Ordering by ValidFromDate alone
+        merges the series lazily, so $top=1 on ValidFromDate desc finds the
+        latest rate of a series without reading the rest of it.
+        """
+        lower = upper = None
+        exact = True
+        if compiled_filter is not None:
+            # Stored dates are normalized to UTC, so literals are too before
+            # they are bisected or compared
+            compiled_filter = compiled_filter.converting(DATE_FIELD, _date_literal)
+        with self.lock:
+            selected = list(self._series.items())
+            if compiled_filter is not None:
+                for position, field in enumerate(SERIES_FIELDS):
+                    values = compiled_filter.field_values(field)
+                    if values is not None:
+                        selected = [(key, series) for key, series in selected if key[position] in values]
+                lower, upper = compiled_filter.field_bounds(DATE_FIELD)
+                if any(bound is not None and not isinstance(bound[0], str) for bound in (lower, upper)):
+                    lower = upper = None
+                    exact = False
+                else:
+                    exact = compiled_filter.only_restricts(SERIES_FIELDS + (DATE_FIELD,))
+            spans = []
+            for _, series in selected:
+                dates = series.dates
+                start = 0 if lower is None else (bisect_left if lower[1] else bisect_right)(dates, lower[0])
+                end = len(dates) if upper is None else (bisect_right if upper[1] else bisect_left)(dates, upper[0])
+                if start < end:
+                    spans.append((series.rows, start, end))
+
+        # Rates are read by position, so a concurrent write can at worst
+        # shift which rates a page shows, as with EntityStore indexes
+        by_date = len(orderby) == 1 and orderby[0][0] == DATE_FIELD
+        descending = by_date and orderby[0][1]
+        runs = [_run(rows, start, end, descending) for rows, start, end in spans]
+        if by_date and len(runs) > 1:
+            rates = heapq.merge(*runs, key=itemgetter(DATE_FIELD), reverse=descending)
+        else:
+            rates = chain.from_iterable(runs)
+        if exact and (by_date or not orderby):
+            return rates, sum(end - start for _, start, end in spans)
+        if not exact:
+            rates = filter(compiled_filter.predicate, rates)
+        rates = list(rates)
+        if orderby and not by_date:
+            for field, descending in reversed(orderby):
+                rates.sort(key=lambda rate: _sort_key(rate.get(field)), reverse=descending)
+        return rates, len(rates)
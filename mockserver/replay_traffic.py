@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Replay captured traffic against a running Microsoft Dynamics 365 Finance Mock Server.
+
+Reads a log written by the server's traffic capture (--capture) and sends
+every request again, with its method, path, query, headers and body, over
+pooled keep-alive connections:
+
+- --speed 1 (default) keeps the captured arrival times, --speed N
+  compresses them N-fold; requests are sent on that schedule however fast
+  the server answers, and the lag behind the schedule is reported
+- --speed max sends the requests in captured order as fast as
+  --concurrency workers can
+
+For every route template the result compares the server-side latency
+recorded at capture with the latency of the replay, and reports the drift
+between them (replay minus capture) at p50/p90/p99, along with requests
+whose status differs from the captured one. Replay latency is measured at
+the client, so it includes the network and client overhead the captured
+latency does not; against a local server that is a fraction of a
+millisecond. For statuses to match, start the server from the same
+snapshot the captured traffic ran against.
+
+Usage:
+    python replay_traffic.py capture.jsonl --speed 1 --concurrency 32
+    python replay_traffic.py capture.jsonl --speed 10 --output replay.json
+    python replay_traffic.py capture.jsonl --speed max --concurrency 8
+"""
+
+import argparse
+import base64
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from bench_load import make_session
+from capture import read_capture
+from metrics import LatencyHistogram, QUANTILES
+
+BASE_URL = "http://localhost:8080"
+
+
+class DriftRecorder:
+    """Thread-safe captured and replayed latencies per route template"""
+
+    def __init__(self):
+        self.captured = {}
+        self.replayed = {}
+        self.mismatches = {}
+        self.errors = {}
+        self.lag = LatencyHistogram()
+        self.lock = threading.Lock()
+
+    def record(self, record, seconds, lag, status=None, error=None):
+        route = f"{record['method']} {record.get('route') or record['path']}"
+        with self.lock:
+            for histograms, micros in ((self.captured, int(record["durationMs"] * 1000)),
+                                       (self.replayed, int(seconds * 1_000_000))):
+                histogram = histograms.get(route) or histograms.setdefault(route, LatencyHistogram())
+                histogram.record(micros)
+            self.lag.record(int(max(lag, 0) * 1_000_000))
+            if error is not None:
+                self.errors[route] = self.errors.get(route, 0) + 1
+            elif status != record["status"]:
+                mismatches = self.mismatches.setdefault(route, {})
+                change = f"{record['status']}->{status}"
+                mismatches[change] = mismatches.get(change, 0) + 1
+
+    def summary(self, elapsed):
+        def quantiles(histogram):
+            return {f"p{q * 100:g}".replace(".", "") + "_ms": round(histogram.quantile(q) / 1000, 3)
+                    for q in QUANTILES[:3]}
+
+        def compare(captured, replayed):
+            captured_ms, replayed_ms = quantiles(captured), quantiles(replayed)
+            return {
+                "requests": replayed.total,
+                "captured": captured_ms,
+                "replayed": replayed_ms,
+                "drift": {name: round(replayed_ms[name] - captured_ms[name], 3) for name in captured_ms},
+                "mean_drift_ms": round((replayed.sum - captured.sum) / replayed.total / 1000, 3)
+            }
+
+        all_captured, all_replayed = LatencyHistogram(), LatencyHistogram()
+        routes = {}
+        for route in sorted(self.replayed):
+            all_captured.merge(self.captured[route])
+            all_replayed.merge(self.replayed[route])
+            routes[route] = compare(self.captured[route], self.replayed[route])
+            routes[route]["status_mismatches"] = self.mismatches.get(route, {})
+            routes[route]["errors"] = self.errors.get(route, 0)
+        overall = compare(all_captured, all_replayed) if all_replayed.total else {"requests": 0}
+        return {
+            **overall,
+            "throughput_rps": round(all_replayed.total / elapsed, 2),
+            "status_mismatches": sum(sum(changes.values()) for changes in self.mismatches.values()),
+            "errors": sum(self.errors.values()),
+            "schedule_lag": {**quantiles(self.lag), "max_ms": round(self.lag.quantile(1.0) / 1000, 3)},
+            "routes": routes
+        }
+
+
+def send(session, record, recorder, scheduled):
+    """Send one captured request and record its latency against the captured one"""
+    url = BASE_URL + record["path"] + (f"?{record['query']}" if record.get("query") else "")
+    if "bodyBase64" in record:
+        body = base64.b64decode(record["bodyBase64"])
+    else:
+        body = record.get("body", "").encode("utf-8") or None
+    started = time.perf_counter()
+    lag = started - scheduled
+    try:
+        # Read the whole body, streamed or not, so the latency covers the last byte
+        response = session.request(record["method"], url, headers=record["headers"], data=body, timeout=60,
+                                   stream=True)
+        for _ in response.iter_content(65536, decode_unicode=False):
+            pass
+        recorder.record(record, time.perf_counter() - started, lag, response.status_code)
+    except requests.RequestException as e:
+        recorder.record(record, time.perf_counter() - started, lag, error=e)
+
+
+def replay_scheduled(records, speed, concurrency, recorder):
+    """Send each record at its offset from the first captured request divided by speed"""
+    session = make_session(concurrency)
+    first = records[0]["time"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for record in records:
+            scheduled = start + (record["time"] - first) / speed
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(send, session, record, recorder, scheduled)
+
+
+def replay_max(records, concurrency, recorder):
+    """Send the records in captured order as fast as the workers can"""
+    session = make_session(concurrency)
+    pending = iter(records)
+    lock = threading.Lock()
+
+    def worker(_):
+        while True:
+            with lock:
+                record = next(pending, None)
+            if record is None:
+                return
+            send(session, record, recorder, time.perf_counter())
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+
+
+def main():
+    global BASE_URL
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("capture", help="traffic log written by the server's --capture")
+    parser.add_argument("--url", default=BASE_URL, help="base URL of the running mock server")
+    parser.add_argument("--speed", default="1",
+                        help="time scale of the replay: 1 for real time, N for N times faster, max for no delays")
+    parser.add_argument("--concurrency", type=int, default=16, help="worker threads and keep-alive connections")
+    parser.add_argument("--limit", type=int, help="replay only the first N captured requests")
+    parser.add_argument("--output", help="write the JSON result to this file")
+    args = parser.parse_args()
+    BASE_URL = args.url.rstrip("/")
+    if args.speed != "max":
+        try:
+            speed = float(args.speed)
+        except ValueError:
+            speed = 0
+        if speed <= 0:
+            parser.error("--speed must be a positive number or max")
+
+    records = read_capture(args.capture)
+    if args.limit is not None:
+        records = records[:args.limit]
+    if not records:
+        parser.error(f"no requests captured in {args.capture}")
+
+    recorder = DriftRecorder()
+    started = time.perf_counter()
+    if args.speed == "max":
+        replay_max(records, args.concurrency, recorder)
+    else:
+        replay_scheduled(records, speed, args.concurrency, recorder)
+    elapsed = time.perf_counter() - started
+
+    captured_s = records[-1]["time"] - records[0]["time"]
+    result = {
+        "config": {
+            "url": BASE_URL,
+            "capture": args.capture,
+            "speed": args.speed,
+            "concurrency": args.concurrency
+        },
+        "captured_s": round(captured_s, 3),
+        "elapsed_s": round(elapsed, 3),
+        "summary": recorder.summary(elapsed)
+    }
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
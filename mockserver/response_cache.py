@@ -0,0 +1,124 @@
+"""
+Pre-serialized response cache for the Dynamics 365 Finance mock server.
+
+Read-mostly GET endpoints keep the final encoded body of each response,
+together with the response headers (ETag, Content-Type, ...) and a
+compressed copy per Content-Encoding clients have asked for, so a repeated
+request is answered without querying, serializing or compressing anything
+again.
+
+Every entry records the version of the data it was built from. A lookup
+passes the current version and an entry built from an older one is dropped,
+so any write to the underlying entity set (including bulk loads and
+changeset rollbacks) invalidates exactly the responses that depend on it.
+The cache is bounded both by number of entries and by total bytes, evicting
+the least recently used entries first.
+"""
+
+import threading
+from collections import OrderedDict
+
+
+class CachedResponse:
+    """Encoded body, compressed variants and headers of one cached response"""
+
+    __slots__ = ("key", "version", "body", "encodings", "headers", "rows", "size")
+
+    def __init__(self, key, version, body, headers, rows=0):
+        self.key = key
+        self.version = version
+        self.body = body
+        # Compressed copies of body by Content-Encoding, added on first use
+        self.encodings = {}
+        self.headers = headers
+        # Number of entities in the response, for latency emulation
+        self.rows = rows
+        self.size = len(body)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of encoded responses keyed by request"""
+
+    def __init__(self, max_entries=512, max_bytes=64 * 1024 * 1024, max_entry_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 8
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        """Return the entry for key if it was built from version, else None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.version == version:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            if entry is not None:
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(self, key, version, body, headers, rows=0):
+        """
+        Cache an encoded response body and return its entry.
+
+        Bodies larger than max_entry_bytes are not cached and None is
+        returned.
+        """
+        if len(body) > self.max_entry_bytes:
+            return None
+        entry = CachedResponse(key, version, body, headers, rows)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+        return entry
+
+    def encoded(self, entry, encoding, compress):
+        """
+        Return entry's body compressed with the named Content-Encoding,
+        calling compress(body) only the first time an encoding is asked for.
+        """
+        data = entry.encodings.get(encoding)
+        if data is not None:
+            return data
+        # Compressed outside the lock; two requests racing for the same
+        # encoding both compress, and the first copy stored wins
+        data = compress(entry.body)
+        with self._lock:
+            if encoding in entry.encodings:
+                return entry.encodings[encoding]
+            entry.encodings[encoding] = data
+            entry.size += len(data)
+            if self._entries.get(entry.key) is entry:
+                self._bytes += len(data)
+                self._evict()
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return entry, byte and hit/miss counts"""
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes,
+                    "hits": self.hits, "misses": self.misses}
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry.size
@@ -0,0 +1,358 @@
+"""
+OData $search support for the Dynamics 365 Finance mock server.
+
+SearchIndex is an inverted index from the tokens of some text fields of an
+entity set (e.g. OrganizationName and NameAlias of CustomersV3) to the keys
+of the entities holding them. Text is tokenized into lowercase runs of
+letters and runs of digits, so "Contoso Retail 0042" and the alias
+"Contoso0042" both hold the tokens contoso and 0042. The index is updated on
+every write like a hash index (bulk loads are added in one pass, see
+add_all), and keeps its tokens sorted so that a prefix is resolved by
+bisecting instead of scanning.
+
+$search expressions are parsed into a small AST like $filter ones:
+
+- a word matches entities with a token starting with it: retail matches
+  "Retail" and "Retailers"; a word holding several tokens, like Contoso0042,
+  matches them in sequence, the last one as a prefix
+- a "quoted phrase" matches its words as whole tokens, in sequence
+- terms separated by spaces or AND must all match, OR matches either side,
+  NOT excludes, and parentheses group; NOT binds tighter than AND, which
+  binds tighter than OR
+"""
+
+import re
+from bisect import bisect_left, insort
+from functools import lru_cache
+from itertools import filterfalse
+
+
+class SearchError(ValueError):
+    """Raised when a $search expression cannot be parsed"""
+
+
+_WORD_RE = re.compile(r"[^\W\d_]+|\d+")
+
+_TOKEN_RE = re.compile(r'\s*(?:(?P<phrase>"[^"]*")|(?P<punct>[()])|(?P<word>[^\s()"]+))')
+
+_OPERATORS = {"AND", "OR", "NOT"}
+
+_EMPTY = frozenset()
+
+
+def tokens(text):
+    """Return the lowercase tokens of a text, in order"""
+    return _text_tokens(text) if isinstance(text, str) else ()
+
+
+# Names repeat a lot across entities (and every write re-indexes them), so
+# tokenizing each distinct text once pays off
+@lru_cache(maxsize=65536)
+def _text_tokens(text):
+    return tuple(_WORD_RE.findall(text.lower()))
+
+
+class SearchIndex:
+    """Inverted index from the tokens of text fields to entity keys"""
+
+    def __init__(self, fields):
+        self.fields = tuple(fields)
+        # token -> set of entity keys; results are ordered afterwards, so
+        # unlike hash index buckets these need no order and intersect as sets
+        self.buckets = {}
+        # Sorted tokens of buckets, for prefix lookups
+        self.tokens = []
+
+    def entity_tokens(self, entity):
+        return {token for field in self.fields for token in tokens(entity.get(field))}
+
+    def add(self, key, entity):
+        buckets = self.buckets
+        for token in self.entity_tokens(entity):
+            bucket = buckets.get(token)
+            if bucket is None:
+                bucket = buckets[token] = set()
+                insort(self.tokens, token)
+            bucket.add(key)
+
+    def add_all(self, entities):
+        """
+        Add (key, entity) pairs in bulk. Entities sharing a text, such as a
+        common name, are tokenized once for all of them, and the tokens are
+        sorted once at the end rather than inserted one by one.
+        """
+        entities = list(entities)
+        buckets = self.buckets
+        for field in self.fields:
+            groups = {}
+            for key, entity in entities:
+                text = entity.get(field)
+                group = groups.get(text)
+                if group is None:
+                    groups[text] = [key]
+                else:
+                    group.append(key)
+            # Bulk loaded texts are mostly distinct, so they skip the token cache
+            for text, keys in groups.items():
+                if not isinstance(text, str):
+                    continue
+                for token in set(_WORD_RE.findall(text.lower())):
+                    bucket = buckets.get(token)
+                    if bucket is None:
+                        buckets[token] = set(keys)
+                    else:
+                        bucket.update(keys)
+        self.load(buckets)
+
+    def remove(self, key, entity):
+        buckets = self.buckets
+        for token in self.entity_tokens(entity):
+            bucket = buckets.get(token)
+            if bucket is None:
+                continue
+            bucket.discard(key)
+            if not bucket:
+                del buckets[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+    def load(self, buckets):
+        """Replace the index with buckets read from elsewhere, e.g. a snapshot"""
+        self.buckets = buckets
+        self.tokens = sorted(buckets)
+
+    def clear(self):
+        self.buckets.clear()
+        self.tokens.clear()
+
+    def lookup(self, token):
+        return self.buckets.get(token, _EMPTY)
+
+    def prefixed(self, prefix):
+        """Return the buckets of every token starting with prefix"""
+        found = []
+        index = self.tokens
+        position = bisect_left(index, prefix)
+        while position < len(index) and index[position].startswith(prefix):
+            found.append(self.buckets[index[position]])
+            position += 1
+        return found
+
+
+def _tokenize(text):
+    parts = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        match = _TOKEN_RE.match(text, position)
+        if not match or match.end() == position:
+            raise SearchError(f"unexpected input at position {position}: {text[position:position + 20]!r}")
+        position = match.end()
+        kind = match.lastgroup
+        value = match.group(kind)
+        if kind == "phrase":
+            parts.append(("phrase", value[1:-1]))
+        elif kind == "punct":
+            parts.append((value, value))
+        elif value in _OPERATORS:
+            parts.append(("op", value))
+        else:
+            parts.append(("word", value))
+    return parts
+
+
+class _Parser:
+    """Recursive descent parser producing a tuple-based AST"""
+
+    def __init__(self, parts):
+        self.parts = parts
+        self.position = 0
+
+    def peek(self):
+        if self.position < len(self.parts):
+            return self.parts[self.position]
+        return (None, None)
+
+    def take(self):
+        part = self.peek()
+        if part[0] is None:
+            raise SearchError("unexpected end of expression")
+        self.position += 1
+        return part
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek()[0] is not None:
+            raise SearchError(f"unexpected {self.peek()[1]!r}")
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == ("op", "OR"):
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ("or", *nodes)
+
+    def parse_and(self):
+        nodes = [self.parse_not()]
+        # Terms next to each other are implicitly and-ed
+        while self.peek()[0] is not None and self.peek() not in (("op", "OR"), (")", ")")):
+            if self.peek() == ("op", "AND"):
+                self.take()
+            nodes.append(self.parse_not())
+        return nodes[0] if len(nodes) == 1 else ("and", *nodes)
+
+    def parse_not(self):
+        if self.peek() == ("op", "NOT"):
+            self.take()
+            return ("not", self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        kind, value = self.take()
+        if kind == "(":
+            node = self.parse_or()
+            if self.take()[0] != ")":
+                raise SearchError("expected ')'")
+            return node
+        if kind in ("word", "phrase"):
+            words = tuple(tokens(value))
+            if not words:
+                raise SearchError(f"{value!r} has no letters or digits to search for")
+            # ("term", tokens, whether the last token is a prefix)
+            return ("term", words, kind == "word")
+        raise SearchError(f"unexpected {value!r}")
+
+
+# Buckets read from a snapshot are not sets; they are probed through their
+# __contains__ from filter(), which still keeps the loop in C
+def _intersect(key_sets):
+    key_sets = sorted(key_sets, key=len)
+    keys = key_sets[0]
+    for other in key_sets[1:]:
+        if isinstance(keys, (set, frozenset)) and isinstance(other, (set, frozenset)):
+            keys = keys & other
+        else:
+            keys = set(filter(other.__contains__, keys))
+    return keys
+
+
+def _union(key_sets):
+    if len(key_sets) == 1:
+        return key_sets[0]
+    return set().union(*key_sets)
+
+
+def _plan(node, index):
+    """
+    Resolve a search from the index.
+
+    Returns (keys, exact) where keys is a set of candidate keys or
+    None when every entity has to be checked, and exact is True when every
+    candidate is known to match without evaluating the predicate.
+    """
+    if node[0] == "term":
+        words, prefix = node[1], node[2]
+        key_sets = [index.lookup(word) for word in words[:-1]]
+        last = index.prefixed(words[-1]) if prefix else [index.lookup(words[-1])]
+        key_sets.append(_union(last) if last else _EMPTY)
+        # Several tokens also have to be next to each other, which only the
+        # predicate can tell
+        return _intersect(key_sets), len(words) == 1
+    if node[0] == "and":
+        key_sets, excluded, exact = [], [], True
+        for child in node[1:]:
+            if child[0] == "not":
+                # Exclusions known exactly are taken out without the predicate
+                child_keys, child_exact = _plan(child[1], index)
+                if child_keys is not None and child_exact:
+                    excluded.append(child_keys)
+                else:
+                    exact = False
+                continue
+            child_keys, child_exact = _plan(child, index)
+            if child_keys is None:
+                exact = False
+            else:
+                key_sets.append(child_keys)
+                exact = exact and child_exact
+        if not key_sets:
+            return None, False
+        keys = _intersect(key_sets)
+        for other in excluded:
+            if isinstance(keys, (set, frozenset)) and isinstance(other, (set, frozenset)):
+                keys = keys - other
+            else:
+                keys = set(filterfalse(other.__contains__, keys))
+        return keys, exact
+    if node[0] == "or":
+        plans = [_plan(child, index) for child in node[1:]]
+        if any(keys is None for keys, _ in plans):
+            return None, False
+        return _union([keys for keys, _ in plans]), all(exact for _, exact in plans)
+    # A bare NOT matches nearly everything; the predicate is cheaper than a complement
+    return None, False
+
+
+def _term_pattern(words, prefix):
+    """
+    Compile a regular expression finding words in sequence in lowercase
+    text, bounded as tokens are: a run of letters or of digits, separated
+    from the next run of the same kind by other characters.
+    """
+    parts = []
+    for position, word in enumerate(words):
+        letters = not word[0].isdecimal()
+        if position == 0:
+            parts.append(r"(?<![^\W\d_])" if letters else r"(?<!\d)")
+        else:
+            same_kind = letters != words[position - 1][0].isdecimal()
+            parts.append(r"[\W_]+" if same_kind else r"[\W_]*")
+        parts.append(re.escape(word))
+    if not prefix:
+        parts.append(r"(?![^\W\d_])" if letters else r"(?!\d)")
+    return re.compile("".join(parts))
+
+
+# Compiled predicates take the lowercase texts of the searched fields of an
+# entity and match them with regular expressions, which is much cheaper than
+# tokenizing them
+def _compile(node):
+    kind = node[0]
+    if kind == "term":
+        search = _term_pattern(node[1], node[2]).search
+        return lambda texts: any(search(text) for text in texts)
+    if kind == "and":
+        children = [_compile(child) for child in node[1:]]
+        return lambda texts: all(child(texts) for child in children)
+    if kind == "or":
+        children = [_compile(child) for child in node[1:]]
+        return lambda texts: any(child(texts) for child in children)
+    child = _compile(node[1])
+    return lambda texts: not child(texts)
+
+
+class CompiledSearch:
+    """A parsed $search expression with its compiled predicate"""
+
+    def __init__(self, text):
+        self.text = text
+        self.ast = _Parser(_tokenize(text)).parse()
+        self._matches = _compile(self.ast)
+
+    def plan(self, index):
+        """Return (candidate keys or None, exact) using a SearchIndex"""
+        return _plan(self.ast, index)
+
+    def predicate(self, fields):
+        """Return a predicate matching entities whose given fields satisfy the search"""
+        matches = self._matches
+        def predicate(row):
+            values = [row.get(field) for field in fields]
+            return matches([value.lower() for value in values if isinstance(value, str)])
+        return predicate
+
+
+@lru_cache(maxsize=512)
+def compile_search(text):
+    """Parse and compile a $search expression, caching by expression text"""
+    return CompiledSearch(text)
@@ -0,0 +1,251 @@
+"""
+Synthetic data generation and bulk seeding for the Dynamics 365 Finance mock server.
+
+Generates large, deterministic data sets of customers, vendors, system users
+and exchange rates spread across several legal entities (dataAreaId). The
+same seed and profile always produce the same data, so every load-test run
+can start from a known dataset. Entities are loaded with
+EntityStore.bulk_load rather than the per-request POST handlers.
+
+The distributions come from DEFAULT_PROFILE and can be overridden by the
+"seeding.profile" section of config.json.
+"""
+
+import gc
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+
+DEFAULT_PROFILE = {
+    # Legal entities with their relative weight, currency and country
+    "companies": {
+        "USMF": {"weight": 40, "currency": "USD", "country": "US"},
+        "USSI": {"weight": 15, "currency": "USD", "country": "US"},
+        "DEMF": {"weight": 20, "currency": "EUR", "country": "DE"},
+        "GBSI": {"weight": 15, "currency": "GBP", "country": "GB"},
+        "FRRT": {"weight": 10, "currency": "EUR", "country": "FR"}
+    },
+    "customer_groups": {"10": 60, "20": 25, "30": 10, "40": 5},
+    "vendor_groups": {"10": 50, "20": 35, "30": 15},
+    "person_genders": {"Unknown": 80, "Female": 10, "Male": 10},
+    "credit_limit": {"min": 0, "max": 500000, "step": 500},
+    # Share of entities with IsActive = true
+    "active_ratio": 0.9,
+    # Exchange rate history: one rate per pair, rate type and day
+    "exchange_rates": {
+        "base_rates": {"USD": 1.0, "EUR": 1.08, "GBP": 1.27, "JPY": 0.0067, "CAD": 0.74},
+        "rate_types": ["SPOT", "AVERAGE"],
+        "start_date": "2025-01-01",
+        "volatility": 0.004
+    }
+}
+
+_NAME_PREFIXES = [
+    "Adventure", "Alpine", "Blue", "Bright", "Cedar", "Coho", "Contoso", "Crimson",
+    "Fabrikam", "Fourth", "Global", "Granite", "Harbor", "Litware", "Lucerne", "Margie's",
+    "Northwind", "Proseware", "Silver", "Southridge", "Summit", "Tailspin", "Trey", "Wide World",
+    "Wingtip", "Woodgrove"
+]
+_NAME_NOUNS = [
+    "Airlines", "Bank", "Bikes", "Coffee", "Consulting", "Electronics", "Energy", "Foods",
+    "Holdings", "Imports", "Industries", "Logistics", "Media", "Motors", "Outfitters",
+    "Pharmaceuticals", "Publishing", "Research", "Supplies", "Systems", "Textiles", "Toys",
+    "Travel", "Wines"
+]
+_NAME_SUFFIXES = ["Inc", "Ltd", "LLC", "GmbH", "SA", "Corp", "Group", "Co"]
+_FIRST_NAMES = [
+    "alex", "blake", "casey", "dana", "eli", "frankie", "gray", "harper", "indy", "jordan",
+    "kai", "logan", "morgan", "noel", "parker", "quinn", "riley", "sam", "taylor", "val"
+]
+
+
+def merge_profile(overrides=None):
+    """Return DEFAULT_PROFILE with any top-level overrides applied"""
+    profile = dict(DEFAULT_PROFILE)
+    profile.update(overrides or {})
+    return profile
+
+
+def _weighted(rng, distribution, count):
+    """Draw count values from a {value: weight} distribution"""
+    values = list(distribution)
+    weights = [distribution[value] for value in values]
+    return rng.choices(values, weights=weights, k=count)
+
+
+def _company_codes(rng, profile, count):
+    companies = profile["companies"]
+    return _weighted(rng, {code: spec["weight"] for code, spec in companies.items()}, count)
+
+
+def _names(rng, count):
+    prefixes = rng.choices(_NAME_PREFIXES, k=count)
+    nouns = rng.choices(_NAME_NOUNS, k=count)
+    suffixes = rng.choices(_NAME_SUFFIXES, k=count)
+    return [f"{prefix} {noun} {suffix}" for prefix, noun, suffix in zip(prefixes, nouns, suffixes)]
+
+
+def _active_flags(rng, profile, count):
+    ratio = profile["active_ratio"]
+    return [value < ratio for value in (rng.random() for _ in range(count))]
+
+
+def _etags(rng, count):
+    getrandbits = rng.getrandbits
+    return ['W/"%016x"' % getrandbits(64) for _ in range(count)]
+
+
+def generate_customers(count, rng, profile, start=1):
+    """Yield (key, customer) pairs for count synthetic customers"""
+    companies = profile["companies"]
+    codes = _company_codes(rng, profile, count)
+    names = _names(rng, count)
+    groups = _weighted(rng, profile["customer_groups"], count)
+    genders = _weighted(rng, profile["person_genders"], count)
+    limits = profile["credit_limit"]
+    credit_values = [float(value) for value in range(limits["min"], limits["max"] + 1, limits["step"])]
+    credit = rng.choices(credit_values, k=count)
+    active = _active_flags(rng, profile, count)
+    etags = _etags(rng, count)
+    for i in range(count):
+        code = codes[i]
+        company = companies[code]
+        account = f"C{start + i:09d}"
+        name = names[i]
+        yield f"{code}_{account}", {
+            "@odata.etag": etags[i],
+            "dataAreaId": code,
+            "CustomerAccount": account,
+            "OrganizationName": name,
+            "NameAlias": name.split(" ", 1)[0] + account[-4:],
+            "CustomerGroupId": groups[i],
+            "AddressCountryRegionId": company["country"],
+            "SalesCurrencyCode": company["currency"],
+            "PersonGender": genders[i],
+            "CreditLimit": credit[i],
+            "IsActive": active[i]
+        }
+
+
+def generate_vendors(count, rng, profile, start=1):
+    """Yield (key, vendor) pairs for count synthetic vendors"""
+    companies = profile["companies"]
+    codes = _company_codes(rng, profile, count)
+    names = _names(rng, count)
+    groups = _weighted(rng, profile["vendor_groups"], count)
+    active = _active_flags(rng, profile, count)
+    etags = _etags(rng, count)
+    for i in range(count):
+        code = codes[i]
+        company = companies[code]
+        account = f"V{start + i:09d}"
+        yield f"{code}_{account}", {
+            "@odata.etag": etags[i],
+            "dataAreaId": code,
+            "VendorAccount": account,
+            "OrganizationName": names[i],
+            "VendorGroupId": groups[i],
+            "AddressCountryRegionId": company["country"],
+            "PurchaseCurrencyCode": company["currency"],
+            "IsActive": active[i]
+        }
+
+
+def generate_system_users(count, rng, profile, start=1):
+    """Yield (key, user) pairs for count synthetic system users"""
+    first_names = rng.choices(_FIRST_NAMES, k=count)
+    active = _active_flags(rng, profile, count)
+    etags = _etags(rng, count)
+    for i in range(count):
+        user_id = f"USER{start + i:07d}"
+        user_name = f"{first_names[i]}{start + i}"
+        yield user_id, {
+            "@odata.etag": etags[i],
+            "UserId": user_id,
+            "UserName": user_name,
+            "Email": f"{user_name}@company.com",
+            "IsActive": active[i]
+        }
+
+
+def generate_exchange_rates(days, rng, profile):
+    """Return daily exchange rates for every currency pair and rate type"""
+    settings = profile["exchange_rates"]
+    base_rates = settings["base_rates"]
+    start = datetime.fromisoformat(settings["start_date"]).replace(tzinfo=timezone.utc)
+    volatility = settings["volatility"]
+    currencies = list(base_rates)
+    rates = []
+    for rate_type in settings["rate_types"]:
+        # Random walk of each currency against USD, then derive every pair
+        levels = dict(base_rates)
+        for day in range(days):
+            valid_from = (start + timedelta(days=day)).strftime("%Y-%m-%dT%H:%M:%SZ")
+            for currency in currencies:
+                if currency != "USD":
+                    levels[currency] *= 1 + rng.gauss(0, volatility)
+            for source in currencies:
+                for target in currencies:
+                    if source == target:
+                        continue
+                    rates.append({
+                        "@odata.etag": 'W/"%016x"' % rng.getrandbits(64),
+                        "FromCurrencyCode": source,
+                        "ToCurrencyCode": target,
+                        "ExchangeRateValue": round(levels[source] / levels[target], 6),
+                        "ValidFromDate": valid_from,
+                        "RateTypeId": rate_type
+                    })
+    return rates
+
+
+def seed_stores(vendors=None, customers=None, system_users=None, exchange_rates=None,
+                counts=None, seed=42, profile=None):
+    """
+    Generate and bulk load synthetic entities into the given stores.
+
+    counts maps "vendors", "customers", "system_users" and
+    "exchange_rate_days" to how many to generate. Each entity set uses its
+    own random stream derived from seed, so changing one count does not
+    change the data generated for the others. Returns a summary of how many
+    rows were loaded and how long each entity set took.
+    """
+    counts = counts or {}
+    profile = merge_profile(profile)
+    summary = {}
+    # The collector is paused for the whole seeding, not only during each
+    # bulk load: re-enabling it between entity sets would make it scan every
+    # entity loaded so far. The seeded entities live as long as the server,
+    # so they are frozen out of its scans altogether afterwards
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _seed(vendors, customers, system_users, exchange_rates, counts, seed, profile, summary)
+    finally:
+        gc.freeze()
+        if gc_enabled:
+            gc.enable()
+    return summary
+
+
+def _seed(vendors, customers, system_users, exchange_rates, counts, seed, profile, summary):
+    plans = [
+        ("vendors", vendors, generate_vendors),
+        ("customers", customers, generate_customers),
+        ("system_users", system_users, generate_system_users),
+    ]
+    for offset, (name, store, generator) in enumerate(plans):
+        count = counts.get(name, 0)
+        if store is None or count <= 0:
+            continue
+        started = time.perf_counter()
+        loaded = store.bulk_load(generator(count, random.Random(f"{seed}:{offset}"), profile))
+        summary[name] = {"rows": loaded, "seconds": round(time.perf_counter() - started, 3)}
+
+    days = counts.get("exchange_rate_days", 0)
+    if exchange_rates is not None and days > 0:
+        started = time.perf_counter()
+        rates = generate_exchange_rates(days, random.Random(f"{seed}:rates"), profile)
+        exchange_rates.extend(rates)
+        summary["exchange_rates"] = {"rows": len(rates), "seconds": round(time.perf_counter() - started, 3)}
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Production launcher for the Microsoft Dynamics 365 Finance Mock Server.
+
+mock_server.py runs Flask's single-process development server, which is
+fine for manual testing but caps load tests at a few hundred requests per
+second. This launcher, which start.sh runs by default, serves the same app
+with a production WSGI server instead:
+
+- gunicorn (default on Linux/macOS): a worker process with a pool of
+  threads and HTTP keep-alive. The app and any seeded dataset are loaded
+  before the worker is started.
+- waitress: a single multi-threaded process, available on every platform.
+
+Settings come from the "server.production" section of config.json and can
+be overridden on the command line. Seeding options are the same as for
+mock_server.py.
+
+The server runs one worker process by default. Every gunicorn worker holds
+its own copy of the in-memory stores, so with several workers a write is
+only visible to the worker that handled it, account numbers are allocated
+separately per worker (and collide), and throttling, metrics and the
+response cache are kept per worker. --workers N is only meant for read-only
+load tests against seeded data; it is refused together with a snapshot, a
+write log or traffic capture, whose files would be written by every worker.
+
+Even so, one worker serves about 1,750 simple requests per second on one
+core, far below a target of tens of thousands. This launcher removes the
+development server's overhead; it does not make the mock a high-throughput
+server.
+"""
+
+import os
+
+import mock_server
+
+
+def build_arg_parser():
+    server = mock_server.config.get("server", {})
+    production = server.get("production", {})
+    parser = mock_server.build_arg_parser("Microsoft Dynamics 365 Finance Mock Server (production mode)")
+    parser.add_argument("--server", choices=("gunicorn", "waitress"),
+                        default=production.get("server", "waitress" if os.name == "nt" else "gunicorn"),
+                        help="WSGI server to run the app with")
+    parser.add_argument("--host", default=server.get("host", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=server.get("port", 8080))
+    parser.add_argument("--workers", type=int, default=production.get("workers", 1),
+                        help="worker processes (gunicorn only); more than one splits the stores")
+    parser.add_argument("--threads", type=int, default=production.get("threads", 16),
+                        help="threads per worker process")
+    parser.add_argument("--keepalive", type=int, default=production.get("keepalive", 75),
+                        help="seconds to keep idle client connections open")
+    parser.add_argument("--backlog", type=int, default=production.get("backlog", 2048),
+                        help="maximum number of pending connections")
+    return parser
+
+
+def run_gunicorn(args):
+    from gunicorn.app.base import BaseApplication
+
+    class MockServerApplication(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{args.host}:{args.port}",
+                "workers": args.workers,
+                "threads": args.threads,
+                # gthread workers keep client connections alive between requests
+                "worker_class": "gthread",
+                "keepalive": args.keepalive,
+                "backlog": args.backlog,
+                "preload_app": True,
+                "accesslog": None,
+                "loglevel": "warning",
+            }
+            for name, value in settings.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return mock_server.app
+
+    MockServerApplication().run()
+
+
+def run_waitress(args):
+    from waitress import serve
+
+    serve(
+        mock_server.app,
+        host=args.host,
+        port=args.port,
+        threads=args.threads,
+        backlog=args.backlog,
+        channel_timeout=args.keepalive,
+        connection_limit=max(1000, args.backlog),
+        ident="d365-mock"
+    )
+
+
+def main():
+    parser = build_arg_parser()
+    args = parser.parse_args()
+    if args.server == "gunicorn" and args.workers > 1:
+        # Each worker would write the same files from its own copy of the stores
+        shared = [option for option, value in (("--snapshot", args.snapshot), ("--write-log", args.write_log),
+                                               ("--capture", args.capture)) if value]
+        if shared:
+            parser.error(f"--workers {args.workers} cannot be used with {', '.join(shared)}: every worker "
+                         f"has its own copy of the stores, use --workers 1 with more --threads")
+    elif args.workers < 1:
+        parser.error("--workers must be at least 1")
+    mock_server.prepare_data(args)
+    mock_server.print_banner(f"http://localhost:{args.port} ({args.server}, "
+                             f"{args.workers if args.server == 'gunicorn' else 1} worker(s) "
+                             f"x {args.threads} threads)")
+    if args.server == "gunicorn":
+        run_gunicorn(args)
+    else:
+        run_waitress(args)
+
+
+if __name__ == "__main__":
+    main()
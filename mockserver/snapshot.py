@@ -0,0 +1,567 @@
+"""
+Snapshot persistence and write logging for the Dynamics 365 Finance mock server.
+
+save_snapshot writes entity stores to one compact binary file. For each store
+it writes:
+
+- every entity as a marshal record, with an offset table
+- the entity keys, plus an open-addressing hash table from key to row
+- the row order of the key index and of every sorted index
+- the rows of every hash index bucket, and of every token of the $search
+  index
+
+Stores partitioned by company (partitions.py) are saved partition by
+partition in the same layout.
+
+load_snapshot memory-maps the file and points the stores at it without
+decoding anything. Entities are decoded when they are read, key lookups
+probe the on-disk hash table, and index walks read row numbers straight
+from the mapping. A multi-million row snapshot is therefore serving as soon
+as the header is parsed, and gunicorn workers share its pages. Writes go to
+in-memory overlays of rows and index entries that are merged in when read.
+
+WriteLog appends every write to a log file so that a restarted server can
+replay it on top of the snapshot and resume where it left off. Saving a new
+snapshot truncates the log.
+"""
+
+import json
+import marshal
+import mmap
+import os
+import struct
+import zlib
+from array import array
+import heapq
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import MutableMapping
+
+from store import _scan, _sort_key, _tally
+
+
+MAGIC = b"D365SNP1"
+_EMPTY = 0xFFFFFFFF
+_LENGTH = struct.Struct("<Q")
+_RECORD = struct.Struct("<I")
+
+
+class SnapshotError(ValueError):
+    """Raised when a snapshot file cannot be read"""
+
+
+class _SnapshotRows:
+    """Mapping of entity key to entity, read from a snapshot with an overlay for writes"""
+
+    def __init__(self, data, sections):
+        self._data = data
+        self._keys_blob, self._key_offsets = sections["keys"], sections["key_offsets"]
+        self._records, self._record_offsets = sections["records"], sections["record_offsets"]
+        self._table = sections["key_table"]
+        self._mask = len(self._table) - 1
+        self._base_count = len(self._key_offsets) - 1
+        # Entities written since loading, and snapshot keys deleted or overwritten
+        self.overlay = {}
+        self.removed = set()
+
+    def key(self, row):
+        return str(self._keys_blob[self._key_offsets[row]:self._key_offsets[row + 1]], "utf-8")
+
+    def record(self, row):
+        return marshal.loads(self._records[self._record_offsets[row]:self._record_offsets[row + 1]])
+
+    def row_of(self, key):
+        """Return the snapshot row of key, or None if the snapshot does not hold it"""
+        if not isinstance(key, str) or not self._base_count:
+            return None
+        encoded = key.encode("utf-8")
+        slot = zlib.crc32(encoded) & self._mask
+        table, offsets, blob = self._table, self._key_offsets, self._keys_blob
+        while True:
+            row = table[slot]
+            if row == _EMPTY:
+                return None
+            if blob[offsets[row]:offsets[row + 1]] == encoded:
+                return row
+            slot = (slot + 1) & self._mask
+
+    def get(self, key, default=None):
+        entity = self.overlay.get(key)
+        if entity is not None:
+            return entity
+        if key in self.removed:
+            return default
+        row = self.row_of(key)
+        return default if row is None else self.record(row)
+
+    def __getitem__(self, key):
+        entity = self.get(key)
+        if entity is None:
+            raise KeyError(key)
+        return entity
+
+    def __contains__(self, key):
+        if key in self.overlay:
+            return True
+        return key not in self.removed and self.row_of(key) is not None
+
+    def __len__(self):
+        return self._base_count - len(self.removed) + len(self.overlay)
+
+    def __setitem__(self, key, entity):
+        if key not in self.overlay and key not in self.removed and self.row_of(key) is not None:
+            self.removed.add(key)
+        self.overlay[key] = entity
+
+    def pop(self, key, *default):
+        if key in self.overlay:
+            return self.overlay.pop(key)
+        if key not in self.removed:
+            row = self.row_of(key)
+            if row is not None:
+                self.removed.add(key)
+                return self.record(row)
+        if default:
+            return default[0]
+        raise KeyError(key)
+
+    def keys(self):
+        removed = self.removed
+        for row in range(self._base_count):
+            key = self.key(row)
+            if key not in removed:
+                yield key
+        yield from list(self.overlay)
+
+    __iter__ = keys
+
+    def items(self):
+        removed = self.removed
+        for row in range(self._base_count):
+            key = self.key(row)
+            if key not in removed:
+                yield key, self.record(row)
+        yield from list(self.overlay.items())
+
+    def values(self):
+        return (entity for _, entity in self.items())
+
+    def clear(self):
+        self._base_count = 0
+        self.overlay.clear()
+        self.removed.clear()
+
+
+class _OrderEntries:
+    """Read-only sequence of index entries decoded from a row order array"""
+
+    def __init__(self, order, entry):
+        self.order = order
+        self.entry = entry
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, position):
+        return self.entry(self.order[position])
+
+
+class _SnapshotIndex:
+    """
+    Sorted index read from a snapshot, with in-memory changes kept aside.
+
+    Entries added since loading are kept in a sorted list and removed
+    snapshot entries in a set; walks merge the two, so a write costs a few
+    bisections instead of building the whole index in memory.
+    """
+
+    def __init__(self, order, entry):
+        self._base = _OrderEntries(order, entry)
+        self._added = []
+        self._dropped = set()
+
+    def __len__(self):
+        return len(self._base) - len(self._dropped) + len(self._added)
+
+    def __iter__(self):
+        return self.entries()
+
+    def _in_base(self, entry):
+        position = bisect_left(self._base, entry)
+        return position < len(self._base) and self._base[position] == entry
+
+    def add(self, entry):
+        if entry in self._dropped:
+            self._dropped.discard(entry)
+        else:
+            insort(self._added, entry)
+
+    def discard(self, entry):
+        added = self._added
+        position = bisect_left(added, entry)
+        if position < len(added) and added[position] == entry:
+            del added[position]
+        elif self._in_base(entry):
+            self._dropped.add(entry)
+
+    def entries(self, bound=None, descending=False, after_bound=False):
+        """Yield entries in order from bound, as store._iter_entries does for lists"""
+        base, added = self._base, self._added
+        if descending:
+            end = len(base) if bound is None else bisect_left(base, bound)
+            base_positions = range(end - 1, -1, -1)
+            end = len(added) if bound is None else bisect_left(added, bound)
+            added_positions = range(end - 1, -1, -1)
+        else:
+            find = bisect_right if after_bound else bisect_left
+            start = 0 if bound is None else find(base, bound)
+            base_positions = range(start, len(base))
+            start = 0 if bound is None else find(added, bound)
+            added_positions = range(start, len(added))
+        dropped = self._dropped
+        from_base = (entry for entry in map(base.__getitem__, base_positions) if entry not in dropped)
+        return heapq.merge(from_base, _scan(added, added_positions), reverse=descending)
+
+    def clear(self):
+        self._base = _OrderEntries((), None)
+        self._added.clear()
+        self._dropped.clear()
+
+
+class _SnapshotBucket(MutableMapping):
+    """Hash index bucket of snapshot rows, with in-memory changes kept aside"""
+
+    def __init__(self, rows, members):
+        self._rows = rows
+        self._members = members
+        self._added = {}
+        self._dropped = set()
+
+    def _in_base(self, key):
+        row = self._rows.row_of(key)
+        if row is None:
+            return False
+        position = bisect_left(self._members, row)
+        return position < len(self._members) and self._members[position] == row
+
+    def __contains__(self, key):
+        if key in self._added:
+            return True
+        return key not in self._dropped and self._in_base(key)
+
+    def __getitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        return None
+
+    def __len__(self):
+        return len(self._members) - len(self._dropped) + len(self._added)
+
+    def __iter__(self):
+        dropped = self._dropped
+        for row in self._members:
+            key = self._rows.key(row)
+            if key not in dropped:
+                yield key
+        yield from list(self._added)
+
+    def __setitem__(self, key, value):
+        if key in self._dropped:
+            self._dropped.discard(key)
+        elif not self._in_base(key):
+            self._added[key] = None
+
+    def __delitem__(self, key):
+        if key in self._added:
+            del self._added[key]
+        elif key not in self._dropped and self._in_base(key):
+            self._dropped.add(key)
+        else:
+            raise KeyError(key)
+
+
+class _SnapshotTokenBucket(_SnapshotBucket):
+    """Token bucket of a $search index, with the set methods the index writes through"""
+
+    def add(self, key):
+        self[key] = None
+
+    def discard(self, key):
+        self.pop(key, None)
+
+    def update(self, keys):
+        for key in keys:
+            self[key] = None
+
+
+def _store_sections(store):
+    """Serialize one store into its snapshot sections"""
+    rows = list(store.items())
+    row_of = {key: row for row, (key, _) in enumerate(rows)}
+
+    keys_blob = bytearray()
+    key_offsets = array("Q", [0])
+    records = bytearray()
+    record_offsets = array("Q", [0])
+    for key, entity in rows:
+        if not isinstance(key, str):
+            raise SnapshotError(f"{store.name}: only string entity keys can be snapshotted")
+        keys_blob += key.encode("utf-8")
+        key_offsets.append(len(keys_blob))
+        records += marshal.dumps(dict(store.materialize(entity)))
+        record_offsets.append(len(records))
+
+    # Open-addressing hash table from key to row, at most half full
+    size = 1
+    while size < 2 * len(rows):
+        size *= 2
+    table = array("I", [_EMPTY]) * size
+    mask = size - 1
+    for key, row in row_of.items():
+        slot = zlib.crc32(key.encode("utf-8")) & mask
+        while table[slot] != _EMPTY:
+            slot = (slot + 1) & mask
+        table[slot] = row
+
+    sections = {
+        "keys": bytes(keys_blob),
+        "key_offsets": key_offsets.tobytes(),
+        "records": bytes(records),
+        "record_offsets": record_offsets.tobytes(),
+        "key_table": table.tobytes(),
+        "key_order": array("I", (row_of[key] for key in store._key_index)).tobytes(),
+    }
+    for field, index in store._sorted_indexes.items():
+        sections[f"sorted:{field}"] = array("I", (row_of[key] for _, key in index)).tobytes()
+    buckets = {}
+    for field, index in store._hash_indexes.items():
+        members = array("I")
+        spans = []
+        for value, keys in index.items():
+            spans.append((value, len(members), len(keys)))
+            members.extend(sorted(row_of[key] for key in keys))
+        sections[f"hash:{field}"] = members.tobytes()
+        buckets[field] = spans
+    sections["buckets"] = marshal.dumps(buckets)
+    sections["counters"] = marshal.dumps([(fields, list(counter.items()))
+                                          for fields, counter in store._counters.items()])
+    search_index = store._current_search_index()
+    if search_index is not None:
+        members = array("I")
+        spans = []
+        for token, keys in search_index.buckets.items():
+            spans.append((token, len(members), len(keys)))
+            members.extend(sorted(row_of[key] for key in keys))
+        sections["search"] = members.tobytes()
+        sections["search_buckets"] = marshal.dumps((search_index.fields, spans))
+    return sections
+
+
+def save_snapshot(path, stores, lists=None, meta=None):
+    """
+    Write entity stores and plain lists of entities to path.
+
+    stores maps names to EntityStores and lists maps names to lists of
+    dicts, or to containers of them with clear() and extend(). Each store is serialized while holding its lock. The file is
+    written under a temporary name and renamed into place, so a server
+    still reading the previous snapshot is unaffected.
+    """
+    header = {"meta": meta or {}, "stores": {}, "lists": {}}
+    chunks = []
+    offset = 0
+
+    def add(data):
+        nonlocal offset
+        # Keep sections 8-byte aligned so they can be cast to integer arrays
+        padding = -offset % 8
+        if padding:
+            chunks.append(b"\0" * padding)
+            offset += padding
+        chunks.append(data)
+        start = offset
+        offset += len(data)
+        return [start, len(data)]
+
+    for name, store in stores.items():
+        with store.lock:
+            saved = header["stores"][name] = {"version": store.version}
+            partitions = getattr(store, "partitions", None)
+            if partitions is None:
+                saved["sections"] = {section: add(data) for section, data in _store_sections(store).items()}
+            else:
+                # Company-partitioned stores save each partition as its own store
+                saved["partitions"] = {
+                    value: {section: add(data) for section, data in _store_sections(partition).items()}
+                    for value, partition in partitions.items()
+                }
+    for name, values in (lists or {}).items():
+        header["lists"][name] = add(marshal.dumps(list(values)))
+
+    encoded = json.dumps(header).encode("utf-8")
+    base = len(MAGIC) + _LENGTH.size + len(encoded)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as snapshot:
+        snapshot.write(MAGIC)
+        snapshot.write(_LENGTH.pack(len(encoded)))
+        snapshot.write(encoded)
+        # Section offsets in the header are relative to the end of the header
+        snapshot.write(b"\0" * (-base % 8))
+        for chunk in chunks:
+            snapshot.write(chunk)
+        snapshot.flush()
+        os.fsync(snapshot.fileno())
+    os.replace(temporary, path)
+
+
+def load_snapshot(path, stores, lists=None):
+    """
+    Point stores at the snapshot in path and fill lists from it.
+
+    Stores and lists are matched by name; names missing from the snapshot
+    are left untouched. Returns the meta dict saved with the snapshot.
+    """
+    with open(path, "rb") as snapshot:
+        if snapshot.read(len(MAGIC)) != MAGIC:
+            raise SnapshotError(f"{path} is not a mock server snapshot")
+        data = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+    (length,) = _LENGTH.unpack_from(data, len(MAGIC))
+    start = len(MAGIC) + _LENGTH.size
+    try:
+        header = json.loads(data[start:start + length])
+    except ValueError as e:
+        raise SnapshotError(f"{path} has a corrupt header: {e}") from e
+    base = start + length
+    base += -base % 8
+    view = memoryview(data)
+
+    def section(span, typecode=None):
+        chunk = view[base + span[0]:base + span[0] + span[1]]
+        return chunk.cast(typecode) if typecode else chunk
+
+    for name, saved in header["stores"].items():
+        store = stores.get(name)
+        if store is None:
+            continue
+        with store.lock:
+            if "partitions" in saved:
+                store.clear()
+                for value, spans in saved["partitions"].items():
+                    _attach(store.partition(value), data, spans, section)
+            else:
+                _attach(store, data, saved["sections"], section)
+            store.version = saved["version"] + 1
+            store._reset_changes()
+    for name, span in header["lists"].items():
+        if lists is not None and name in lists:
+            # Cleared and extended rather than replaced, so a store standing
+            # in for a list (an ExchangeRateStore) is refilled as well
+            lists[name].clear()
+            lists[name].extend(marshal.loads(section(span)))
+    return header["meta"]
+
+
+def _attach(store, data, spans, section):
+    rows = _SnapshotRows(data, {
+        "keys": section(spans["keys"]),
+        "key_offsets": section(spans["key_offsets"], "Q"),
+        "records": section(spans["records"]),
+        "record_offsets": section(spans["record_offsets"], "Q"),
+        "key_table": section(spans["key_table"], "I"),
+    })
+    def key_entry(row):
+        return rows.key(row)
+
+    def sorted_entry(field):
+        return lambda row: (_sort_key(rows.record(row).get(field)), rows.key(row))
+
+    store._rows = rows
+    store._key_index = _SnapshotIndex(section(spans["key_order"], "I"), key_entry)
+    for field in list(store._sorted_indexes):
+        span = spans.get(f"sorted:{field}")
+        if span is None:
+            continue
+        store._sorted_indexes[field] = _SnapshotIndex(section(span, "I"), sorted_entry(field))
+    buckets = marshal.loads(section(spans["buckets"]))
+    for field in list(store._hash_indexes):
+        members = section(spans[f"hash:{field}"], "I") if f"hash:{field}" in spans else None
+        store._hash_indexes[field] = {
+            value: _SnapshotBucket(rows, members[start:start + count])
+            for value, start, count in buckets.get(field, [])
+        }
+    saved = dict(marshal.loads(section(spans["counters"]))) if "counters" in spans else {}
+    for fields in list(store._counters):
+        if fields in saved:
+            store._counters[fields] = dict(saved[fields])
+        else:
+            # Counters added since the snapshot was taken are counted afresh
+            counter = store._counters[fields] = {}
+            for entity in rows.values():
+                _tally({fields: counter}, entity, 1)
+    search_index = store._search_index
+    store._search_pending = []
+    if search_index is not None:
+        saved = marshal.loads(section(spans["search_buckets"])) if "search_buckets" in spans else None
+        if saved is not None and tuple(saved[0]) == search_index.fields:
+            members = section(spans["search"], "I")
+            search_index.load({token: _SnapshotTokenBucket(rows, members[start:start + count])
+                               for token, start, count in saved[1]})
+        else:
+            # Fields searched since the snapshot was taken are indexed afresh,
+            # on the first search
+            search_index.load({})
+            store._search_pending = list(rows)
+
+
+class WriteLog:
+    """Append-only log of entity writes, replayed on top of a snapshot"""
+
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self._file = open(path, "ab")
+
+    def record(self, store_name, key, entity):
+        """Append one write; entity is None for a delete"""
+        payload = marshal.dumps((store_name, key, None if entity is None else dict(entity)))
+        self._file.write(_RECORD.pack(len(payload)) + payload)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def truncate(self):
+        self._file.truncate(0)
+        self._file.seek(0)
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+    @staticmethod
+    def read(path):
+        """Yield (store name, key, entity or None) records, stopping at a torn tail"""
+        if not os.path.exists(path):
+            return
+        with open(path, "rb") as log:
+            while True:
+                prefix = log.read(_RECORD.size)
+                if len(prefix) < _RECORD.size:
+                    return
+                (length,) = _RECORD.unpack(prefix)
+                payload = log.read(length)
+                if len(payload) < length:
+                    return
+                yield marshal.loads(payload)
+
+    @staticmethod
+    def replay(path, stores, on_entity=None):
+        """Apply the writes logged in path to stores, returning how many were applied"""
+        applied = 0
+        for store_name, key, entity in WriteLog.read(path):
+            store = stores.get(store_name)
+            if store is None:
+                continue
+            with store.lock:
+                store._restore(key, entity)
+                if entity is not None and on_entity is not None:
+                    on_entity(entity)
+            applied += 1
+        return applied
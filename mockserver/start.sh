@@ -14,6 +14,7 @@ SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 VENV_DIR="$SCRIPT_DIR/venv"
 REQUIREMENTS_FILE="$SCRIPT_DIR/requirements.txt"
 SERVER_SCRIPT="$SCRIPT_DIR/mock_server.py"
+PRODUCTION_SCRIPT="$SCRIPT_DIR/serve.py"
 TEST_SCRIPT="$SCRIPT_DIR/test_server.py"
 
 echo -e "${BLUE}Microsoft Dynamics 365 Finance Mock Server${NC}"
@@ -74,14 +75,24 @@ install_dependencies() {
     fi
 }
 
-# Function to start the server
+# Function to start the server with a production WSGI server
 start_server() {
     echo -e "${YELLOW}Starting mock server...${NC}"
-    echo -e "${BLUE}Server will be available at: http://localhost:5000${NC}"
+    echo -e "${BLUE}Server will be available at: http://localhost:8080${NC}"
     echo -e "${BLUE}Press Ctrl+C to stop the server${NC}"
     echo ""
     
-    python "$SERVER_SCRIPT"
+    python "$PRODUCTION_SCRIPT" "$@"
+}
+
+# Function to start the server with Flask's development server
+start_dev_server() {
+    echo -e "${YELLOW}Starting mock server with the Flask development server...${NC}"
+    echo -e "${BLUE}Server will be available at: http://localhost:8080${NC}"
+    echo -e "${BLUE}Press Ctrl+C to stop the server${NC}"
+    echo ""
+    
+    python "$SERVER_SCRIPT" "$@"
 }
 
 # Function to run tests
@@ -95,7 +106,10 @@ show_usage() {
     echo "Usage: $0 [OPTION]"
     echo ""
     echo "Options:"
-    echo "  start     Start the mock server (default)"
+    echo "  start     Start the mock server with a production WSGI server (gunicorn/waitress, default);"
+    echo "            extra options are passed to serve.py"
+    echo "  serve     Same as start"
+    echo "  dev       Start the server with Flask's development server; add --debug for the debugger"
     echo "  test      Run the test suite"
     echo "  setup     Set up the environment only"
     echo "  help      Show this help message"
@@ -103,6 +117,9 @@ show_usage() {
     echo "Examples:"
     echo "  $0                # Start the server"
     echo "  $0 start          # Start the server"
+    echo "  $0 start --customers 1000000 --vendors 100000   # Start with a seeded dataset"
+    echo "  $0 start --threads 32   # More threads for load tests"
+    echo "  $0 dev --debug    # Development server with the debugger and reloader"
     echo "  $0 test           # Run tests"
     echo "  $0 setup          # Set up environment"
 }
@@ -142,7 +159,20 @@ main() {
             run_tests
             exit $?
             ;;
-        "start")
+        "start"|"serve")
+            if ! check_python; then
+                exit 1
+            fi
+            if ! setup_venv; then
+                exit 1
+            fi
+            if ! install_dependencies; then
+                exit 1
+            fi
+            shift
+            start_server "$@"
+            ;;
+        "dev")
             if ! check_python; then
                 exit 1
             fi
@@ -152,7 +182,8 @@ main() {
             if ! install_dependencies; then
                 exit 1
             fi
-            start_server
+            shift
+            start_dev_server "$@"
             ;;
         *)
             echo -e "${RED}Unknown command: $command${NC}"
@@ -0,0 +1,950 @@
+"""
+In-memory entity stores for the Dynamics 365 Finance mock server.
+
+Each entity set is held in an EntityStore, a dict-like container that keeps
+secondary hash indexes and sorted indexes on selected fields up to date on
+every write. Equality filters are answered without scanning the whole set,
+and $orderby on a sorted field walks the index instead of sorting.
+
+Query results have a total order (the $orderby fields followed by the entity
+key), so a page can be resumed from the position of its last row. That
+position is what the opaque $skiptoken cursor carries.
+
+Every store has its own lock. Writes, atomic read-modify-write updates and
+the planning and materializing steps of a query hold it; the lazy part of a
+query result walks index lists by position and tolerates concurrent writes,
+so a long streamed response never blocks writers.
+
+Counts are maintained as aggregates too: a filter that only tests fields
+for equality is counted from hash index bucket sizes, or from a counter of
+a configured field combination, in time independent of the store size.
+
+Every write is also appended to the store's change log, ordered by store
+version, so the entities changed since a given version can be listed without
+scanning the set. This backs OData delta queries ($deltatoken).
+"""
+
+import base64
+import gc
+import heapq
+import itertools
+import json
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from itertools import dropwhile, groupby, islice, product, repeat
+from operator import itemgetter
+
+from search import SearchIndex
+
+
+class _Max:
+    """Sentinel that compares greater than any entity key"""
+
+    def __lt__(self, other):
+        return False
+
+    def __gt__(self, other):
+        return True
+
+
+_MAX = _Max()
+
+# Bisecting an entry into a large index costs about as much as re-sorting
+# four of its entries (see _merge_index)
+_MERGE_RATIO = 4
+
+
+def _sort_key(value):
+    """Order values of mixed types consistently, with nulls first"""
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (1, value)
+    if isinstance(value, (int, float)):
+        return (2, value)
+    if isinstance(value, str):
+        return (3, value)
+    return (4, str(value))
+
+
+def _scan(index, positions):
+    """Yield index entries by position, stopping early if writers shrink the list"""
+    for position in positions:
+        try:
+            yield index[position]
+        except IndexError:
+            return
+
+
+def _insert_entry(index, entry):
+    """Add an entry to a sorted index"""
+    if isinstance(index, list):
+        insort(index, entry)
+    else:
+        index.add(entry)
+
+
+def _remove_entry(index, entry):
+    """Remove an entry from a sorted index, if present"""
+    if isinstance(index, list):
+        position = bisect_left(index, entry)
+        if position < len(index) and index[position] == entry:
+            del index[position]
+    else:
+        index.discard(entry)
+
+
+def _iter_entries(index, bound=None, descending=False, after_bound=False):
+    """
+    Yield the entries of a sorted index in order, starting at bound.
+
+    Ascending, iteration starts at the first entry >= bound (> bound when
+    after_bound); descending, at the last entry < bound. Lists are read by
+    position so concurrent writers can only shift entries near the start.
+    Other index types (see snapshot.py) provide their own entries() method.
+    """
+    if not isinstance(index, list):
+        return index.entries(bound, descending, after_bound)
+    if descending:
+        end = len(index) if bound is None else bisect_left(index, bound)
+        return _scan(index, range(end - 1, -1, -1))
+    if bound is None:
+        start = 0
+    else:
+        start = bisect_right(index, bound) if after_bound else bisect_left(index, bound)
+    return _scan(index, range(start, len(index)))
+
+
+def _sort_index(index):
+    """
+    Sort a list of (sort key, entity key) index entries in place.
+
+    Comparing nested tuples is slow, so when every entry holds a string or
+    every entry holds a number the list is sorted twice instead, by entity
+    key and then stably by value, which orders it like (value, key) while
+    Python compares plain strs or floats with its specialized fast paths.
+    Entries mostly arrive in key order, which makes the first sort a single
+    pass.
+    """
+    ranks = set(map(_FIRST, map(_FIRST, index)))
+    if ranks == {3} or ranks == {2}:
+        index.sort(key=_SECOND)
+        decorated = list(zip(map(_SECOND, map(_FIRST, index)), index))
+        decorated.sort(key=_FIRST)
+        index[:] = map(_SECOND, decorated)
+    else:
+        index.sort()
+
+
+_FIRST = itemgetter(0)
+_SECOND = itemgetter(1)
+
+
+def _sort_keys(values):
+    """Return the _sort_key of each of values, without a call per value when they share a type"""
+    types = set(map(type, values))
+    if len(types) == 1:
+        rank = {str: 3, float: 2, int: 2, bool: 1}.get(types.pop())
+        if rank is not None:
+            return zip(repeat(rank), values)
+    elif types == {int, float}:
+        return zip(repeat(2), values)
+    return map(_sort_key, values)
+
+
+def _merge_index(index, additions):
+    """
+    Add index entries to a sorted index in place, keeping it sorted.
+
+    Re-sorting walks every entry of the index, which dominates when a few
+    thousand entries are added to one of millions, so small additions are
+    sorted on their own and each is bisected into place instead.
+    """
+    if len(additions) * _MERGE_RATIO < len(index):
+        _sort_index(additions)
+        merged = []
+        start = 0
+        for entry in additions:
+            end = bisect_right(index, entry, start)
+            merged += index[start:end]
+            merged.append(entry)
+            start = end
+        merged += index[start:]
+        index[:] = merged
+    else:
+        index.extend(additions)
+        _sort_index(index)
+
+
+def _tally(counters, entity, delta):
+    """Add delta to the counter of entity's value combination in each counter"""
+    for fields, counter in counters.items():
+        combination = tuple(entity.get(field) for field in fields)
+        try:
+            total = counter.get(combination, 0) + delta
+        except TypeError:
+            continue
+        if total:
+            counter[combination] = total
+        else:
+            del counter[combination]
+
+
+def _tally_column(counter, fields, columns, entities):
+    """Count entities into the counter of fields, given the column of values of each field"""
+    try:
+        counts = Counter(zip(*columns))
+    except TypeError:
+        # Unhashable values are left out, as _tally does
+        for entity in entities:
+            _tally({fields: counter}, entity, 1)
+        return
+    for combination, count in counts.items():
+        counter[combination] = counter.get(combination, 0) + count
+
+
+def _sort_entries(entries, orderby, tie_descending=None):
+    """
+    Sort (key, row) pairs by several (field, descending) keys using stable
+    passes. Ties are broken by entity key in the direction of the first key,
+    matching the order produced by walking a sorted index.
+    """
+    if tie_descending is None:
+        tie_descending = bool(orderby) and orderby[0][1]
+    entries = sorted(entries, key=itemgetter(0), reverse=tie_descending)
+    for field, descending in reversed(orderby):
+        entries.sort(key=lambda entry: _sort_key(entry[1].get(field)), reverse=descending)
+    return entries
+
+
+def _position(key, row, orderby):
+    """Return the position of a row in the total order of a query"""
+    return tuple(_sort_key(row.get(field)) for field, _ in orderby) + (key,)
+
+
+class _Ordered:
+    """Merge key comparing query positions in the directions of an $orderby"""
+
+    __slots__ = ("position", "orderby")
+
+    def __init__(self, position, orderby):
+        self.position = position
+        self.orderby = orderby
+
+    def __lt__(self, other):
+        return _is_after(other.position, self.position, self.orderby)
+
+
+def merge_ordered(iterables, orderby):
+    """Lazily merge (key, row) iterables that are each in the result order of orderby"""
+    if len({descending for _, descending in orderby}) <= 1:
+        # One direction throughout: positions compare as plain tuples
+        descending = bool(orderby) and orderby[0][1]
+        return heapq.merge(*iterables, key=lambda entry: _position(entry[0], entry[1], orderby),
+                           reverse=descending)
+    return heapq.merge(*iterables, key=lambda entry: _Ordered(_position(entry[0], entry[1], orderby), orderby))
+
+
+def _is_after(position, cursor, orderby):
+    """Return True when position comes strictly after cursor in result order"""
+    directions = [descending for _, descending in orderby]
+    directions.append(orderby[0][1] if orderby else False)
+    for value, bound, descending in zip(position, cursor, directions):
+        if value != bound:
+            return value < bound if descending else value > bound
+    return False
+
+
+def encode_cursor(key, row, orderby, version=None):
+    """
+    Encode the position of the last row of a page as an opaque token.
+
+    version optionally records the store version the first page was read at,
+    so the last page can hand out a delta link covering the whole read.
+    """
+    payload = {"o": [list(clause) for clause in orderby], "p": _position(key, row, orderby)}
+    if version is not None:
+        payload["v"] = version
+    text = json.dumps(payload, separators=(",", ":"))
+    return base64.urlsafe_b64encode(text.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token, orderby):
+    """Decode a $skiptoken produced by encode_cursor into (position, version)"""
+    try:
+        text = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        payload = json.loads(text)
+        position = payload["p"]
+        if [tuple(clause) for clause in payload["o"]] != list(orderby):
+            raise ValueError("token was issued for a different $orderby")
+        if len(position) != len(orderby) + 1 or not isinstance(position[-1], str):
+            raise ValueError("malformed position")
+        version = payload.get("v")
+        if version is not None and not isinstance(version, int):
+            raise ValueError("malformed version")
+        return tuple(tuple(value) for value in position[:-1]) + (position[-1],), version
+    except (ValueError, KeyError, TypeError) as e:
+        raise ValueError(f"invalid $skiptoken: {e}") from e
+
+
+_transaction = threading.local()
+
+# A transaction holds the lock of every store it writes to until it ends, in
+# no fixed order, so transactions run one at a time. Code taking the locks of
+# several stores takes this lock first
+transactions_lock = threading.Lock()
+
+
+class Transaction:
+    """
+    Record every store write made by the current thread so it can be undone.
+
+    Used as a context manager around an atomic group of writes; calling
+    rollback() restores each touched entity to its state before the first
+    write, across all entity stores. A store written to stays locked until
+    the transaction ends, so no other thread writes entities the rollback
+    would then overwrite.
+    """
+
+    def __init__(self):
+        self.journal = []
+        self._locked = []
+
+    def __enter__(self):
+        if getattr(_transaction, "active", None) is not None:
+            raise RuntimeError("transactions cannot be nested")
+        transactions_lock.acquire()
+        _transaction.active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        _transaction.active = None
+        for store in reversed(self._locked):
+            store.lock.release()
+        self._locked.clear()
+        transactions_lock.release()
+        return False
+
+    def record(self, store, key, old):
+        """Journal the state of key before a write, locking store until the end"""
+        if store not in self._locked:
+            store.lock.acquire()
+            self._locked.append(store)
+        self.journal.append((store, key, old))
+
+    def rollback(self):
+        for store, key, old in reversed(self.journal):
+            with store.lock:
+                store._restore(key, old)
+        self.journal.clear()
+
+
+def _active_transaction():
+    return getattr(_transaction, "active", None)
+
+
+class EntityStore:
+    """
+    Dict-like entity set with maintained secondary hash and sorted indexes.
+
+    counted_fields lists field combinations, as tuples, whose entities are
+    counted per combination of values, so a filter testing exactly those
+    fields for equality is counted without reading any keys.
+    searched_fields lists the text fields $search looks in, through an
+    inverted index of their tokens (see search.py).
+    """
+
+    def __init__(self, name, indexed_fields=(), sorted_fields=(), counted_fields=(), searched_fields=()):
+        self.name = name
+        self.lock = threading.RLock()
+        self._sequence = itertools.count(1)
+        # Bumped on every write, so cached collection responses can be revalidated
+        self.version = 0
+        # Optional snapshot.WriteLog that every write is appended to
+        self.write_log = None
+        # Change log entries kept for delta queries (None keeps all, 0 disables)
+        self.max_changes = None
+        self._reset_changes()
+        self._rows = {}
+        # Sorted entity keys, giving a stable default order to resume from
+        self._key_index = []
+        # field -> value -> ordered set (dict) of entity keys
+        self._hash_indexes = {field: {} for field in indexed_fields}
+        # field -> sorted list of (sort key, entity key)
+        self._sorted_indexes = {field: [] for field in sorted_fields}
+        # field combination -> value combination -> number of entities
+        self._counters = {tuple(fields): {} for fields in counted_fields}
+        self._search_index = SearchIndex(searched_fields) if searched_fields else None
+        # Keys bulk loaded since the search index was last brought up to date
+        self._search_pending = []
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __iter__(self):
+        return iter(self._rows)
+
+    def __getitem__(self, key):
+        return self._rows[key]
+
+    def __setitem__(self, key, entity):
+        with self.lock:
+            self._journal(key)
+            self._store(key, entity)
+
+    def __delitem__(self, key):
+        with self.lock:
+            self._journal(key)
+            self._delete(key)
+
+    def insert(self, key, entity):
+        """Store a new entity, returning False without writing if the key exists"""
+        with self.lock:
+            if key in self._rows:
+                return False
+            self[key] = entity
+            return True
+
+    def update(self, key, modify):
+        """
+        Atomically read, modify and write back an entity.
+
+        modify receives a dict copy of the current entity and changes it in
+        place; it may raise to abort the update. Returns the stored entity,
+        or None if the key does not exist.
+        """
+        with self.lock:
+            current = self._rows.get(key)
+            if current is None:
+                return None
+            entity = dict(current)
+            modify(entity)
+            self[key] = entity
+            return entity
+
+    def next_sequence(self):
+        """Allocate the next number of this store's sequence, unique across threads"""
+        with self.lock:
+            return next(self._sequence)
+
+    def _journal(self, key):
+        transaction = _active_transaction()
+        if transaction is not None:
+            old = self._rows.get(key)
+            transaction.record(self, key, None if old is None else self.materialize(old))
+
+    def _restore(self, key, old):
+        # Undoes a journaled write, old being None for an entity that did not exist
+        if old is None:
+            if key in self._rows:
+                self._delete(key)
+        else:
+            self._store(key, old)
+
+    def _store(self, key, entity):
+        old = self._rows.get(key)
+        if old is not None:
+            self._unindex(key, old)
+        else:
+            _insert_entry(self._key_index, key)
+        self._rows[key] = entity
+        self._index(key, entity)
+        self.version += 1
+        self._log_change(key)
+        if self.write_log is not None:
+            self.write_log.record(self.name, key, self.materialize(entity))
+
+    def _delete(self, key):
+        entity = self._rows.pop(key)
+        self._unindex(key, entity)
+        _remove_entry(self._key_index, key)
+        self.version += 1
+        self._log_change(key)
+        if self.write_log is not None:
+            self.write_log.record(self.name, key, None)
+
+    def get(self, key, default=None):
+        return self._rows.get(key, default)
+
+    def bulk_load(self, entries, log_changes=False):
+        """
+        Insert many (key, entity) pairs at once.
+
+        Hash indexes are updated as rows arrive, but the key index and sorted
+        indexes are appended to and sorted once at the end instead of being
+        bisected per row. The cyclic garbage collector is paused meanwhile, as
+        its repeated scans of millions of new dicts would otherwise dominate
+        the load time. Returns the number of entities loaded.
+
+        The change log is reset, so delta links issued before the load
+        expire, unless log_changes is set: then every entity is logged as a
+        write of its own, which keys must be unique for.
+        """
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with self.lock:
+                return self._bulk_load(entries, log_changes)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _bulk_load(self, entries, log_changes=False):
+        # Indexes read from a snapshot are copied into lists before appending
+        if not isinstance(self._key_index, list):
+            self._key_index = list(self._key_index)
+        for field, index in self._sorted_indexes.items():
+            if not isinstance(index, list):
+                self._sorted_indexes[field] = list(index)
+        entries = entries if isinstance(entries, list) else list(entries)
+        # The last entity of a key wins, as if they had been written in turn
+        batch = dict(entries)
+        keys = list(batch)
+        entities = list(batch.values())
+        rows = self._rows
+        replaced = batch.keys() & rows.keys() if len(rows) else ()
+        for key in replaced:
+            self._unindex(key, rows[key])
+        if isinstance(rows, dict):
+            rows.update(batch)
+        else:
+            for key, entity in batch.items():
+                rows[key] = entity
+
+        # Indexes are built a field at a time, from the column of its values
+        columns = {}
+        def column(field):
+            values = columns.get(field)
+            if values is None:
+                values = columns[field] = [entity.get(field) for entity in entities]
+            return values
+
+        for field, index in self._hash_indexes.items():
+            groups = {}
+            for value, key in zip(column(field), keys):
+                try:
+                    group = groups.get(value)
+                    if group is None:
+                        groups[value] = [key]
+                    else:
+                        group.append(key)
+                except TypeError:
+                    pass
+            for value, group in groups.items():
+                bucket = index.get(value)
+                if bucket is None:
+                    index[value] = dict.fromkeys(group)
+                else:
+                    bucket.update(dict.fromkeys(group))
+        for field, index in self._sorted_indexes.items():
+            _merge_index(index, list(zip(_sort_keys(column(field)), keys)))
+        for fields, counter in self._counters.items():
+            _tally_column(counter, fields, [column(field) for field in fields], entities)
+        if self._search_index is not None:
+            self._search_pending.extend(keys)
+        self._key_index.extend([key for key in keys if key not in replaced] if replaced else keys)
+        self._key_index.sort()
+
+        write_log = self.write_log
+        if write_log is not None:
+            for key, entity in entries:
+                write_log.record(self.name, key, self.materialize(entity))
+        if log_changes:
+            for key, _ in entries:
+                self.version += 1
+                self._log_change(key)
+        else:
+            self.version += 1
+            # Bulk loads are not logged entry by entry; readers have to reload
+            self._reset_changes()
+        return len(entries)
+
+    def keys(self):
+        return self._rows.keys()
+
+    def values(self):
+        return self._rows.values()
+
+    def items(self):
+        return self._rows.items()
+
+    def materialize(self, entity):
+        """Return a stored entity as a plain dict ready for serialization"""
+        return entity
+
+    def clear(self):
+        with self.lock:
+            self._rows.clear()
+            self._key_index.clear()
+            for index in self._hash_indexes.values():
+                index.clear()
+            for index in self._sorted_indexes.values():
+                index.clear()
+            for counter in self._counters.values():
+                counter.clear()
+            if self._search_index is not None:
+                self._search_index.clear()
+                self._search_pending = []
+            self.version += 1
+            self._reset_changes()
+
+    def changes(self, since, limit):
+        """
+        Return the entities changed after store version since, oldest first.
+
+        Returns (entries, through, more): up to limit (key, row) pairs, with
+        row None for deleted entities and each key listed once, at its latest
+        change; the version these entries bring a reader up to; and whether
+        more changes follow. Returns None if the changes after since are no
+        longer fully logged, i.e. the version predates a bulk load, a clear
+        or the oldest entry kept.
+        """
+        with self.lock:
+            if since < self._changes_from or since > self.version:
+                return None
+            versions, keys, last_change = self._change_versions, self._change_keys, self._last_change
+            entries = []
+            through = since
+            for position in range(bisect_right(versions, since), len(versions)):
+                version, key = versions[position], keys[position]
+                if last_change[key] != version:
+                    continue
+                if len(entries) == limit:
+                    return entries, through, True
+                entries.append((key, self._rows.get(key)))
+                through = version
+            return entries, self.version, False
+
+    def _log_change(self, key):
+        if self.max_changes == 0:
+            self._changes_from = self.version
+            return
+        self._change_versions.append(self.version)
+        self._change_keys.append(key)
+        self._last_change[key] = self.version
+        # Trim in batches so the amortized cost per write stays constant
+        limit = self.max_changes
+        if limit is not None and len(self._change_keys) > limit + limit // 4:
+            self._trim_changes(len(self._change_keys) - limit)
+
+    def _trim_changes(self, count):
+        last_change = self._last_change
+        for version, key in zip(self._change_versions[:count], self._change_keys[:count]):
+            if last_change[key] == version:
+                del last_change[key]
+        self._changes_from = self._change_versions[count - 1]
+        del self._change_versions[:count]
+        del self._change_keys[:count]
+
+    def _reset_changes(self):
+        # Changes after self.version are logged from here on
+        self._change_versions = array("Q")
+        self._change_keys = []
+        self._last_change = {}
+        self._changes_from = self.version
+
+    def _index(self, key, entity):
+        for field, index in self._hash_indexes.items():
+            value = entity.get(field)
+            try:
+                index.setdefault(value, {})[key] = None
+            except TypeError:
+                pass
+        for field, index in self._sorted_indexes.items():
+            _insert_entry(index, (_sort_key(entity.get(field)), key))
+        if self._counters:
+            _tally(self._counters, entity, 1)
+        if self._search_index is not None:
+            self._search_index.add(key, entity)
+
+    def _unindex(self, key, entity):
+        for field, index in self._hash_indexes.items():
+            value = entity.get(field)
+            try:
+                bucket = index.get(value)
+            except TypeError:
+                continue
+            if bucket is not None:
+                bucket.pop(key, None)
+                if not bucket:
+                    del index[value]
+        for field, index in self._sorted_indexes.items():
+            _remove_entry(index, (_sort_key(entity.get(field)), key))
+        if self._counters:
+            _tally(self._counters, entity, -1)
+        if self._search_index is not None:
+            self._search_index.remove(key, entity)
+
+    def lookup(self, field, value):
+        """Return the keys whose field equals value, or None if the field is not indexed"""
+        index = self._hash_indexes.get(field)
+        if index is None:
+            return None
+        try:
+            return index.get(value, {})
+        except TypeError:
+            return {}
+
+    def is_indexed(self, field):
+        return field in self._hash_indexes
+
+    def searched_fields(self):
+        """Return the fields $search looks in, empty when the store cannot be searched"""
+        return self._search_index.fields if self._search_index is not None else ()
+
+    def find(self, values, limit=None):
+        """
+        Return the (key, row) pairs of the entities whose fields equal
+        values, a dict of field to value, in key order and at most limit of
+        them. Every field must be hash indexed; returns None otherwise,
+        without scanning.
+        """
+        with self.lock:
+            buckets = [self.lookup(field, value) for field, value in values.items()]
+            if any(bucket is None for bucket in buckets):
+                return None
+            rows = self._rows
+            buckets.sort(key=len)
+            if limit is not None and (not buckets or len(buckets[0]) * 16 > len(rows)):
+                # Dense matches: the first limit of them in key order are
+                # found sooner by walking the key index than by sorting
+                keys = (key for key in _iter_entries(self._key_index)
+                        if all(key in bucket for bucket in buckets))
+                return [(key, rows[key]) for key in islice(keys, limit)]
+            if buckets:
+                smallest, others = buckets[0], buckets[1:]
+                keys = (key for key in smallest if all(key in other for other in others))
+            else:
+                keys = iter(rows)
+            if limit is not None:
+                return [(key, rows[key]) for key in heapq.nsmallest(limit, keys)]
+            return [(key, rows[key]) for key in sorted(keys)]
+
+    def count(self, compiled_filter=None, implied=(), search=None):
+        """
+        Return the number of entities matching a compiled $filter and, if
+        given, a compiled $search.
+
+        Filters that only test fields for equality are counted from the
+        maintained indexes and counters; others are planned and, where the
+        plan is not exact, checked row by row. implied names fields whose
+        tests every entity of the store is known to pass, such as the
+        partition field of a partition.
+        """
+        with self.lock:
+            if search is not None:
+                keys, exact, predicate = self._searched(search, compiled_filter, implied)
+            else:
+                count = self._counted(compiled_filter, implied)
+                if count is not None:
+                    return count
+                keys, exact = compiled_filter.plan(self.lookup)
+                predicate = compiled_filter.predicate
+            rows = self._rows
+            if keys is None:
+                return sum(1 for row in rows.values() if predicate(row))
+            if exact:
+                return len(keys)
+            return sum(1 for key in keys if predicate(rows[key]))
+
+    def _counted(self, compiled_filter, implied=()):
+        """Count from indexes and counters alone, or return None if that is not possible"""
+        if compiled_filter is None:
+            return len(self._rows)
+        terms = compiled_filter.equality_terms()
+        if terms is None:
+            return None
+        for field in implied:
+            terms.pop(field, None)
+        if not terms:
+            return len(self._rows)
+        if len(terms) == 1:
+            (field, values), = terms.items()
+            index = self._hash_indexes.get(field)
+            if index is not None:
+                return sum(len(index.get(value, ())) for value in values)
+        for fields, counter in self._counters.items():
+            if len(fields) == len(terms) and all(field in terms for field in fields):
+                return sum(counter.get(combination, 0)
+                           for combination in product(*(terms[field] for field in fields)))
+        return None
+
+    def _current_search_index(self):
+        """
+        Return the search index, first adding the entities bulk loaded since
+        it was last used. Bulk loads leave tokenizing to the next search (or
+        snapshot), which indexes all of them in one pass, so seeding does
+        not pay for $search until it is used.
+        """
+        index = self._search_index
+        if self._search_pending:
+            rows = self._rows
+            # As in bulk_load, the collector would otherwise rescan the
+            # growing index over and over
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                index.add_all((key, rows[key]) for key in dict.fromkeys(self._search_pending) if key in rows)
+            finally:
+                if gc_enabled:
+                    gc.enable()
+            self._search_pending = []
+        return index
+
+    def _searched(self, search, compiled_filter=None, implied=()):
+        """
+        Plan a compiled $search, and-ed with a compiled $filter if given.
+
+        Returns (keys, exact, predicate) as a filter plan does, with the
+        predicate checking whatever the candidate keys do not settle. The
+        search decides the candidates: its matches are usually far fewer
+        than those of the filter's terms.
+        """
+        index = self._current_search_index()
+        if index is None:
+            raise ValueError(f"{self.name} has no searched fields")
+        keys, exact = search.plan(index)
+        searched = search.predicate(index.fields)
+        if keys is not None and not exact:
+            # Candidates are checked once here rather than by both the count
+            # and the walk
+            rows = self._rows
+            keys = {key for key in keys if searched(rows[key])}
+            exact = True
+        if compiled_filter is None:
+            return keys, exact, None if exact else searched
+        terms = compiled_filter.equality_terms() if keys is not None else None
+        if terms is not None:
+            for field in implied:
+                terms.pop(field, None)
+            if all(field in self._hash_indexes for field in terms):
+                # Equality tests of indexed fields narrow the matches down
+                # through their buckets, leaving nothing to check row by row
+                for field, values in terms.items():
+                    buckets = [self.lookup(field, value) for value in values]
+                    bucket = buckets[0] if len(buckets) == 1 else set().union(*buckets)
+                    if isinstance(keys, set) and isinstance(bucket, (dict, set)):
+                        keys = keys & bucket.keys() if isinstance(bucket, dict) else keys & bucket
+                    else:
+                        keys = set(filter(bucket.__contains__, keys))
+                return keys, True, None
+        if keys is None:
+            filtered = compiled_filter.predicate
+            keys, _ = compiled_filter.plan(self.lookup)
+            return keys, False, lambda row: searched(row) and filtered(row)
+        return keys, False, compiled_filter.predicate
+
+    def query(self, compiled_filter=None, orderby=(), after=None, implied=(), search=None):
+        """
+        Return (entries, count) for the entities matching a compiled $filter
+        and, if given, a compiled $search, ordered by a parsed $orderby.
+
+        entries is a lazy iterable of (key, row) pairs so callers applying
+        $skip/$top only evaluate as many entities as they need. When after
+        is a decoded cursor, iteration resumes just past that position.
+        count is the total number of matches, regardless of the cursor.
+        implied is as for count.
+        """
+        with self.lock:
+            return self._query(compiled_filter, orderby, after, implied, search)
+
+    def _query(self, compiled_filter, orderby, after, implied=(), search=None):
+        rows = self._rows
+        indexed_order = not orderby or orderby[0][0] in self._sorted_indexes
+        keys, exact, predicate = None, False, None
+        # Share of the set above which a result is walked in index order
+        walk_share = 16
+        if search is not None:
+            keys, exact, predicate = self._searched(search, compiled_filter, implied)
+            # Search matches are known exactly or checked with a cheap
+            # predicate, so walking pays off for smaller results too
+            walk_share = 256
+        elif compiled_filter is not None:
+            predicate = compiled_filter.predicate
+            # A large result counted from the counters is walked with the
+            # predicate, without intersecting the candidate keys first
+            count = self._counted(compiled_filter, implied)
+            if count is not None and indexed_order and count * 16 > len(rows):
+                return self._walk(orderby, lambda key, row: predicate(row), after), count
+            keys, exact = compiled_filter.plan(self.lookup)
+
+        # Walk an index when the result is a large share of the set,
+        # otherwise sorting the few matches is cheaper
+        unrestricted = keys is None and predicate is None
+        large_result = unrestricted or (keys is not None and len(keys) * walk_share > len(rows))
+        if indexed_order and large_result:
+            if unrestricted:
+                accept, count = None, len(rows)
+            elif exact:
+                accept, count = (lambda key, row: key in keys), len(keys)
+            else:
+                accept = lambda key, row: key in keys and predicate(row)
+                count = sum(1 for key in keys if predicate(rows[key]))
+            return self._walk(orderby, accept, after), count
+
+        if keys is None:
+            matches = [(key, row) for key, row in rows.items() if predicate is None or predicate(row)]
+        elif exact:
+            matches = [(key, rows[key]) for key in keys]
+        else:
+            matches = [(key, rows[key]) for key in keys if predicate(rows[key])]
+        entries = _sort_entries(matches, orderby)
+        if after is not None:
+            entries = dropwhile(
+                lambda entry: not _is_after(_position(entry[0], entry[1], orderby), after, orderby),
+                entries)
+        return entries, len(matches)
+
+    def _walk(self, orderby, accept=None, after=None):
+        """
+        Yield (key, row) pairs in result order by walking a sorted index.
+
+        Runs without the store lock: entries are read by position and
+        entities deleted since the walk started are skipped, so concurrent
+        writes can at worst shift which rows near the cursor are returned.
+        """
+        rows = self._rows
+
+        if not orderby:
+            bound = after[-1] if after is not None else None
+            for key in _iter_entries(self._key_index, bound, after_bound=True):
+                row = rows.get(key)
+                if row is not None and (accept is None or accept(key, row)):
+                    yield key, row
+            return
+
+        field, descending = orderby[0]
+        index = self._sorted_indexes[field]
+        if after is None:
+            entries = _iter_entries(index, descending=descending)
+        elif descending:
+            entries = _iter_entries(index, (after[0], _MAX), descending=True)
+        else:
+            entries = _iter_entries(index, (after[0],))
+
+        if len(orderby) == 1:
+            for sort_value, key in entries:
+                row = rows.get(key)
+                if row is None or (accept is not None and not accept(key, row)):
+                    continue
+                if after is not None and sort_value == after[0] and not _is_after((sort_value, key), after, orderby):
+                    continue
+                yield key, row
+            return
+
+        # Ties on the first key are ordered by the remaining keys; only the
+        # group holding the cursor needs a full position comparison
+        for sort_value, group in groupby(entries, key=itemgetter(0)):
+            matched = [(key, row) for key, row in ((key, rows.get(key)) for _, key in group)
+                       if row is not None and (accept is None or accept(key, row))]
+            if len(matched) > 1:
+                matched = _sort_entries(matched, orderby[1:], descending)
+            if after is not None and sort_value == after[0]:
+                matched = [entry for entry in matched
+                           if _is_after(_position(entry[0], entry[1], orderby), after, orderby)]
+            yield from matched
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Concurrent write stress test for the Microsoft Dynamics 365 Finance Mock Server.
+
+Hammers a running server with many simultaneous writers and checks that no
+write is lost:
+
+- every POST without an account number gets a distinct account, and the
+  $count grows by exactly the number of creates
+- concurrent PATCHes of different fields on the same customer all survive
+
+Run it against a multi-threaded server, e.g.:
+    python serve.py --server waitress --threads 64
+    python stress_test.py --threads 64 --creates 2000
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BASE_URL = "http://localhost:8080"
+
+
+def stress_creates(session_for, threads, creates):
+    """Create customers from many threads and check account numbers are unique"""
+    print(f"Creating {creates} customers from {threads} threads...")
+    before = int(requests.get(f"{BASE_URL}/CustomersV3/$count").text)
+
+    def create(i):
+        response = session_for().post(f"{BASE_URL}/CustomersV3",
+                                      json={"dataAreaId": "USMF", "OrganizationName": f"Stress {i}"})
+        return response.status_code, response.json().get("CustomerAccount")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(create, range(creates)))
+    elapsed = time.perf_counter() - started
+
+    statuses = {status for status, _ in results}
+    accounts = [account for _, account in results]
+    after = int(requests.get(f"{BASE_URL}/CustomersV3/$count").text)
+    ok = statuses == {201} and len(set(accounts)) == creates and after - before == creates
+    print(f"{'✅' if ok else '❌'} {creates} creates in {elapsed:.2f}s: statuses {sorted(statuses)}, "
+          f"{len(set(accounts))} distinct accounts, $count grew by {after - before}")
+    return ok, accounts[0]
+
+
+def stress_updates(session_for, threads, account):
+    """PATCH a different field of one customer from each thread and check none is lost"""
+    print(f"Patching one customer from {threads} threads...")
+    url = f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='{account}')"
+
+    def patch(i):
+        return session_for().patch(url, json={f"StressField{i}": i}).status_code
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        statuses = set(pool.map(patch, range(threads)))
+
+    customer = requests.get(f"{BASE_URL}/CustomersV3",
+                            params={"$filter": f"CustomerAccount eq '{account}'"}).json()["value"][0]
+    lost = [i for i in range(threads) if customer.get(f"StressField{i}") != i]
+    ok = statuses == {200} and not lost
+    print(f"{'✅' if ok else '❌'} {threads} concurrent updates: statuses {sorted(statuses)}, "
+          f"{len(lost)} lost updates")
+    return ok
+
+
+def main():
+    global BASE_URL
+    parser = argparse.ArgumentParser(description="Concurrent write stress test")
+    parser.add_argument("--url", default=BASE_URL, help="base URL of the running mock server")
+    parser.add_argument("--threads", type=int, default=64, help="number of concurrent writers")
+    parser.add_argument("--creates", type=int, default=1000, help="number of customers to create")
+    args = parser.parse_args()
+    BASE_URL = args.url.rstrip("/")
+
+    # One keep-alive session per worker thread
+    local = threading.local()
+
+    def session_for():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    created_ok, account = stress_creates(session_for, args.threads, args.creates)
+    updated_ok = stress_updates(session_for, args.threads, account)
+    return 0 if created_ok and updated_ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
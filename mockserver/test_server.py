@@ -8,6 +8,7 @@ import requests
 import json
 import time
 import sys
+from concurrent.futures import ThreadPoolExecutor
 
 BASE_URL = "http://localhost:8080"
 
@@ -133,6 +134,843 @@ def test_customers():
         print(f"❌ Customer tests failed: {e}")
         return False
 
+def test_filters():
+    """Test OData $filter support"""
+    print("Testing $filter...")
+    try:
+        # Indexed equality filter
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$filter": "CustomerGroupId eq '20'"})
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["value"]) > 0
+        assert all(c["CustomerGroupId"] == "20" for c in data["value"])
+        assert data["@odata.count"] == len(data["value"])
+        
+        # Combined indexed and non-indexed predicates
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={
+            "$filter": "dataAreaId eq 'USMF' and (startswith(OrganizationName,'Adv') or CreditLimit gt 75000)"
+        })
+        assert response.status_code == 200
+        accounts = {c["CustomerAccount"] for c in response.json()["value"]}
+        assert {"C000001", "C000002"} <= accounts
+        
+        # in, contains and not
+        response = requests.get(f"{BASE_URL}/VendorsV2", params={
+            "$filter": "VendorGroupId in ('10','20') and not contains(OrganizationName,'Fabrikam')"
+        })
+        assert response.status_code == 200
+        names = [v["OrganizationName"] for v in response.json()["value"]]
+        assert "Contoso Electronics" in names
+        assert "Fabrikam Supplies" not in names
+        
+        # Invalid expressions are rejected
+        response = requests.get(f"{BASE_URL}/VendorsV2", params={"$filter": "VendorGroupId eq"})
+        assert response.status_code == 400
+        
+        # Filters that are not true or false, and functions called with the
+        # wrong number of arguments, are rejected rather than matching all or nothing
+        for filter_query in ("CustomerGroupId", "'10'", "tolower(OrganizationName)",
+                             "IsActive and CreditLimit", "contains(OrganizationName)",
+                             "startswith(OrganizationName,'A','B')", "length(OrganizationName,'A') gt 1"):
+            response = requests.get(f"{BASE_URL}/CustomersV3", params={"$filter": filter_query})
+            assert response.status_code == 400, filter_query
+            assert response.json()["error"].startswith("Invalid $filter")
+        response = requests.get(f"{BASE_URL}/CustomersV3/$count", params={"$filter": "CustomerGroupId"})
+        assert response.status_code == 400
+        
+        # A boolean property stands as a condition on its own
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$filter": "not IsActive or IsActive"})
+        assert response.status_code == 200
+        everyone = requests.get(f"{BASE_URL}/CustomersV3").json()["@odata.count"]
+        assert response.json()["@odata.count"] == everyone
+        
+        print("✅ Filter tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Filter tests failed: {e}")
+        return False
+
+def test_orderby():
+    """Test OData $orderby support"""
+    print("Testing $orderby...")
+    try:
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$orderby": "CreditLimit desc"})
+        assert response.status_code == 200
+        limits = [c["CreditLimit"] for c in response.json()["value"]]
+        assert limits == sorted(limits, reverse=True)
+        
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={
+            "$orderby": "CustomerGroupId desc,OrganizationName asc",
+            "$top": 1
+        })
+        assert response.status_code == 200
+        assert response.json()["value"][0]["CustomerGroupId"] == "20"
+        
+        response = requests.get(f"{BASE_URL}/VendorsV2", params={"$orderby": "OrganizationName desc"})
+        assert response.status_code == 200
+        names = [v["OrganizationName"] for v in response.json()["value"]]
+        assert names == sorted(names, reverse=True)
+        
+        response = requests.get(f"{BASE_URL}/VendorsV2", params={"$orderby": "OrganizationName sideways"})
+        assert response.status_code == 400
+        
+        print("✅ Orderby tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Orderby tests failed: {e}")
+        return False
+
+def test_paging():
+    """Test server-driven paging with @odata.nextLink"""
+    print("Testing server-driven paging...")
+    try:
+        session = requests.Session()
+        session.headers["Prefer"] = "odata.maxpagesize=1"
+        url = f"{BASE_URL}/CustomersV3?$orderby=CustomerAccount"
+        accounts = []
+        while url:
+            response = session.get(url)
+            assert response.status_code == 200
+            assert response.headers.get("Preference-Applied") == "odata.maxpagesize=1"
+            data = response.json()
+            assert len(data["value"]) <= 1
+            accounts.extend(c["CustomerAccount"] for c in data["value"])
+            url = data.get("@odata.nextLink")
+        assert len(accounts) == data["@odata.count"]
+        assert accounts == sorted(accounts)
+        
+        # A tampered token is rejected
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$skiptoken": "not-a-token"})
+        assert response.status_code == 400
+        
+        # Negative or non-numeric $skip and $top are rejected, not served
+        for url in ("CustomersV3", "ExchangeRates"):
+            for params in ({"$skip": "-1"}, {"$top": "-1"}, {"$top": "ten"}):
+                response = requests.get(f"{BASE_URL}/{url}", params=params)
+                assert response.status_code == 400, (url, params, response.status_code)
+                assert "non-negative integer" in response.json()["error"]
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$top": "0"})
+        assert response.status_code == 200 and response.json()["value"] == []
+        
+        print("✅ Paging tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Paging tests failed: {e}")
+        return False
+
+def test_streaming():
+    """Test streamed collection responses"""
+    print("Testing streamed responses...")
+    try:
+        buffered = requests.get(f"{BASE_URL}/VendorsV2").json()
+        response = requests.get(f"{BASE_URL}/VendorsV2", headers={"Accept": "application/json;odata.streaming=true"})
+        assert response.status_code == 200
+        assert response.headers.get("Transfer-Encoding") == "chunked"
+        streamed = response.json()
+        assert streamed["@odata.count"] == buffered["@odata.count"]
+        assert streamed["value"] == buffered["value"]
+        
+        print("✅ Streaming tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Streaming tests failed: {e}")
+        return False
+
+def test_compression():
+    """Test Accept-Encoding negotiation of compressed responses"""
+    print("Testing response compression...")
+    try:
+        # $metadata is cached and larger than the minimum size for compression
+        url = f"{BASE_URL}/$metadata"
+        plain = requests.get(url, headers={"Accept-Encoding": "identity"})
+        assert "Content-Encoding" not in plain.headers
+        assert "Accept-Encoding" in plain.headers.get("Vary", "")
+        
+        # The cached body is compressed once and served again in the same encoding
+        for encoding in ("gzip", "deflate", "gzip"):
+            response = requests.get(url, headers={"Accept-Encoding": encoding})
+            assert response.headers.get("Content-Encoding") == encoding
+            assert int(response.headers["Content-Length"]) < len(plain.content)
+            assert response.text == plain.text
+        
+        # Unsupported or refused codecs fall back to identity
+        response = requests.get(url, headers={"Accept-Encoding": "compress, gzip;q=0"})
+        assert "Content-Encoding" not in response.headers
+        
+        # Streamed responses are compressed on the fly; small bodies are not compressed
+        response = requests.get(f"{BASE_URL}/VendorsV2", headers={
+            "Accept": "application/json;odata.streaming=true", "Accept-Encoding": "gzip"
+        })
+        assert response.headers.get("Content-Encoding") == "gzip"
+        assert response.json()["value"]
+        response = requests.get(f"{BASE_URL}/health", headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in response.headers
+        
+        print("✅ Compression tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Compression tests failed: {e}")
+        return False
+
+def test_batch():
+    """Test OData JSON $batch endpoint"""
+    print("Testing $batch...")
+    try:
+        # Accounts must be new on every run now that duplicate POSTs are refused
+        account = f"BATCH{int(time.time() * 1000) % 10 ** 9}"
+        batch = {
+            "requests": [
+                {"id": "1", "method": "GET", "url": "VendorsV2?$top=1"},
+                {"id": "2", "atomicityGroup": "g1", "method": "POST", "url": "CustomersV3",
+                 "body": {"dataAreaId": "USMF", "CustomerAccount": account, "OrganizationName": "Batch Co"}},
+                {"id": "3", "atomicityGroup": "g1", "method": "PATCH",
+                 "url": f"CustomersV3(dataAreaId='USMF',CustomerAccount='{account}')",
+                 "body": {"CreditLimit": 1000.0}},
+                {"id": "4", "dependsOn": ["g1"], "method": "GET",
+                 "url": f"CustomersV3?$filter=CustomerAccount eq '{account}'"}
+            ]
+        }
+        response = requests.post(f"{BASE_URL}/$batch", json=batch)
+        assert response.status_code == 200
+        responses = response.json()["responses"]
+        assert [r["id"] for r in responses] == ["1", "2", "3", "4"]
+        assert [r["status"] for r in responses] == [200, 201, 200, 200]
+        assert responses[3]["body"]["value"][0]["CreditLimit"] == 1000.0
+        
+        # A failing changeset is rolled back and its dependents fail
+        batch = {
+            "requests": [
+                {"id": "1", "atomicityGroup": "g1", "method": "POST", "url": "CustomersV3",
+                 "body": {"dataAreaId": "USMF", "CustomerAccount": "BATCH02"}},
+                {"id": "2", "atomicityGroup": "g1", "method": "PATCH",
+                 "url": "CustomersV3(dataAreaId='USMF',CustomerAccount='MISSING')", "body": {}},
+                {"id": "3", "dependsOn": ["1"], "method": "GET", "url": "CustomersV3"}
+            ]
+        }
+        response = requests.post(f"{BASE_URL}/$batch", json=batch)
+        assert response.status_code == 200
+        assert [r["status"] for r in response.json()["responses"]] == [424, 404, 424]
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$filter": "CustomerAccount eq 'BATCH02'"})
+        assert response.json()["value"] == []
+
+        # Groups and dependencies that are not string ids are malformed
+        for malformed in ({"atomicityGroup": {"name": "g1"}}, {"atomicityGroup": ["g1"]},
+                          {"dependsOn": [["1"]]}, {"dependsOn": [{"id": "1"}]}):
+            batch = {"requests": [{"id": "1", "method": "GET", "url": "VendorsV2?$top=1"},
+                                  {"id": "2", "method": "GET", "url": "VendorsV2?$top=1", **malformed}]}
+            response = requests.post(f"{BASE_URL}/$batch", json=batch)
+            assert response.status_code == 400, malformed
+            assert response.json()["error"].startswith("Invalid $batch")
+
+        # A write racing a failing changeset survives its rollback, and rates
+        # written by the changeset are rolled back too
+        customer_url = f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='{account}')"
+        rate = {"FromCurrencyCode": "XBT", "ToCurrencyCode": "USD", "ExchangeRateValue": 2.0,
+                "ValidFromDate": "2025-01-01T00:00:00Z"}
+        changeset = [{"id": "1", "atomicityGroup": "g1", "method": "PATCH", "url": customer_url[len(BASE_URL) + 1:],
+                      "body": {"CreditLimit": 5.0}},
+                     {"id": "2", "atomicityGroup": "g1", "method": "POST", "url": "ExchangeRates", "body": rate}]
+        changeset += [{"id": str(i), "atomicityGroup": "g1", "method": "GET", "url": "CustomersV3?$top=50"}
+                      for i in range(3, 300)]
+        changeset.append({"id": "300", "atomicityGroup": "g1", "method": "PATCH",
+                          "url": "CustomersV3(dataAreaId='USMF',CustomerAccount='MISSING')", "body": {}})
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            batch_response = pool.submit(requests.post, f"{BASE_URL}/$batch", json={"requests": changeset})
+            time.sleep(0.1)
+            assert requests.patch(customer_url, json={"OrganizationName": "Raced Co"}).status_code == 200
+            assert batch_response.result().json()["responses"][-1]["status"] == 404
+        customer = requests.get(customer_url).json()
+        assert customer["OrganizationName"] == "Raced Co" and customer["CreditLimit"] == 1000.0
+        response = requests.get(f"{BASE_URL}/ExchangeRates", params={"$filter": "FromCurrencyCode eq 'XBT'"})
+        assert response.json()["value"] == []
+
+        print("✅ Batch tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Batch tests failed: {e}")
+        return False
+
+def test_concurrent_writes():
+    """Test that concurrent creates and updates are not lost"""
+    print("Testing concurrent writes...")
+    try:
+        def create(i):
+            response = requests.post(f"{BASE_URL}/CustomersV3",
+                                     json={"dataAreaId": "USMF", "OrganizationName": f"Concurrent {i}"})
+            assert response.status_code == 201
+            return response.json()["CustomerAccount"]
+        
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            accounts = list(pool.map(create, range(32)))
+        assert len(set(accounts)) == len(accounts)
+        
+        # Explicitly reusing an account is refused rather than overwriting it
+        response = requests.post(f"{BASE_URL}/CustomersV3",
+                                 json={"dataAreaId": "USMF", "CustomerAccount": accounts[0]})
+        assert response.status_code == 409
+        
+        # Each PATCH sets a different field; all of them must survive
+        update_url = f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='{accounts[0]}')"
+        with ThreadPoolExecutor(max_workers=16) as pool:
+            statuses = list(pool.map(lambda i: requests.patch(update_url, json={f"Field{i}": i}).status_code,
+                                     range(32)))
+        assert statuses == [200] * 32
+        customer = requests.get(f"{BASE_URL}/CustomersV3",
+                                params={"$filter": f"CustomerAccount eq '{accounts[0]}'"}).json()["value"][0]
+        assert all(customer[f"Field{i}"] == i for i in range(32))
+        
+        print("✅ Concurrent write tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Concurrent write tests failed: {e}")
+        return False
+
+def test_conditional_requests():
+    """Test ETag revalidation and optimistic concurrency"""
+    print("Testing conditional requests...")
+    try:
+        # Collection GETs revalidate to 304 until the entity set changes
+        response = requests.get(f"{BASE_URL}/VendorsV2")
+        etag = response.headers["ETag"]
+        response = requests.get(f"{BASE_URL}/VendorsV2", headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+        
+        # Entity GETs carry the entity's ETag
+        entity_url = f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='C000001')"
+        response = requests.get(entity_url)
+        assert response.status_code == 200
+        etag = response.headers["ETag"]
+        assert response.json()["@odata.etag"] == etag
+        assert requests.get(entity_url, headers={"If-None-Match": etag}).status_code == 304
+        
+        # PATCH with the current ETag succeeds and issues a new one; a stale one fails
+        response = requests.patch(entity_url, json={"NameAlias": "AWorks"}, headers={"If-Match": etag})
+        assert response.status_code == 200
+        new_etag = response.headers["ETag"]
+        assert new_etag != etag
+        response = requests.patch(entity_url, json={"NameAlias": "Stale"}, headers={"If-Match": etag})
+        assert response.status_code == 412
+        assert requests.get(entity_url, headers={"If-None-Match": etag}).status_code == 200
+        assert requests.get(entity_url).json()["NameAlias"] == "AWorks"
+        
+        print("✅ Conditional request tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Conditional request tests failed: {e}")
+        return False
+
+def test_delta_queries():
+    """Test change tracking with $deltatoken"""
+    print("Testing delta queries...")
+    try:
+        # The last page of a full read carries a delta link
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$select": "CustomerAccount,CreditLimit"})
+        assert response.status_code == 200
+        data = response.json()
+        assert "@odata.nextLink" not in data
+        delta_link = data["@odata.deltaLink"]
+        assert "$deltatoken" in requests.utils.unquote(delta_link)
+        
+        # Nothing changed yet
+        data = requests.get(delta_link).json()
+        assert data["value"] == []
+        assert data["@odata.context"].endswith("#CustomersV3/$delta")
+        
+        # Created and updated entities are returned once each, with $select applied
+        created = requests.post(f"{BASE_URL}/CustomersV3", json={
+            "dataAreaId": "USMF", "OrganizationName": "Delta Customer"
+        }).json()["CustomerAccount"]
+        entity_url = f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='C000002')"
+        requests.patch(entity_url, json={"CreditLimit": 110000.0})
+        requests.patch(entity_url, json={"CreditLimit": 120000.0})
+        data = requests.get(delta_link).json()
+        assert [entity["CustomerAccount"] for entity in data["value"]] == [created, "C000002"]
+        assert data["value"][1]["CreditLimit"] == 120000.0
+        assert "OrganizationName" not in data["value"][0]
+        
+        # Following the new delta link returns only later changes
+        assert requests.get(data["@odata.deltaLink"]).json()["value"] == []
+        
+        # Tokens this server did not issue have expired
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$deltatoken": "1.unknown"})
+        assert response.status_code == 410
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={"$deltatoken": "invalid"})
+        assert response.status_code == 400
+        
+        print("✅ Delta query tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Delta query tests failed: {e}")
+        return False
+
+def test_cross_company():
+    """Test company-scoped and cross-company queries"""
+    print("Testing cross-company queries...")
+    try:
+        # Requests see the default company unless they pass cross-company=true
+        scoped = int(requests.get(f"{BASE_URL}/CustomersV3/$count").text)
+        total = int(requests.get(f"{BASE_URL}/CustomersV3/$count", params={"cross-company": "true"}).text)
+        created = requests.post(f"{BASE_URL}/CustomersV3", json={
+            "dataAreaId": "DEMF", "OrganizationName": "Cross Company Customer"
+        }).json()["CustomerAccount"]
+        assert int(requests.get(f"{BASE_URL}/CustomersV3/$count").text) == scoped
+        assert int(requests.get(f"{BASE_URL}/CustomersV3/$count", params={"cross-company": "true"}).text) == total + 1
+        
+        params = {"$filter": "dataAreaId eq 'DEMF'", "$select": "dataAreaId,CustomerAccount"}
+        assert requests.get(f"{BASE_URL}/CustomersV3", params=params).json()["value"] == []
+        data = requests.get(f"{BASE_URL}/CustomersV3", params={**params, "cross-company": "true"}).json()
+        assert {"dataAreaId": "DEMF", "CustomerAccount": created} in [
+            {field: entity[field] for field in ("dataAreaId", "CustomerAccount")} for entity in data["value"]
+        ]
+        
+        # Cross-company results are merged in $orderby order
+        data = requests.get(f"{BASE_URL}/CustomersV3", params={
+            "$orderby": "dataAreaId desc", "$select": "dataAreaId", "cross-company": "true"
+        }).json()
+        companies = [entity["dataAreaId"] for entity in data["value"]]
+        assert companies == sorted(companies, reverse=True)
+        assert companies[-1] == "DEMF"
+        
+        # The company of an entity is part of its key and cannot be changed
+        entity_url = f"{BASE_URL}/CustomersV3(dataAreaId='DEMF',CustomerAccount='{created}')"
+        assert requests.get(entity_url).status_code == 200
+        requests.patch(entity_url, json={"dataAreaId": "USMF"})
+        assert requests.get(entity_url).json()["dataAreaId"] == "DEMF"
+        
+        print("✅ Cross-company tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Cross-company tests failed: {e}")
+        return False
+
+def test_counts():
+    """Test $count with filters and $count=true on collections"""
+    print("Testing counts...")
+    try:
+        count_url = f"{BASE_URL}/CustomersV3/$count"
+        created = requests.post(f"{BASE_URL}/CustomersV3", json={
+            "dataAreaId": "DEMF", "OrganizationName": "Counted Customer", "CustomerGroupId": "77"
+        }).json()["CustomerAccount"]
+        
+        # Maintained counts agree with the entities a collection GET returns
+        for filter_query in ("IsActive eq true", "dataAreaId eq 'DEMF' and IsActive eq true",
+                             "CustomerGroupId eq '77' and IsActive eq true", "CreditLimit ge 0"):
+            params = {"$filter": filter_query, "cross-company": "true"}
+            data = requests.get(f"{BASE_URL}/CustomersV3", params={**params, "$count": "true"}).json()
+            assert int(requests.get(count_url, params=params).text) == len(data["value"]) == data["@odata.count"]
+        
+        # Counters follow writes
+        params = {"$filter": "CustomerGroupId eq '77' and IsActive eq false", "cross-company": "true"}
+        assert int(requests.get(count_url, params=params).text) == 0
+        requests.patch(f"{BASE_URL}/CustomersV3(dataAreaId='DEMF',CustomerAccount='{created}')",
+                       json={"IsActive": False})
+        assert int(requests.get(count_url, params=params).text) == 1
+        # The request's company still applies without cross-company=true
+        assert int(requests.get(count_url, params={"$filter": params["$filter"]}).text) == 0
+        
+        # $count=false leaves the count out; invalid options are rejected
+        data = requests.get(f"{BASE_URL}/CustomersV3", params={"$count": "false"}).json()
+        assert "@odata.count" not in data and data["value"]
+        assert requests.get(f"{BASE_URL}/CustomersV3", params={"$count": "maybe"}).status_code == 400
+        assert requests.get(count_url, params={"$filter": "IsActive eq"}).status_code == 400
+        
+        print("✅ Count tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Count tests failed: {e}")
+        return False
+
+def test_expand():
+    """Test $expand of navigation properties between customers and customer groups"""
+    print("Testing $expand...")
+    try:
+        customer_url = f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='C000001')"
+        customer = requests.get(customer_url, params={"$expand": "CustomerGroup"}).json()
+        group = customer["CustomerGroup"]
+        assert group["CustomerGroupId"] == customer["CustomerGroupId"]
+        assert group["dataAreaId"] == customer["dataAreaId"]
+        
+        # To-many, with nested $select and $top
+        params = {"$filter": f"CustomerGroupId eq '{group['CustomerGroupId']}'",
+                  "$expand": "Customers($select=CustomerAccount;$top=2)"}
+        groups = requests.get(f"{BASE_URL}/CustomerGroups", params=params).json()["value"]
+        related = groups[0]["Customers"]
+        assert 0 < len(related) <= 2 and "CustomerAccount" in related[0] and "OrganizationName" not in related[0]
+        params["$expand"] = "Customers($select=CustomerAccount)"
+        groups = requests.get(f"{BASE_URL}/CustomerGroups", params=params).json()["value"]
+        assert "C000001" in [c["CustomerAccount"] for c in groups[0]["Customers"]]
+        
+        # Writes to the expanded entity set change the expanding collection's ETag
+        etag = requests.get(f"{BASE_URL}/CustomerGroups", params=params).headers["ETag"]
+        assert requests.get(f"{BASE_URL}/CustomerGroups", params=params,
+                            headers={"If-None-Match": etag}).status_code == 304
+        created = requests.post(f"{BASE_URL}/CustomersV3", json={
+            "dataAreaId": "USMF", "OrganizationName": "Expanded Customer",
+            "CustomerGroupId": group["CustomerGroupId"]}).json()["CustomerAccount"]
+        response = requests.get(f"{BASE_URL}/CustomerGroups", params=params, headers={"If-None-Match": etag})
+        assert response.status_code == 200 and response.headers["ETag"] != etag
+        assert created in [c["CustomerAccount"] for c in response.json()["value"][0]["Customers"]]
+        
+        # Unknown navigation properties and nested options are rejected
+        assert requests.get(f"{BASE_URL}/CustomersV3", params={"$expand": "Orders"}).status_code == 400
+        
+        # There are no currency or security role entity sets to expand, so
+        # those navigation properties are rejected on every entity set
+        for url, name in ((f"{BASE_URL}/VendorsV2", "Currency"), (customer_url, "Currency"),
+                          (f"{BASE_URL}/SystemUsers", "Roles"), (f"{BASE_URL}/ExchangeRates", "Currency")):
+            response = requests.get(url, params={"$expand": name})
+            assert response.status_code == 400, url
+            assert f"has no navigation property '{name}'" in response.json()["error"]
+        assert requests.get(customer_url, params={"$expand": "CustomerGroup($filter=x)"}).status_code == 400
+        assert '<NavigationProperty Name="CustomerGroup"' in requests.get(f"{BASE_URL}/$metadata").text
+        
+        print("✅ $expand tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ $expand tests failed: {e}")
+        return False
+
+def test_search():
+    """Test $search on customer and vendor names through the search index"""
+    print("Testing $search...")
+    try:
+        customers_url = f"{BASE_URL}/CustomersV3"
+        def searched(params, url=customers_url):
+            response = requests.get(url, params={"cross-company": "true", **params})
+            assert response.status_code == 200, response.text
+            return response.json()["value"]
+        
+        # Words match token prefixes in OrganizationName and NameAlias
+        assert "C000001" in [c["CustomerAccount"] for c in searched({"$search": "adventure"})]
+        assert "C000001" in [c["CustomerAccount"] for c in searched({"$search": "AWor"})]
+        assert not searched({"$search": "adventure NOT works"})
+        
+        # Combined with $filter, $top and $select
+        data = searched({"$search": "adventure OR yonder", "$filter": "dataAreaId eq 'USMF'",
+                         "$top": "1", "$select": "CustomerAccount"})
+        assert len(data) == 1 and set(data[0]) == {"@odata.etag", "CustomerAccount"}
+        
+        # The index follows writes
+        created = requests.post(customers_url, json={
+            "dataAreaId": "USMF", "OrganizationName": "Zephyr Search Holdings", "NameAlias": "Zephyr"
+        }).json()["CustomerAccount"]
+        assert [c["CustomerAccount"] for c in searched({"$search": "\"zephyr search\""})] == [created]
+        requests.patch(f"{customers_url}(dataAreaId='USMF',CustomerAccount='{created}')",
+                       json={"OrganizationName": "Quokka Holdings", "NameAlias": "Quokka"})
+        assert not searched({"$search": "zephyr"})
+        assert int(requests.get(f"{customers_url}/$count", params={
+            "$search": "quokka holdings", "cross-company": "true"}).text) == 1
+        
+        # Vendors are searched by OrganizationName
+        vendors = searched({"$search": "\"contoso electronics\""}, f"{BASE_URL}/VendorsV2")
+        assert vendors and all("Contoso" in v["OrganizationName"] for v in vendors)
+        
+        # Invalid expressions and entity sets without searched fields are rejected
+        assert requests.get(customers_url, params={"$search": "(adventure"}).status_code == 400
+        assert requests.get(f"{BASE_URL}/CustomerGroups", params={"$search": "x"}).status_code == 400
+        
+        print("✅ $search tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ $search tests failed: {e}")
+        return False
+
+def test_spec_routes():
+    """Test routes generated from the OpenAPI spec and request body validation"""
+    print("Testing OpenAPI spec routes...")
+    try:
+        # Entity sets advertised by the service root are served
+        names = [entity_set["name"] for entity_set in requests.get(f"{BASE_URL}/data").json()["value"]]
+        assert "ReleasedProductsV2" in names and "CustomerGroups" in names
+        metadata = requests.get(f"{BASE_URL}/$metadata").text
+        assert '<EntitySet Name="ReleasedProductsV2"' in metadata
+        
+        response = requests.get(f"{BASE_URL}/ReleasedProductsV2", params={
+            "$filter": "BasePrice gt 100", "$select": "ProductNumber,BasePrice"
+        })
+        assert response.status_code == 200
+        assert all(product["BasePrice"] > 100 for product in response.json()["value"])
+        count = int(requests.get(f"{BASE_URL}/ReleasedProductsV2/$count").text)
+        assert count == len(requests.get(f"{BASE_URL}/ReleasedProductsV2").json()["value"])
+        assert requests.get(f"{BASE_URL}/CustomerGroups").status_code == 200
+        
+        # Bodies that do not match the entity type are rejected
+        response = requests.post(f"{BASE_URL}/CustomersV3", json={"dataAreaId": "USMF", "CreditLimit": "high"})
+        assert response.status_code == 400
+        assert "CreditLimit" in response.json()["error"]
+        response = requests.post(f"{BASE_URL}/VendorsV2", json=["not", "an", "object"])
+        assert response.status_code == 400
+        entity_url = f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='C000001')"
+        assert requests.patch(entity_url, json={"PersonGender": "Other"}).status_code == 400
+        assert requests.patch(entity_url, json={"PersonGender": "Female"}).status_code == 200
+        
+        print("✅ OpenAPI spec route tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ OpenAPI spec route tests failed: {e}")
+        return False
+
+def test_bulk_import():
+    """Test importing CSV and JSON Lines packages through the data management API"""
+    print("Testing bulk import...")
+    try:
+        actions = f"{BASE_URL}/DataManagementDefinitionGroups/Microsoft.Dynamics.DataEntities."
+        
+        def import_package(file_name, body):
+            blob = json.loads(requests.post(f"{actions}GetAzureWriteUrl",
+                                            json={"uniqueFileName": file_name}).json()["value"])
+            assert requests.put(blob["BlobUrl"], data=body).status_code == 201
+            response = requests.post(f"{actions}ImportFromPackage", json={
+                "packageUrl": blob["BlobUrl"], "definitionGroupId": "CustomersV3", "legalEntityId": "USMF"
+            })
+            assert response.status_code == 200
+            execution_id = response.json()["value"]
+            for _ in range(100):
+                status = requests.post(f"{actions}GetExecutionSummaryStatus",
+                                       json={"executionId": execution_id}).json()["value"]
+                if status not in ("NotRun", "Executing"):
+                    break
+                time.sleep(0.05)
+            return execution_id, status
+        
+        # A bad cell fails its row only; the company comes from legalEntityId
+        execution_id, status = import_package("customers.csv", (
+            "CustomerAccount,OrganizationName,CreditLimit,IsActive\n"
+            "IMP001,Import One,1500.5,true\n"
+            "IMP002,Import Two,abc,false\n"
+            "IMP003,Import Three,,true\n"
+        ))
+        assert status == "PartiallySucceeded"
+        summary = requests.get(f"{BASE_URL}/dmf/jobs/{execution_id}").json()
+        assert (summary["rowsRead"], summary["rowsImported"], summary["rowsFailed"]) == (3, 2, 1)
+        errors = requests.post(f"{actions}GetExecutionErrors", json={"executionId": execution_id}).json()["value"]
+        assert "CreditLimit" in errors
+        customer = requests.get(f"{BASE_URL}/CustomersV3(dataAreaId='USMF',CustomerAccount='IMP001')").json()
+        assert customer["CreditLimit"] == 1500.5 and customer["IsActive"] is True
+        
+        execution_id, status = import_package("customers.jsonl", "\n".join(json.dumps(row) for row in (
+            {"dataAreaId": "USMF", "CustomerAccount": "IMP004", "OrganizationName": "Import Four"},
+            {"dataAreaId": "USMF", "CustomerAccount": "IMP001", "OrganizationName": "Import One Renamed"}
+        )))
+        assert status == "Succeeded"
+        response = requests.get(f"{BASE_URL}/CustomersV3", params={
+            "$filter": "startswith(CustomerAccount,'IMP')", "$select": "CustomerAccount,OrganizationName"
+        })
+        names = {c["CustomerAccount"]: c["OrganizationName"] for c in response.json()["value"]}
+        assert names == {"IMP001": "Import One Renamed", "IMP003": "Import Three", "IMP004": "Import Four"}
+        
+        assert requests.post(f"{actions}ImportFromPackage", json={
+            "packageUrl": f"{BASE_URL}/dmf/packages/missing", "definitionGroupId": "CustomersV3"
+        }).status_code == 400
+
+        # Execution ids that are not strings are rejected rather than looked up
+        blob = json.loads(requests.post(f"{actions}GetAzureWriteUrl",
+                                        json={"uniqueFileName": "ids.csv"}).json()["value"])
+        assert requests.put(blob["BlobUrl"], data="CustomerAccount\nIMP005\n").status_code == 201
+        for execution_id in (["IMP"], {"id": 1}, 5):
+            response = requests.post(f"{actions}ImportFromPackage", json={
+                "packageUrl": blob["BlobUrl"], "definitionGroupId": "CustomersV3", "executionId": execution_id
+            })
+            assert response.status_code == 400 and "executionId" in response.json()["error"]
+            for action in ("GetExecutionSummaryStatus", "GetExecutionErrors"):
+                assert requests.post(f"{actions}{action}", json={"executionId": execution_id}).status_code == 400
+
+        print("✅ Bulk import tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Bulk import tests failed: {e}")
+        return False
+
+def test_response_cache():
+    """Test cached responses are reused and invalidated by writes"""
+    print("Testing response cache...")
+    try:
+        # Static endpoints keep the same ETag and revalidate to 304
+        first = requests.get(f"{BASE_URL}/$metadata")
+        second = requests.get(f"{BASE_URL}/$metadata")
+        assert first.text == second.text
+        assert first.headers["ETag"] == second.headers["ETag"]
+        assert requests.get(f"{BASE_URL}/data", headers={"If-None-Match": "*"}).status_code == 304
+        
+        # Query options in a different order share the cached response
+        first = requests.get(f"{BASE_URL}/VendorsV2?$top=5&$select=VendorAccount")
+        second = requests.get(f"{BASE_URL}/VendorsV2?$select=VendorAccount&$top=5")
+        assert first.json() == second.json()
+        assert first.headers["ETag"] == second.headers["ETag"]
+        
+        # A write invalidates the cached collection
+        response = requests.post(f"{BASE_URL}/VendorsV2", json={"dataAreaId": "USMF", "OrganizationName": "Cache Co"})
+        assert response.status_code == 201
+        account = response.json()["VendorAccount"]
+        response = requests.get(f"{BASE_URL}/VendorsV2?$top=5&$select=VendorAccount")
+        assert response.headers["ETag"] != first.headers["ETag"]
+        response = requests.get(f"{BASE_URL}/VendorsV2", params={"$select": "VendorAccount", "$top": "10000"})
+        assert account in [v["VendorAccount"] for v in response.json()["value"]]
+        
+        print("✅ Response cache tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Response cache tests failed: {e}")
+        return False
+
+def test_service_protection():
+    """Test the throttling and latency building blocks"""
+    print("Testing service protection...")
+    try:
+        import random
+        from throttling import Latency, TokenBucket
+        
+        # A bucket allows its burst, then asks the client to wait
+        bucket = TokenBucket(rate=1, burst=3)
+        assert [bucket.take() for _ in range(3)] == [0, 0, 0]
+        assert 0 < bucket.take() <= 1
+        
+        # Latency distributions stay within their configured range
+        rng = random.Random(1)
+        assert Latency({"distribution": "fixed", "ms": 20, "per_row_ms": 1}, rng).sample(10) == 0.03
+        histogram = Latency({"distribution": "histogram", "buckets": [[10, 1], [100, 1]]}, rng)
+        assert all(0 <= histogram.sample() <= 0.1 for _ in range(100))
+        normal = Latency({"distribution": "normal", "mean_ms": 5, "stddev_ms": 50}, rng)
+        assert all(normal.sample() >= 0 for _ in range(100))
+        
+        print("✅ Service protection tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Service protection tests failed: {e}")
+        return False
+
+def test_metrics():
+    """Test the Prometheus metrics endpoint"""
+    print("Testing metrics endpoint...")
+    try:
+        from metrics import LatencyHistogram
+        
+        requests.get(f"{BASE_URL}/health")
+        response = requests.get(f"{BASE_URL}/metrics")
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/plain")
+        text = response.text
+        assert 'mockserver_http_requests_total{route="/health",method="GET",status="200"}' in text
+        assert 'mockserver_http_request_duration_seconds{route="/health",method="GET",quantile="0.99"}' in text
+        assert 'mockserver_store_entities{entity_set="CustomersV3"}' in text
+        
+        # Quantiles are accurate to a few percent
+        histogram = LatencyHistogram()
+        for micros in range(1, 100001):
+            histogram.record(micros)
+        for q, expected in ((0.5, 50000), (0.9, 90000), (0.99, 99000), (0.999, 99900)):
+            assert abs(histogram.quantile(q) - expected) / expected < 0.03
+        
+        print("✅ Metrics tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Metrics tests failed: {e}")
+        return False
+
+def test_columnar_store():
+    """Test that columnar entity views keep reading the entity they were made for"""
+    print("Testing columnar store...")
+    try:
+        from columnar import ColumnarEntityStore
+        
+        store = ColumnarEntityStore("CustomersV3", {"dataAreaId": "category", "CreditLimit": "float"},
+                                    ("dataAreaId",), ("CreditLimit",))
+        store._rows.min_compaction = 4
+        for i in range(10):
+            store[f"USMF_C{i}"] = {"dataAreaId": "USMF", "CustomerAccount": f"C{i}", "CreditLimit": float(i)}
+        
+        # Views handed out before a delete, an update and a compaction, as a
+        # streaming response holds them, still read their own entity
+        deleted, updated = store["USMF_C0"], store["USMF_C1"]
+        del store["USMF_C0"]
+        store["USMF_C1"] = {"dataAreaId": "USMF", "CustomerAccount": "C1", "CreditLimit": 100.0}
+        store["USMF_C10"] = {"dataAreaId": "USMF", "CustomerAccount": "C10", "CreditLimit": 10.0}
+        assert dict(deleted) == {"dataAreaId": "USMF", "CustomerAccount": "C0", "CreditLimit": 0.0}
+        assert updated["CreditLimit"] == 1.0
+        entries, _ = store.query(orderby=[("CreditLimit", False)])
+        page = list(entries)
+        for i in range(2, 12):
+            store[f"USMF_C{i}"] = {"dataAreaId": "USMF", "CustomerAccount": f"C{i}", "CreditLimit": -1.0}
+        assert store._rows.row_count < 30
+        assert [row["CreditLimit"] for _, row in page] == [2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0, 100.0]
+        assert store["USMF_C1"]["CreditLimit"] == 100.0 and store["USMF_C5"]["CreditLimit"] == -1.0
+        assert len(store) == 11 and "USMF_C0" not in store
+        
+        print("✅ Columnar store tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Columnar store tests failed: {e}")
+        return False
+
+def test_snapshot():
+    """Test snapshot persistence and the write log"""
+    print("Testing snapshots...")
+    try:
+        import os
+        import tempfile
+        from store import EntityStore
+        from rates import ExchangeRateStore
+        from snapshot import save_snapshot, load_snapshot, WriteLog
+        
+        # Without --snapshot there is nowhere to save to
+        response = requests.post(f"{BASE_URL}/$snapshot")
+        assert response.status_code == 409
+        
+        def make_store():
+            return EntityStore("CustomersV3", ("dataAreaId",), ("CreditLimit",))
+        
+        original = make_store()
+        for i in range(100):
+            original[f"USMF_C{i:06d}"] = {"dataAreaId": "USMF", "CustomerAccount": f"C{i:06d}", "CreditLimit": float(i % 7)}
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "test.snap")
+        save_snapshot(path, {"CustomersV3": original}, meta={"entity_version": 5})
+        
+        restored = make_store()
+        assert load_snapshot(path, {"CustomersV3": restored}) == {"entity_version": 5}
+        assert len(restored) == 100
+        assert restored["USMF_C000042"]["CreditLimit"] == 0.0
+        
+        # Writes to a loaded store are logged and replayed on top of the snapshot
+        log = WriteLog(os.path.join(directory, "test.log"))
+        restored.write_log = log
+        restored["USMF_C000100"] = {"dataAreaId": "USMF", "CustomerAccount": "C000100", "CreditLimit": 99.0}
+        with restored.lock:
+            restored._delete("USMF_C000000")
+        log.close()
+        ordered = list(restored.query(orderby=[("CreditLimit", True)])[0])
+        assert ordered[0][0] == "USMF_C000100" and len(ordered) == 100
+        
+        replayed = make_store()
+        load_snapshot(path, {"CustomersV3": replayed})
+        assert WriteLog.replay(log.path, {"CustomersV3": replayed}) == 2
+        assert "USMF_C000000" not in replayed
+        assert [key for key, _ in replayed.query(orderby=[("CreditLimit", True)])[0]] == [key for key, _ in ordered]
+
+        # Exchange rates written after the snapshot are logged and replayed too
+        rates = ExchangeRateStore()
+        rates.extend([{"RateTypeId": "SPOT", "FromCurrencyCode": "EUR", "ToCurrencyCode": "USD",
+                       "ExchangeRateValue": 1.1, "ValidFromDate": "2024-01-01"}])
+        save_snapshot(path, {}, {"ExchangeRates": rates})
+        log = WriteLog(os.path.join(directory, "rates.log"))
+        rates.write_log = log
+        rates.add({"RateTypeId": "SPOT", "FromCurrencyCode": "EUR", "ToCurrencyCode": "USD",
+                   "ExchangeRateValue": 1.2, "ValidFromDate": "2024-02-01"})
+        log.close()
+        replayed_rates = ExchangeRateStore()
+        load_snapshot(path, {}, {"ExchangeRates": replayed_rates})
+        assert len(replayed_rates) == 1
+        assert WriteLog.replay(log.path, {"ExchangeRates": replayed_rates}) == 1
+        assert list(replayed_rates) == list(rates)
+        assert replayed_rates.as_of("EUR", "USD", "2024-03-01", "SPOT")["ExchangeRateValue"] == 1.2
+
+        print("✅ Snapshot tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Snapshot tests failed: {e}")
+        return False
+
 def test_exchange_rates():
     """Test exchange rates endpoint"""
     print("Testing exchange rates...")
@@ -149,12 +987,105 @@ def test_exchange_rates():
         assert ("USD", "EUR") in currency_pairs
         assert ("USD", "GBP") in currency_pairs
         
+        # As-of query: the latest rate valid on a date
+        response = requests.get(f"{BASE_URL}/ExchangeRates", params={
+            "$filter": "FromCurrencyCode eq 'USD' and ToCurrencyCode eq 'EUR' and ValidFromDate le 2025-06-30T00:00:00Z",
+            "$orderby": "ValidFromDate desc", "$top": "1"
+        })
+        assert response.status_code == 200
+        latest = response.json()["value"]
+        assert len(latest) == 1 and latest[0]["ValidFromDate"] <= "2025-06-30T00:00:00Z"
+        assert requests.get(f"{BASE_URL}/ExchangeRates", params={"$filter": "ValidFromDate le 1990-01-01"}
+                            ).json()["value"] == []
+
+        # Date literals are compared as UTC instants: a date stands for
+        # midnight UTC, and an offset is applied, whether the dates are
+        # bisected or, with other terms, tested by the predicate
+        pair = "FromCurrencyCode eq 'USD' and ToCurrencyCode eq 'GBP' and RateTypeId eq 'SPOT'"
+        for condition, expected in (("ValidFromDate le 2025-01-01", 1),
+                                    ("ValidFromDate eq 2025-01-01", 1),
+                                    ("ValidFromDate lt 2025-01-01", 0),
+                                    ("ValidFromDate le 2025-01-01T01:00:00+02:00", 0),
+                                    ("ValidFromDate ge 2025-01-01T02:00:00+02:00", 1)):
+            for extra in ("", " and ExchangeRateValue gt 0"):
+                response = requests.get(f"{BASE_URL}/ExchangeRates",
+                                        params={"$filter": f"{pair} and {condition}{extra}"})
+                assert response.status_code == 200
+                assert response.json()["@odata.count"] == expected, condition + extra
+
+        # Cross rates are derived through USD and follow newly written rates
+        cross = requests.get(f"{BASE_URL}/fx/rate", params={"from": "GBP", "to": "EUR", "date": "2030-01-01"}).json()
+        assert cross["Source"] == "cross" and cross["ExchangeRateValue"] > 0
+        response = requests.post(f"{BASE_URL}/ExchangeRates", json={
+            "FromCurrencyCode": "USD", "ToCurrencyCode": "EUR", "ExchangeRateValue": 2.0,
+            "ValidFromDate": "2029-12-31T00:00:00Z", "RateTypeId": "SPOT"
+        })
+        assert response.status_code == 201
+        gbp_usd = requests.get(f"{BASE_URL}/fx/rate", params={"from": "GBP", "to": "USD", "date": "2030-01-01"}).json()
+        updated = requests.get(f"{BASE_URL}/fx/rate", params={"from": "GBP", "to": "EUR", "date": "2030-01-01"}).json()
+        assert abs(updated["ExchangeRateValue"] - gbp_usd["ExchangeRateValue"] * 2.0) < 1e-9
+        assert requests.get(f"{BASE_URL}/fx/rate", params={"from": "USD", "to": "XXX"}).status_code == 404
+        assert requests.get(f"{BASE_URL}/fx/rate", params={"from": "USD", "to": "EUR", "date": "soon"}).status_code == 400
+        
         print("✅ Exchange rates test passed")
         return True
     except Exception as e:
         print(f"❌ Exchange rates test failed: {e}")
         return False
 
+def test_traffic_capture():
+    """Test capturing traffic to a log and replaying it"""
+    print("Testing traffic capture and replay...")
+    try:
+        import os
+        import tempfile
+        from flask import Flask, jsonify
+        from capture import TrafficCapture, read_capture
+        import replay_traffic
+        
+        # Capture a few requests served by a stand-in app
+        app = Flask(__name__)
+        app.add_url_rule("/CustomersV3", "list", lambda: jsonify(value=[]))
+        app.add_url_rule("/VendorsV2", "create", lambda: (jsonify(created=True), 201), methods=["POST"])
+        app.add_url_rule("/health", "health", lambda: "ok")
+        capture = TrafficCapture()
+        capture.init_app(app)
+        path = os.path.join(tempfile.mkdtemp(), "capture.jsonl")
+        capture.start(path)
+        client = app.test_client()
+        # A request is captured once its response has been sent and closed
+        client.get("/CustomersV3?$top=2&$filter=IsActive eq true", headers={"Authorization": "Bearer secret"}).close()
+        client.post("/VendorsV2", json={"dataAreaId": "USMF", "OrganizationName": "Replayed Vendor"}).close()
+        client.get("/health").close()
+        capture.close()
+        
+        records = read_capture(path)
+        assert [(record["method"], record["path"], record["status"]) for record in records] == [
+            ("GET", "/CustomersV3", 200), ("POST", "/VendorsV2", 201)]
+        assert records[0]["query"].startswith("$top=2&$filter=IsActive")
+        assert "Authorization" not in records[0]["headers"]
+        assert json.loads(records[1]["body"])["OrganizationName"] == "Replayed Vendor"
+        assert records[0]["time"] <= records[1]["time"] and records[1]["durationMs"] >= 0
+        assert capture.written == 2 and capture.dropped == 0
+        
+        # Replay them against the server; a torn last line is skipped
+        with open(path, "a") as log:
+            log.write('{"time": 9.0, "method": "GET"')
+        replay_traffic.BASE_URL = BASE_URL
+        recorder = replay_traffic.DriftRecorder()
+        replay_traffic.replay_scheduled(read_capture(path), 100, 2, recorder)
+        summary = recorder.summary(1.0)
+        assert summary["requests"] == 2 and summary["errors"] == 0
+        assert summary["status_mismatches"] == 0
+        assert set(summary["routes"]) == {"GET /CustomersV3", "POST /VendorsV2"}
+        assert "p99_ms" in summary["drift"]
+        
+        print("✅ Traffic capture tests passed")
+        return True
+    except Exception as e:
+        print(f"❌ Traffic capture tests failed: {e}")
+        return False
+
 def test_system_users():
     """Test system users endpoints"""
     print("Testing system users...")
@@ -219,6 +1150,27 @@ def run_all_tests():
         test_metadata,
         test_vendors,
         test_customers,
+        test_filters,
+        test_orderby,
+        test_paging,
+        test_streaming,
+        test_compression,
+        test_batch,
+        test_concurrent_writes,
+        test_conditional_requests,
+        test_delta_queries,
+        test_cross_company,
+        test_counts,
+        test_expand,
+        test_search,
+        test_spec_routes,
+        test_bulk_import,
+        test_response_cache,
+        test_service_protection,
+        test_metrics,
+        test_traffic_capture,
+        test_columnar_store,
+        test_snapshot,
         test_exchange_rates,
         test_system_users
     ]
@@ -0,0 +1,185 @@
+"""
+Service protection emulation for the Dynamics 365 Finance mock server.
+
+Dynamics 365 Finance protects itself with priority-based throttling: clients
+that send too many requests, or too many at once, get 429 Too Many Requests
+with a Retry-After header, and response times vary with the entity and the
+page size. ServiceProtection reproduces this from the "service_protection"
+section of config.json so client retry, circuit breaker and pool settings
+can be tuned against realistic limits.
+
+Each rule matches requests by path regex, and optionally by method and
+client, and may set:
+
+- rate_limit: a token bucket per client, {"requests_per_second", "burst"}
+- max_concurrency: requests of this rule in flight at once, across clients
+- latency: a delay drawn from a distribution, plus "per_row_ms" for every
+  entity returned
+
+The first matching rule applies, so rules for specific (e.g. high-priority)
+clients go before general ones. Clients are told apart by the client_header
+request header, falling back to the remote address.
+"""
+
+import math
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from itertools import accumulate
+
+from flask import g, jsonify, request
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at rate tokens per second"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        """Take one token, returning 0 on success or the seconds until one is available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class Latency:
+    """
+    Delay distribution of a rule.
+
+    distribution is "fixed" ({"ms"}), "normal" ({"mean_ms", "stddev_ms"},
+    never negative) or "histogram" ({"buckets": [[upper_ms, weight], ...]},
+    sampled uniformly within the chosen bucket), so measured production
+    latencies can be replayed.
+    """
+
+    def __init__(self, settings, rng):
+        self.rng = rng
+        self.distribution = settings.get("distribution", "fixed")
+        self.per_row_ms = settings.get("per_row_ms", 0)
+        if self.distribution == "fixed":
+            self.ms = settings.get("ms", 0)
+        elif self.distribution == "normal":
+            self.mean_ms = settings.get("mean_ms", 0)
+            self.stddev_ms = settings.get("stddev_ms", 0)
+        elif self.distribution == "histogram":
+            buckets = sorted(settings["buckets"])
+            self.bounds = [upper for upper, _ in buckets]
+            self.cumulative = list(accumulate(weight for _, weight in buckets))
+        else:
+            raise ValueError(f"unknown latency distribution {self.distribution!r}")
+
+    def sample(self, rows=0):
+        """Return a delay in seconds for a response of rows entities"""
+        if self.distribution == "fixed":
+            ms = self.ms
+        elif self.distribution == "normal":
+            ms = max(0.0, self.rng.gauss(self.mean_ms, self.stddev_ms))
+        else:
+            position = bisect_left(self.cumulative, self.rng.random() * self.cumulative[-1])
+            lower = self.bounds[position - 1] if position else 0
+            ms = self.rng.uniform(lower, self.bounds[position])
+        return (ms + self.per_row_ms * rows) / 1000
+
+
+class Rule:
+    """One service protection rule: which requests it matches and its limits"""
+
+    def __init__(self, settings, rng):
+        self.path = re.compile(settings.get("path", ".*"))
+        self.methods = {method.upper() for method in settings.get("methods", [])}
+        self.clients = set(settings.get("clients", []))
+        rate_limit = settings.get("rate_limit")
+        self.rate = rate_limit["requests_per_second"] if rate_limit else None
+        self.burst = rate_limit.get("burst", self.rate) if rate_limit else None
+        self.max_concurrency = settings.get("max_concurrency")
+        self.slots = threading.BoundedSemaphore(self.max_concurrency) if self.max_concurrency else None
+        self.latency = Latency(settings["latency"], rng) if settings.get("latency") else None
+        self.buckets = {}
+
+    def matches(self, method, path, client):
+        return (self.path.match(path) is not None
+                and (not self.methods or method in self.methods)
+                and (not self.clients or client in self.clients))
+
+
+class ServiceProtection:
+    """Throttles and delays requests of a Flask app according to configured rules"""
+
+    def __init__(self, settings=None):
+        settings = settings or {}
+        self.enabled = settings.get("enabled", False)
+        self.client_header = settings.get("client_header", "Authorization")
+        rng = random.Random(settings.get("seed"))
+        self.rules = [Rule(rule, rng) for rule in settings.get("rules", [])]
+        self.throttled = {"rate_limit": 0, "concurrency": 0}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.before_request(self.before_request)
+        app.after_request(self.after_request)
+        app.teardown_request(self.teardown_request)
+
+    def client(self):
+        return request.headers.get(self.client_header) or request.remote_addr or "unknown"
+
+    def rule_for(self, method, path, client):
+        return next((rule for rule in self.rules if rule.matches(method, path, client)), None)
+
+    def _too_many_requests(self, reason, retry_after, message):
+        with self._lock:
+            self.throttled[reason] += 1
+        response = jsonify({"error": message})
+        response.status_code = 429
+        response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+        return response
+
+    def before_request(self):
+        # $batch sub-requests are covered by the limits of the batch itself
+        if not self.enabled or request.environ.get("mockserver.batch_part"):
+            return None
+        client = self.client()
+        rule = self.rule_for(request.method, request.path, client)
+        if rule is None:
+            return None
+
+        if rule.rate is not None:
+            with self._lock:
+                bucket = rule.buckets.get(client)
+                if bucket is None:
+                    bucket = rule.buckets[client] = TokenBucket(rule.rate, rule.burst)
+                wait = bucket.take()
+            if wait:
+                return self._too_many_requests(
+                    "rate_limit", wait,
+                    f"Number of requests exceeded the limit of {rule.rate:g} per second, retry later")
+
+        if rule.slots is not None:
+            if not rule.slots.acquire(blocking=False):
+                return self._too_many_requests(
+                    "concurrency", 1,
+                    f"Number of concurrent requests exceeded the limit of {rule.max_concurrency}")
+            g.service_protection_slot = rule.slots
+        g.service_protection_rule = rule
+        return None
+
+    def after_request(self, response):
+        # Delay while still holding the concurrency slot, as a slow server would
+        rule = g.pop("service_protection_rule", None)
+        if rule is not None and rule.latency is not None:
+            time.sleep(rule.latency.sample(g.get("result_rows", 0)))
+        return response
+
+    def teardown_request(self, exc=None):
+        slots = g.pop("service_protection_slot", None)
+        if slots is not None:
+            slots.release()